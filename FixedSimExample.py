@@ -39,3 +39,4 @@ if __name__ == '__main__':
         fmodel.updateVeh()
 
     fmodel.destroy()
+    planner.close()
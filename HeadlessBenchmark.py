@@ -0,0 +1,69 @@
+"""
+Simulation steps per second of the ego tracking model, headless and with
+the GUI.
+
+    python HeadlessBenchmark.py              # headless and GUI
+    python HeadlessBenchmark.py --headless   # headless only, e.g. on servers
+"""
+import argparse
+import time
+
+from simModel.egoTracking.model import Model
+from trafficManager.traffic_manager import TrafficManager
+
+import logger
+
+log = logger.setup_app_level_logger(file_name="app_debug.log", level="INFO")
+
+
+def benchmark(net_file, rou_file, ego_veh_id, steps, headless):
+    """Steps per second of a run of at most the given number of steps."""
+    model = Model(
+        ego_veh_id,
+        net_file,
+        rou_file,
+        dataBase="headlessBenchmark.db" if headless else "guiBenchmark.db",
+        simNote="headless benchmark." if headless else "GUI benchmark.",
+        headless=headless,
+    )
+    model.start()
+    planner = TrafficManager(model)
+
+    start = time.time()
+    while not model.tpEnd and model.timeStep < steps:
+        model.moveStep()
+        if model.timeStep % 5 == 0:
+            roadgraph, vehicles = model.exportSce()
+            if model.tpStart and roadgraph:
+                trajectories = planner.plan(
+                    model.timeStep * 0.1, roadgraph, vehicles
+                )
+                model.setTrajectories(trajectories)
+            else:
+                model.ego.exitControlMode()
+        model.updateVeh()
+    wall_time = time.time() - start
+
+    model.destroy()
+    planner.close()
+    return model.timeStep / wall_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--net", default="networkFiles/CarlaTown05/Town05.net.xml")
+    parser.add_argument(
+        "--rou",
+        default="networkFiles/CarlaTown05/carlavtypes.rou.xml,networkFiles/CarlaTown05/Town05.rou.xml",
+    )
+    parser.add_argument("--ego", default="30")
+    parser.add_argument("--steps", type=int, default=1500)
+    parser.add_argument("--headless", action="store_true",
+                        help="only run the headless benchmark")
+    args = parser.parse_args()
+
+    results = {"headless": benchmark(args.net, args.rou, args.ego, args.steps, True)}
+    if not args.headless:
+        results["GUI"] = benchmark(args.net, args.rou, args.ego, args.steps, False)
+    for mode, steps_per_second in results.items():
+        print("{}: {:.1f} steps/s".format(mode, steps_per_second))
@@ -1,3 +1,9 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
 from simModel.egoTracking.model import Model
 from trafficManager.traffic_manager import TrafficManager
 
@@ -53,6 +59,9 @@ def run_model(
     SUMOGUI=0,
     sim_note="example simulation, LimSim-v-0.2.0.",
     carla_cosim=False,
+    port=None,
+    seed=None,
+    headless=False,
 ):
     model = Model(
         ego_veh_id,
@@ -62,24 +71,101 @@ def run_model(
         SUMOGUI=SUMOGUI,
         simNote=sim_note,
         carla_cosim=carla_cosim,
+        port=port,
+        seed=seed,
+        headless=headless,
     )
     model.start()
     planner = TrafficManager(model)
 
-    while not model.tpEnd:
-        model.moveStep()
-        if model.timeStep % 5 == 0:
-            roadgraph, vehicles = model.exportSce()
-            if model.tpStart and roadgraph:
-                trajectories = planner.plan(
-                    model.timeStep * 0.1, roadgraph, vehicles
-                )
-                model.setTrajectories(trajectories)
-            else:
-                model.ego.exitControlMode()
-        model.updateVeh()
-
-    model.destroy()
+    # the planner's worker processes are stopped even if the run fails, as
+    # the processes of run_scenarios run one job after another
+    try:
+        while not model.tpEnd:
+            model.moveStep()
+            if model.timeStep % 5 == 0:
+                roadgraph, vehicles = model.exportSce()
+                if model.tpStart and roadgraph:
+                    trajectories = planner.plan(
+                        model.timeStep * 0.1, roadgraph, vehicles
+                    )
+                    model.setTrajectories(trajectories)
+                else:
+                    model.ego.exitControlMode()
+            model.updateVeh()
+
+        model.destroy()
+    finally:
+        planner.close()
+    # simulated time [s]
+    return model.timeStep * 0.1
+
+
+def run_job(index, net_file, rou_file, ego_veh_id, seed):
+    """Run one job of run_scenarios in its own process and database, with
+    SUMO and the planner seeded by the job's seed."""
+    random.seed(seed)
+    np.random.seed(seed)
+    data_base = "scenario{}_ego{}_seed{}.db".format(index, ego_veh_id, seed)
+    start = time.time()
+    try:
+        sim_time = run_model(
+            net_file,
+            rou_file,
+            ego_veh_id=ego_veh_id,
+            data_base=data_base,
+            sim_note="scenario runner job {}.".format(index),
+            seed=seed,
+            headless=True,
+        )
+    except Exception as e:
+        # the exceptions of libsumo can't be pickled back to the runner
+        error = "{}: {}".format(type(e).__name__, e)
+        log.error("Scenario job %d failed: %s", index, error)
+        return {"job": index, "data_base": data_base, "error": error}
+    return {
+        "job": index,
+        "data_base": data_base,
+        "wall_time": time.time() - start,
+        "sim_time": sim_time,
+    }
+
+
+def run_scenarios(jobs, max_workers=None):
+    """Run (net_file, rou_file, ego_veh_id, seed) jobs concurrently, each
+    in a separate headless process with its own SUMO instance, TraCI
+    connection and database.
+
+    Args:
+        jobs (list): the (net_file, rou_file, ego_veh_id, seed) jobs
+        max_workers (int, optional): number of processes. Defaults to None,
+            which uses one process per CPU.
+
+    Returns:
+        list: a summary of each job, with its database, wall time [s] and
+            simulated time [s], or the error it failed with
+    """
+    summary = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(run_job, index, *job) for index, job in enumerate(jobs)
+        ]
+        for index, future in enumerate(futures):
+            try:
+                summary.append(future.result())
+            except Exception as e:
+                # the process of the job died
+                error = "{}: {}".format(type(e).__name__, e)
+                log.error("Scenario job %d failed: %s", index, error)
+                summary.append({"job": index, "error": error})
+
+    for job in summary:
+        if "error" in job:
+            print("job {}: failed, {}".format(job["job"], job["error"]))
+        else:
+            print("job {}: {}, wall time {:.1f} s, simulated time {:.1f} s".format(
+                job["job"], job["data_base"], job["wall_time"], job["sim_time"]))
+    return summary
 
 
 if __name__ == "__main__":
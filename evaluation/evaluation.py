@@ -165,7 +165,7 @@ class RealTimeEvaluation():
         if self.ego.lanePos < self.ego.width / 2:
             return 0.0
         _, d = self.current_lane.course_spline.cartesian_to_frenet1D(
-            self.ego.x, self.ego.y)
+            self.ego.x, self.ego.y, self.ego.lanePos)
         return d**2
 
     def normalize_result(self) -> np.ndarray:
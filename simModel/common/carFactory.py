@@ -4,13 +4,13 @@ from collections import deque
 from math import cos, pi, sin
 from collections import defaultdict
 
-import dearpygui.dearpygui as dpg
+from utils.lazy_import import dpg
 from rich import print
 import numpy as np
-import traci
-from traci import TraCIException
 
 from simModel.common.networkBuild import NetworkBuild, Rebuild
+from simModel.common.simBackend import traci
+from simModel.common.controlBuffer import controlBuffer
 from utils.simBase import CoordTF, deduceEdge
 from utils.trajectory import Trajectory
 from utils.roadgraph import NormalLane, JunctionLane
@@ -231,6 +231,7 @@ class Vehicle:
 
     # entry control mode and control vehicles
     # used for real-time simulation mode.
+    # the commands are buffered and sent by Model.updateVeh.
     def controlSelf(
         self, centerx: float, centery: float,
         yaw: float, speed: float, accel: float
@@ -239,49 +240,36 @@ class Vehicle:
         y = centery + (self.length / 2) * sin(yaw)
         # x, y = centerx, centery
         angle = (pi / 2 - yaw) * 180 / pi
-        if self._iscontroled:
-            traci.vehicle.moveToXY(self.id, '', -1, x, y,
-                                   angle=angle, keepRoute=2)
-            traci.vehicle.setSpeed(self.id, speed)
-            if accel >= 0:
-                traci.vehicle.setAccel(self.id, accel)
-                traci.vehicle.setDecel(self.id, self.maxDecel)
-            else:
-                traci.vehicle.setAccel(self.id, self.maxAccel)
-                traci.vehicle.setDecel(self.id, -accel)
+        if not self._iscontroled:
+            controlBuffer.add(self.id, 'setLaneChangeMode', 0)
+            controlBuffer.add(self.id, 'setSpeedMode', 0)
+        controlBuffer.add(self.id, 'moveToXY', '', -1, x, y,
+                          angle=angle, keepRoute=2)
+        controlBuffer.add(self.id, 'setSpeed', speed)
+        if accel >= 0:
+            controlBuffer.add(self.id, 'setAccel', accel)
+            controlBuffer.add(self.id, 'setDecel', self.maxDecel)
         else:
-            traci.vehicle.setLaneChangeMode(self.id, 0)
-            traci.vehicle.setSpeedMode(self.id, 0)
-            traci.vehicle.moveToXY(self.id, '', -1, x, y,
-                                   angle=angle, keepRoute=2)
-            traci.vehicle.setSpeed(self.id, speed)
-            if accel >= 0:
-                traci.vehicle.setAccel(self.id, accel)
-                traci.vehicle.setDecel(self.id, self.maxDecel)
-            else:
-                traci.vehicle.setAccel(self.id, self.maxAccel)
-                traci.vehicle.setDecel(self.id, -accel)
-            self._iscontroled = 1
+            controlBuffer.add(self.id, 'setAccel', self.maxAccel)
+            controlBuffer.add(self.id, 'setDecel', -accel)
+        self._iscontroled = 1
 
     # exit control mode and set self.iscontroled = 0
     def exitControlMode(self):
         if self._iscontroled:
-            try:
-                traci.vehicle.setLaneChangeMode(self.id, 0b101010101010)
-                traci.vehicle.setSpeedMode(self.id, 0b010111)
-                traci.vehicle.setSpeed(self.id, 20)
-            except TraCIException:
-                pass
+            controlBuffer.add(self.id, 'setLaneChangeMode', 0b101010101010)
+            controlBuffer.add(self.id, 'setSpeedMode', 0b010111)
+            controlBuffer.add(self.id, 'setSpeed', 20)
             self._iscontroled = 0
 
     def replayUpdate(self):
         # if plannedTrajectory and dbTrajectory are both empty, return 'Failure',
         # else, return 'Success'.
-        if self.plannedTrajectory and self.plannedTrajectory.xQueue:
+        if self.plannedTrajectory:
             x, y, yaw, speed, accel, laneID, lanePos, _ = \
                 self.plannedTrajectory.pop_last_state_r()
             self._iscontroled = 1
-        elif self.dbTrajectory and self.dbTrajectory.xQueue:
+        elif self.dbTrajectory:
             x, y, yaw, speed, accel, laneID, lanePos, routeIdx = \
                 self.dbTrajectory.pop_last_state_r()
         else:
@@ -353,25 +341,23 @@ class Vehicle:
         )
 
     def plotTrajectory(self, node: dpg.node, ex: float, ey: float, ctf: CoordTF):
-        if self.plannedTrajectory and self.plannedTrajectory.xQueue:
+        if self.plannedTrajectory:
             tps = [
-                ctf.dpgCoord(
-                    self.plannedTrajectory.xQueue[i],
-                    self.plannedTrajectory.yQueue[i],
-                    ex, ey
-                ) for i in range(len(self.plannedTrajectory.xQueue))
+                ctf.dpgCoord(x, y, ex, ey) for x, y in zip(
+                    self.plannedTrajectory.column("x").tolist(),
+                    self.plannedTrajectory.column("y").tolist()
+                )
             ]
             dpg.draw_polyline(tps, color=(205, 132, 241),
                               parent=node, thickness=2)
 
     def plotDBTrajectory(self, node: dpg.node, ex: float, ey: float, ctf: CoordTF):
-        if self.dbTrajectory and self.dbTrajectory.xQueue:
+        if self.dbTrajectory:
             tps = [
-                ctf.dpgCoord(
-                    self.dbTrajectory.xQueue[i],
-                    self.dbTrajectory.yQueue[i],
-                    ex, ey
-                ) for i in range(len(self.dbTrajectory.xQueue))
+                ctf.dpgCoord(x, y, ex, ey) for x, y in zip(
+                    self.dbTrajectory.column("x").tolist(),
+                    self.dbTrajectory.column("y").tolist()
+                )
             ]
             dpg.draw_polyline(tps, color=(225, 112, 85),
                               parent=node, thickness=2)
@@ -392,9 +378,16 @@ class Vehicle:
     def lanePosAppend(self, lanePos: float):
         self.lanePosQ.append(lanePos - self.length / 2)
 
-    def laneAppend(self, nb: NetworkBuild):
-        traciLaneID = traci.vehicle.getLaneID(self.id)
-        traciLanePos = traci.vehicle.getLanePosition(self.id)
+    # traciLaneID and traciLanePos can be passed in when they are already
+    # known, e.g. from the subscription results.
+    def laneAppend(
+        self, nb: NetworkBuild,
+        traciLaneID: str = None, traciLanePos: float = None
+    ):
+        if traciLaneID is None:
+            traciLaneID = traci.vehicle.getLaneID(self.id)
+        if traciLanePos is None:
+            traciLanePos = traci.vehicle.getLanePosition(self.id)
         routeIndex = self.routeIdxQ[-1]
         if routeIndex >= 1:
             currEdge = self.routes[routeIndex]
@@ -0,0 +1,81 @@
+from simModel.common.simBackend import traci, TraCIException
+
+import logger
+
+logging = logger.get_logger(__name__)
+
+
+class ControlBuffer:
+    '''
+        Collects the control commands sent to the vehicles during a
+        simulation step and sends them together in flush(), which the
+        models call once per step before the next simulation step.
+        A setting command (accel and decel limits, lane change and speed
+        modes) whose value is already the vehicle's setting is dropped,
+        because these settings are kept by SUMO until they are set again.
+    '''
+    SETTINGS = {'setAccel', 'setDecel', 'setLaneChangeMode', 'setSpeedMode'}
+
+    def __init__(self) -> None:
+        self.reset()
+
+    # forget the commands and settings of the last simulation, called when
+    # a new simulation starts.
+    def reset(self):
+        # vehicle id -> [(command, args, kwargs), ...] of the current step
+        self.commands: dict[str, list[tuple[str, tuple, dict]]] = {}
+        # (vehicle id, command) -> args of the setting in effect
+        self.settings: dict[tuple[str, str], tuple] = {}
+        # command counts of the last flush and of the whole simulation
+        self.sent = 0
+        self.dropped = 0
+        self.totalSent = 0
+        self.totalDropped = 0
+        self.steps = 0
+
+    def add(self, vid: str, command: str, *args, **kwargs):
+        if vid not in self.commands:
+            self.commands[vid] = []
+        self.commands[vid].append((command, args, kwargs))
+
+    def forget(self, vid: str):
+        for command in self.SETTINGS:
+            self.settings.pop((vid, command), None)
+
+    # send the commands of the step in the order they were added. if a
+    # command fails, the vehicle has left the network and its remaining
+    # commands are skipped.
+    def flush(self):
+        sent = 0
+        dropped = 0
+        for vid, commands in self.commands.items():
+            for command, args, kwargs in commands:
+                if command in self.SETTINGS:
+                    if self.settings.get((vid, command)) == args:
+                        dropped += 1
+                        continue
+                try:
+                    getattr(traci.vehicle, command)(vid, *args, **kwargs)
+                except TraCIException:
+                    self.forget(vid)
+                    break
+                sent += 1
+                if command in self.SETTINGS:
+                    self.settings[(vid, command)] = args
+        self.commands = {}
+        self.sent = sent
+        self.dropped = dropped
+        self.totalSent += sent
+        self.totalDropped += dropped
+        self.steps += 1
+        logging.debug("Control commands: %d sent, %d dropped", sent, dropped)
+
+    # log the average command counts of the simulation, called when the
+    # simulation ends.
+    def logSummary(self):
+        steps = max(self.steps, 1)
+        logging.info("Control commands per step: %.1f sent, %.1f dropped",
+                     self.totalSent / steps, self.totalDropped / steps)
+
+
+controlBuffer = ControlBuffer()
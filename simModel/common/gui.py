@@ -1,4 +1,4 @@
-import dearpygui.dearpygui as dpg
+from utils.lazy_import import dpg
 from utils.simBase import CoordTF
 from typing import Tuple
 
@@ -12,7 +12,7 @@ import sqlite3
 from threading import Thread
 import numpy as np
 import xml.etree.ElementTree as ET
-import dearpygui.dearpygui as dpg
+from utils.lazy_import import dpg
 from rich import print
 from datetime import datetime
 
@@ -41,6 +41,10 @@ class NetworkBuild:
         # self.obstacles: dict[str, circleObs | rectangleObs] = {}
         self.dataQue = Queue()
         self.geoHashes: dict[tuple[int], geoHash] = {}
+        # lanes whose course splines are fitted together in one batch
+        self.pendingLanes: list[tuple[NormalLane, np.ndarray, np.ndarray]] = []
+        self.pendingJunctionLanes: list[
+            tuple[JunctionLane, np.ndarray, np.ndarray]] = []
 
     def getEdge(self, eid: str) -> Edge:
         try:
@@ -171,21 +175,12 @@ class NetworkBuild:
                             shapeUnzip[i]
                         ) for i in range(2)
                     ]
-                    lane.course_spline = Spline2D(shapeUnzip[0], shapeUnzip[1])
-                    lane.getPlotElem()
+                    self.pendingLanes.append(
+                        (lane, shapeUnzip[0], shapeUnzip[1]))
                     self.lanes[lid] = lane
                     edge.lanes.add(lane.id)
-                    laneAffGridIDs = self.affGridIDs(lane.center_line)
-                    edge.affGridIDs = edge.affGridIDs | laneAffGridIDs
                     laneNumber += 1
             edge.lane_num = laneNumber
-            for gridID in edge.affGridIDs:
-                try:
-                    geohash = self.geoHashes[gridID]
-                except KeyError:
-                    geohash = geoHash(gridID)
-                    self.geoHashes[gridID] = geohash
-                geohash.edges.add(eid)
             self.edges[eid] = edge
             self.dataQue.put((
                 'edgeINFO', (eid, laneNumber, fromNode, toNode), 'INSERT'
@@ -229,21 +224,20 @@ class NetworkBuild:
                         junctionLane.tlsIndex
                     ), 'REPLACE'
                 ))
-                center_line = []
-                for si in np.linspace(
-                    fromLane.course_spline.s[-1] - OVERLAP_DISTANCE,
-                    fromLane.course_spline.s[-1], num=20
-                ):
-                    center_line.append(
-                        fromLane.course_spline.calc_position(si))
-                for si in np.linspace(0, OVERLAP_DISTANCE, num=20):
-                    center_line.append(
-                        toLane.course_spline.calc_position(si)
+                from_x, from_y = fromLane.course_spline.calc_position_batch(
+                    np.linspace(
+                        fromLane.course_spline.s[-1] - OVERLAP_DISTANCE,
+                        fromLane.course_spline.s[-1], num=20
                     )
-                junctionLane.course_spline = Spline2D(
-                    list(zip(*center_line))[0], list(zip(*center_line))[1]
                 )
-                junctionLane.getPlotElem()
+                to_x, to_y = toLane.course_spline.calc_position_batch(
+                    np.linspace(0, OVERLAP_DISTANCE, num=20)
+                )
+                self.pendingJunctionLanes.append((
+                    junctionLane,
+                    np.concatenate((from_x, to_x)),
+                    np.concatenate((from_y, to_y))
+                ))
                 junctionLane.last_lane_id = fromLaneID
                 junctionLane.next_lane_id = toLaneID
                 fromLane.next_lanes[toLaneID] = (junctionLaneID, direction)
@@ -253,10 +247,51 @@ class NetworkBuild:
                 juncID = fromEdge.to_junction
                 junction = self.getJunction(juncID)
                 junctionLane.affJunc = juncID
-                jlAffGridIDs = self.affGridIDs(junctionLane.center_line)
-                junction.affGridIDs = junction.affGridIDs | jlAffGridIDs
                 junction.JunctionLanes.add(junctionLaneID)
 
+    def buildLaneSplines(
+        self, lanes: list[tuple[NormalLane | JunctionLane, np.ndarray, np.ndarray]]
+    ):
+        """Fit the course splines of many lanes in one batched pass.
+
+        Args:
+            lanes (list): (lane, x coordinates, y coordinates) of each lane
+        """
+        if not lanes:
+            return
+        laneINSs, xs, ys = zip(*lanes)
+        for lane, spline in zip(laneINSs, Spline2D.batch(xs, ys)):
+            lane.course_spline = spline
+            lane.getPlotElem()
+
+    def processPendingLanes(self):
+        # the lanes of all edges are fitted together, then their edges
+        # are registered in the geohash grids
+        self.buildLaneSplines(self.pendingLanes)
+        edgeIDs = dict.fromkeys(
+            lane.affiliated_edge.id for lane, _, _ in self.pendingLanes)
+        for lane, _, _ in self.pendingLanes:
+            edge = lane.affiliated_edge
+            laneAffGridIDs = self.affGridIDs(lane.center_line)
+            edge.affGridIDs = edge.affGridIDs | laneAffGridIDs
+        self.pendingLanes = []
+        for eid in edgeIDs:
+            for gridID in self.edges[eid].affGridIDs:
+                try:
+                    geohash = self.geoHashes[gridID]
+                except KeyError:
+                    geohash = geoHash(gridID)
+                    self.geoHashes[gridID] = geohash
+                geohash.edges.add(eid)
+
+    def processPendingJunctionLanes(self):
+        self.buildLaneSplines(self.pendingJunctionLanes)
+        for junctionLane, _, _ in self.pendingJunctionLanes:
+            junction = self.getJunction(junctionLane.affJunc)
+            jlAffGridIDs = self.affGridIDs(junctionLane.center_line)
+            junction.affGridIDs = junction.affGridIDs | jlAffGridIDs
+        self.pendingJunctionLanes = []
+
     def getData(self):
         elementTree = ET.parse(self.networkFile)
         root = elementTree.getroot()
@@ -288,6 +323,8 @@ class NetworkBuild:
             elif child.tag == 'connection':
                 # in .net.xml, the elements 'edge' come first than elements
                 # 'connection', so the follow codes can work well.
+                if self.pendingLanes:
+                    self.processPendingLanes()
                 self.processConnection(child)
             elif child.tag == 'tlLogic':
                 tlid = child.attrib['id']
@@ -302,6 +339,8 @@ class NetworkBuild:
                     'tlLogicINFO',
                     (tlid, tlType, ' '.join(preDefPhases)), 'INSERT'
                 ))
+        self.processPendingLanes()
+        self.processPendingJunctionLanes()
         for junction in self.junctions.values():
             for gridID in junction.affGridIDs:
                 try:
@@ -525,6 +564,7 @@ class Rebuild(NetworkBuild):
 
         cur.execute('SELECT * FROM laneINFO;')
         laneINFO = cur.fetchall()
+        pendingLanes = []
         if laneINFO:
             for la in laneINFO:
                 lid, rawShape, lwidth, lspeed, eid, llength = la
@@ -543,10 +583,10 @@ class Rebuild(NetworkBuild):
                         shapeUnzip[i]
                     ) for i in range(2)
                 ]
-                lane.course_spline = Spline2D(shapeUnzip[0], shapeUnzip[1])
-                lane.getPlotElem()
+                pendingLanes.append((lane, shapeUnzip[0], shapeUnzip[1]))
                 self.lanes[lid] = lane
                 self.getEdge(eid).lanes.add(lid)
+        self.buildLaneSplines(pendingLanes)
 
         cur.execute('SELECT * FROM junctionLaneINFO;')
         JunctionLaneINFO = cur.fetchall()
@@ -569,6 +609,7 @@ class Rebuild(NetworkBuild):
 
         cur.execute('SELECT * FROM connectionINFO;')
         connectionINFO = cur.fetchall()
+        pendingJunctionLanes = []
         if connectionINFO:
             for ci in connectionINFO:
                 fromLaneID, toLaneID, direction, junctionLaneID = ci
@@ -588,22 +629,21 @@ class Rebuild(NetworkBuild):
                 else:
                     junctionLane = self.getJunctionLane(junctionLaneID)
                     fromEdgeID = deduceEdge(fromLaneID)
-                    center_line = []
-                    for si in np.linspace(
-                        fromLane.course_spline.s[-1] - OVERLAP_DISTANCE,
-                        fromLane.course_spline.s[-1], num=20
-                    ):
-                        center_line.append(
-                            fromLane.course_spline.calc_position(si))
-                    for si in np.linspace(0, OVERLAP_DISTANCE, num=20):
-                        center_line.append(
-                            self.getLane(
-                                toLaneID).course_spline.calc_position(si)
+                    from_x, from_y = fromLane.course_spline.calc_position_batch(
+                        np.linspace(
+                            fromLane.course_spline.s[-1] - OVERLAP_DISTANCE,
+                            fromLane.course_spline.s[-1], num=20
                         )
-                    junctionLane.course_spline = Spline2D(
-                        list(zip(*center_line))[0], list(zip(*center_line))[1]
                     )
-                    junctionLane.getPlotElem()
+                    to_x, to_y = self.getLane(
+                        toLaneID).course_spline.calc_position_batch(
+                        np.linspace(0, OVERLAP_DISTANCE, num=20)
+                    )
+                    pendingJunctionLanes.append((
+                        junctionLane,
+                        np.concatenate((from_x, to_x)),
+                        np.concatenate((from_y, to_y))
+                    ))
                     junctionLane.last_lane_id = fromLaneID
                     junctionLane.next_lane_id = toLaneID
                     fromLane.next_lanes[toLaneID] = (
@@ -613,6 +653,7 @@ class Rebuild(NetworkBuild):
                     fromEdge = self.getEdge(fromEdgeID)
                     junction = self.getJunction(fromEdge.to_junction)
                     junction.JunctionLanes.add(junctionLaneID)
+        self.buildLaneSplines(pendingJunctionLanes)
 
         cur.execute('SELECT * FROM geohashINFO;')
         geohashINFO = cur.fetchall()
@@ -0,0 +1,60 @@
+'''
+    The interface to SUMO used by the simulation models. It forwards to
+    `traci`, which talks to a `sumo` process through a socket, or to
+    `libsumo`, which runs SUMO inside this process and answers every
+    request without IPC. libsumo has no GUI and serves a single client,
+    so it can only be used when neither the SUMO GUI nor a co-simulation
+    client such as CARLA is requested.
+'''
+import traci as _traci
+
+try:
+    import libsumo
+except ImportError:
+    libsumo = None
+
+
+# the exceptions raised by the two backends, to be used in except clauses.
+if libsumo:
+    TraCIException = (_traci.TraCIException, libsumo.TraCIException)
+else:
+    TraCIException = _traci.TraCIException
+
+
+class SimBackend:
+    def __init__(self) -> None:
+        self.module = _traci
+
+    @property
+    def isLibsumo(self) -> bool:
+        return self.module is libsumo
+
+    # select libsumo if it is wanted and installed, traci otherwise.
+    def select(self, useLibsumo: bool):
+        if useLibsumo and libsumo:
+            self.module = libsumo
+        else:
+            self.module = _traci
+
+    # start the simulation. the port and the label only apply to traci,
+    # which picks a free port when port is None and makes the labelled
+    # connection the current one.
+    def start(
+        self, cmd: list[str], port: int = None, label: str = 'default'
+    ):
+        if self.isLibsumo:
+            libsumo.start(cmd)
+        else:
+            _traci.start(cmd, port=port, label=label)
+
+    def setOrder(self, order: int):
+        if not self.isLibsumo:
+            _traci.setOrder(order)
+
+    # the domains (vehicle, lane, simulation, ...) and the other functions
+    # of the selected backend.
+    def __getattr__(self, name: str):
+        return getattr(self.module, name)
+
+
+traci = SimBackend()
@@ -0,0 +1,47 @@
+from simModel.common.simBackend import traci
+import traci.constants as tc
+
+
+class VehicleSubscription:
+    '''
+        Vehicle variables delivered with the response of every simulation
+        step through TraCI subscriptions, instead of one request per
+        variable and vehicle.
+        egoID: id of ego car, subscribed on its own and with a context
+            subscription that reports all vehicles around it;
+        radius: range of the context subscription, in meters.
+    '''
+    VARIABLES = (
+        tc.VAR_ANGLE, tc.VAR_POSITION, tc.VAR_SPEED, tc.VAR_ACCEL,
+        tc.VAR_DECEL, tc.VAR_ROAD_ID, tc.VAR_LANE_ID, tc.VAR_LANEPOSITION
+    )
+
+    def __init__(self, egoID: str, radius: float) -> None:
+        self.egoID = egoID
+        self.radius = radius
+        self.subscribed = False
+        # vehicle id -> {variable id: value}
+        self.results: dict[str, dict] = {}
+
+    # subscribe the ego car when it first appears in the network, the
+    # subscriptions end when it leaves the network.
+    def update(self):
+        if not self.subscribed:
+            traci.vehicle.subscribe(self.egoID, self.VARIABLES)
+            traci.vehicle.subscribeContext(
+                self.egoID, tc.CMD_GET_VEHICLE_VARIABLE,
+                self.radius, self.VARIABLES
+            )
+            self.subscribed = True
+        results = dict(
+            traci.vehicle.getContextSubscriptionResults(self.egoID)
+        )
+        results[self.egoID] = traci.vehicle.getSubscriptionResults(
+            self.egoID)
+        self.results = results
+
+    def __contains__(self, vid: str) -> bool:
+        return vid in self.results
+
+    def __getitem__(self, vid: str) -> dict:
+        return self.results[vid]
@@ -13,7 +13,7 @@ from simModel.common.gui import GUI
 from simModel.common.networkBuild import Rebuild
 from simModel.common.carFactory import Vehicle, egoCar
 from simModel.egoTracking.movingScene import SceneReplay
-from utils.trajectory import Trajectory, State, Rectangle, RecCollide
+from utils.trajectory import Trajectory, Rectangle, RecCollide
 from utils.simBase import vehType, MapCoordTF
 from evaluation.evaluation import RealTimeEvaluation
 from typing import List
@@ -270,14 +270,12 @@ class InterReplayModel:
                 if frameData[i+1][0] - frameData[i][0] == 1:
                     validSeq.append(frameData[i+1])
 
-            tState = []
-            for vs in validSeq:
-                state = State(
-                    x=vs[1], y=vs[2], yaw=vs[3], vel=vs[4],
-                    acc=vs[5], laneID=vs[6], s=vs[7], routeIdx=vs[8]
-                )
-                tState.append(state)
-            dbTrajectory = Trajectory(states=tState)
+            (_, x, y, yaw, vel, acc, laneID, lanePos,
+             routeIdx) = zip(*validSeq)
+            dbTrajectory = Trajectory.from_columns(
+                x=x, y=y, yaw=yaw, vel=vel, acc=acc,
+                laneID=laneID, s=lanePos, routeIdx=routeIdx
+            )
         else:
             if vehid not in self.sr.vehINAoI.keys():
                 self.sr.outOfRange.add(vehid)
@@ -324,7 +322,7 @@ class InterReplayModel:
     def isInvolved(self, veh: Vehicle, currVehs: dict[str, Vehicle]) -> bool:
         # if the vehicle's dbTrajectory is too short, limsim will take over it
         # until the vehicle drive out of the AoI, avoiding the vhicles's suddenly fading.
-        if len(veh.dbTrajectory.states) <= 10:
+        if len(veh.dbTrajectory) <= 10:
             return True
         else:
             if self.VTCollisionCheck(veh, self.ego):
@@ -400,25 +398,21 @@ class InterReplayModel:
             dpg.set_value('a_series_tag', [ax, ay])
 
         if self.ego.plannedTrajectory:
-            if self.ego.plannedTrajectory.velQueue:
-                vfy = list(self.ego.plannedTrajectory.velQueue)
-                vfy = list(self.ego.plannedTrajectory.velQueue)
+            vfy = self.ego.plannedTrajectory.column("vel").tolist()
+            vfy = self.ego.plannedTrajectory.column("vel").tolist()
+            vfx = list(range(1, len(vfy)+1))
+            dpg.set_value('v_series_tag_future', [vfx, vfy])
+            afy = self.ego.plannedTrajectory.column("acc").tolist()
+            afx = list(range(1, len(afy)+1))
+            dpg.set_value('a_series_tag_future', [afx, afy])
+        else:
+            if self.ego.dbTrajectory:
+                vfy = self.ego.dbTrajectory.column("vel").tolist()
                 vfx = list(range(1, len(vfy)+1))
                 dpg.set_value('v_series_tag_future', [vfx, vfy])
-            if self.ego.plannedTrajectory.accQueue:
-                afy = list(self.ego.plannedTrajectory.accQueue)
+                afy = self.ego.dbTrajectory.column("acc").tolist()
                 afx = list(range(1, len(afy)+1))
                 dpg.set_value('a_series_tag_future', [afx, afy])
-        else:
-            if self.ego.dbTrajectory:
-                if self.ego.dbTrajectory.velQueue:
-                    vfy = list(self.ego.dbTrajectory.velQueue)
-                    vfx = list(range(1, len(vfy)+1))
-                    dpg.set_value('v_series_tag_future', [vfx, vfy])
-                if self.ego.dbTrajectory.accQueue:
-                    afy = list(self.ego.dbTrajectory.accQueue)
-                    afx = list(range(1, len(afy)+1))
-                    dpg.set_value('a_series_tag_future', [afx, afy])
 
     def drawSce(self):
         node = dpg.add_draw_node(parent="Canvas")
@@ -503,14 +497,16 @@ class InterReplayModel:
             # when veh2 doesn't have planned trajectory, it will drive according
             # to the database, so veh1 and veh2 won't collide.
             return False
-        duration = min(len(tjA.states), len(tjB.states))
-        for i in range(0, duration, 3):
-            stateA = tjA.states[i]
-            stateB = tjB.states[i]
-            recA = Rectangle([stateA.x, stateA.y],
-                             veh1.length, veh1.width, stateA.yaw)
-            recB = Rectangle([stateB.x, stateB.y],
-                             veh2.length, veh2.width, stateB.yaw)
+        duration = min(len(tjA), len(tjB))
+        xA, yA, yawA = (tjA.column(name)[:duration:3].tolist()
+                        for name in ('x', 'y', 'yaw'))
+        xB, yB, yawB = (tjB.column(name)[:duration:3].tolist()
+                        for name in ('x', 'y', 'yaw'))
+        for i in range(len(xA)):
+            recA = Rectangle([xA[i], yA[i]],
+                             veh1.length, veh1.width, yawA[i])
+            recB = Rectangle([xB[i], yB[i]],
+                             veh2.length, veh2.width, yawB[i])
             rc = RecCollide(recA, recB)
             if rc.isCollide():
                 return True
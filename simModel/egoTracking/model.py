@@ -8,15 +8,17 @@ from datetime import datetime
 from queue import Queue
 from math import sin, cos, pi
 
-import dearpygui.dearpygui as dpg
+from utils.lazy_import import dpg
 import numpy as np
-import traci
+import traci.constants as tc
 from rich import print
-from traci import TraCIException
 from typing import Dict
 
 from simModel.common.carFactory import Vehicle, egoCar
+from simModel.common.controlBuffer import controlBuffer
 from simModel.common.gui import GUI
+from simModel.common.simBackend import traci, TraCIException
+from simModel.common.subscription import VehicleSubscription
 from simModel.egoTracking.movingScene import MovingScene
 from simModel.common.networkBuild import NetworkBuild
 from utils.trajectory import State, Trajectory
@@ -40,6 +42,14 @@ class Model:
         simNote: the simulation note information, which can be any information you 
                 wish to record. For example, the version of your trajectory 
                 planning algorithm, or the user name of this simulation.
+        carla_cosim: boolean variable, used to determine whether CARLA joins
+                the simulation as a second TraCI client;
+        port: the port of the TraCI connection. if it is not specified, a free
+                port is used, or 8813 for the CARLA co-simulation;
+        seed: the random seed of SUMO, if it is not specified, SUMO's default
+                seed is used;
+        headless: boolean variable, if it is true, the simulation runs without
+                the dearpygui interface and only writes the database.
     '''
 
     def __init__(self,
@@ -50,7 +60,10 @@ class Model:
                  dataBase: str = None,
                  SUMOGUI: int = 0,
                  simNote: str = None,
-                 carla_cosim: bool = False) -> None:
+                 carla_cosim: bool = False,
+                 port: int = None,
+                 seed: int = None,
+                 headless: bool = False) -> None:
         print('[green bold]Model initialized at {}.[/green bold]'.format(
             datetime.now().strftime('%H:%M:%S.%f')[:-3]))
         self.netFile = netFile
@@ -67,6 +80,11 @@ class Model:
         self.tpEnd = 0
         # need carla cosimulation
         self.carla_cosim = carla_cosim
+        if port is None and carla_cosim:
+            port = 8813
+        self.port = port
+        self.seed = seed
+        self.headless = headless
 
         self.ego = egoCar(egoID)
 
@@ -85,11 +103,18 @@ class Model:
         self.nb.getData()
         self.nb.buildTopology()
 
-        self.ms = MovingScene(self.nb, self.ego)
+        # vehicles within 2 * deArea are in the scene, the margin keeps
+        # those at its border in the subscription results.
+        self.vehSub = VehicleSubscription(
+            egoID, 2 * self.ego.deArea + self.ego.sceMargin)
+        self.ms = MovingScene(self.nb, self.ego, self.vehSub)
 
         self.allvTypes = None
 
-        self.gui = GUI('real-time-ego')
+        if headless:
+            self.gui = None
+        else:
+            self.gui = GUI('real-time-ego')
 
         self.evaluation = RealTimeEvaluation(dt=0.1)
 
@@ -239,7 +264,9 @@ class Model:
         cnt = 0
         conn = sqlite3.connect(self.dataBase, check_same_thread=False)
         cur = conn.cursor()
-        while cnt < 1000 and not self.dataQue.empty():
+        # the GUI stays responsive with at most 1000 rows per second,
+        # without it all the queued rows are stored.
+        while (cnt < 1000 or self.headless) and not self.dataQue.empty():
             tableName, data = self.dataQue.get()
             sql = 'INSERT INTO %s VALUES ' % tableName + \
                 '(' + '?,'*(len(data)-1) + '?' + ')'
@@ -277,12 +304,15 @@ class Model:
         return allvTypesID
 
     def start(self):
-        
+        controlBuffer.reset()
+        # run SUMO in this process through libsumo, unless the SUMO GUI
+        # or the CARLA co-simulation needs a sumo server.
+        traci.select(not self.SUMOGUI and not self.carla_cosim)
         if self.carla_cosim:
             num_clients = "2"
         else:
             num_clients = "1"
-        traci.start([
+        cmd = [
             'sumo-gui' if self.SUMOGUI else 'sumo',
             '-n',
             self.netFile,
@@ -299,7 +329,12 @@ class Model:
             'remove',
             "--num-clients",
             num_clients,
-        ], port = 8813)
+        ]
+        if self.seed is not None:
+            cmd += ['--seed', str(self.seed)]
+        # the connection is labelled with the database, which is unique to
+        # the simulation.
+        traci.start(cmd, port=self.port, label=self.dataBase)
         traci.setOrder(1)
 
         allvTypeID = self.getAllvTypeID()
@@ -329,7 +364,7 @@ class Model:
 
     def plotVState(self):
         if self.ego.speedQ:
-            currLane = traci.vehicle.getLaneID(self.ego.id)
+            currLane = self.vehSub[self.ego.id][tc.VAR_LANE_ID]
             if ':' not in currLane:
                 try:
                     laneMaxSpeed = traci.lane.getMaxSpeed(currLane)
@@ -356,14 +391,12 @@ class Model:
             dpg.set_value('a_series_tag', [ax, ay])
 
         if self.ego.plannedTrajectory:
-            if self.ego.plannedTrajectory.velQueue:
-                vfy = list(self.ego.plannedTrajectory.velQueue)
-                vfx = list(range(1, len(vfy) + 1))
-                dpg.set_value('v_series_tag_future', [vfx, vfy])
-            if self.ego.plannedTrajectory.accQueue:
-                afy = list(self.ego.plannedTrajectory.accQueue)
-                afx = list(range(1, len(afy) + 1))
-                dpg.set_value('a_series_tag_future', [afx, afy])
+            vfy = self.ego.plannedTrajectory.column("vel").tolist()
+            vfx = list(range(1, len(vfy) + 1))
+            dpg.set_value('v_series_tag_future', [vfx, vfy])
+            afy = self.ego.plannedTrajectory.column("acc").tolist()
+            afx = list(range(1, len(afy) + 1))
+            dpg.set_value('a_series_tag_future', [afx, afy])
 
     def putFrameInfo(self, vid: str, vtag: str, veh: Vehicle):
         self.dataQue.put(
@@ -380,6 +413,20 @@ class Model:
         self.dataQue.put(
             ('evaluationINFO', tuple([self.timeStep] + points.tolist())))
 
+    # put the frame and evaluation information of the current step into the
+    # database queue, with or without the GUI.
+    def recordScene(self):
+        self.putFrameInfo(self.ego.id, 'ego', self.ego)
+        if self.ms.vehINAoI:
+            for v1 in self.ms.vehINAoI.values():
+                self.putFrameInfo(v1.id, 'AoI', v1)
+        if self.ms.outOfAoI:
+            for v2 in self.ms.outOfAoI.values():
+                self.putFrameInfo(v2.id, 'outOfAoI', v2)
+
+        self.evaluationPoints = self.evaluation.output_result()
+        self.putEvaluationInfo(self.evaluation.result)
+
     def drawScene(self):
         ex, ey = self.ego.x, self.ego.y
         node = dpg.add_draw_node(parent="Canvas")
@@ -387,17 +434,14 @@ class Model:
         self.ego.plotSelf('ego', node, ex, ey, self.gui.ctf)
         self.ego.plotdeArea(node, ex, ey, self.gui.ctf)
         self.ego.plotTrajectory(node, ex, ey, self.gui.ctf)
-        self.putFrameInfo(self.ego.id, 'ego', self.ego)
         if self.ms.vehINAoI:
             for v1 in self.ms.vehINAoI.values():
                 v1.plotSelf('AoI', node, ex, ey, self.gui.ctf)
                 v1.plotTrajectory(node, ex, ey, self.gui.ctf)
-                self.putFrameInfo(v1.id, 'AoI', v1)
         if self.ms.outOfAoI:
             for v2 in self.ms.outOfAoI.values():
                 v2.plotSelf('outOfAoI', node, ex, ey, self.gui.ctf)
                 v2.plotTrajectory(node, ex, ey, self.gui.ctf)
-                self.putFrameInfo(v2.id, 'outOfAoI', v2)
 
         mvNode = dpg.add_draw_node(parent='movingScene')
         mvCenterx, mvCentery = self.mapCoordTF.dpgCoord(ex, ey)
@@ -431,11 +475,8 @@ class Model:
 
         radarNode = dpg.add_draw_node(parent='radarPlot')
 
-        points = self.evaluation.output_result()
-        self.putEvaluationInfo(self.evaluation.result)
-
-        transformed_points = self._evaluation_transform_coordinate(points,
-                                                                   scale=30)
+        transformed_points = self._evaluation_transform_coordinate(
+            self.evaluationPoints, scale=30)
         transformed_points.append(transformed_points[0])
 
         radarNode = dpg.add_draw_node(parent='radarPlot')
@@ -488,24 +529,25 @@ class Model:
             routes = ' '.join(veh.routes)
             self.putVehicleInfo(vid, vtins, routes)
             max_decel = veh.maxDecel
-        veh.yawAppend(traci.vehicle.getAngle(vid))
-        x, y = traci.vehicle.getPosition(vid)
+        vres = self.vehSub[vid]
+        veh.yawAppend(vres[tc.VAR_ANGLE])
+        x, y = vres[tc.VAR_POSITION]
         veh.xAppend(x)
         veh.yAppend(y)
-        veh.speedQ.append(traci.vehicle.getSpeed(vid))
-        if max_decel == traci.vehicle.getDecel(vid):
-            accel = traci.vehicle.getAccel(vid)
+        veh.speedQ.append(vres[tc.VAR_SPEED])
+        if max_decel == vres[tc.VAR_DECEL]:
+            accel = vres[tc.VAR_ACCEL]
         else:
-            accel = -traci.vehicle.getDecel(vid)
+            accel = -vres[tc.VAR_DECEL]
         veh.accelQ.append(accel)
-        laneID = traci.vehicle.getLaneID(vid)
+        laneID = vres[tc.VAR_LANE_ID]
         veh.routeIdxAppend(laneID)
-        veh.laneAppend(self.nb)
+        veh.laneAppend(self.nb, laneID, vres[tc.VAR_LANEPOSITION])
 
     def vehMoveStep(self, veh: Vehicle):
         # control vehicles after update its data
         # control happens next timestep
-        if veh.plannedTrajectory and veh.plannedTrajectory.xQueue:
+        if veh.plannedTrajectory:
             centerx, centery, yaw, speed, accel = veh.plannedTrajectory.pop_last_state(
             )
             try:
@@ -520,6 +562,8 @@ class Model:
         if self.ms.currVehicles:
             for v in self.ms.currVehicles.values():
                 self.vehMoveStep(v)
+        # send the control commands of this step together
+        controlBuffer.flush()
 
     def setTrajectories(self, trajectories: Dict[str, Trajectory]):
         for k, v in trajectories.items():
@@ -539,10 +583,12 @@ class Model:
     def getSce(self):
         if self.ego.id in traci.vehicle.getIDList():
             self.tpStart = 1
-            dpg.delete_item("Canvas", children_only=True)
-            dpg.delete_item("movingScene", children_only=True)
-            dpg.delete_item("simInfo", children_only=True)
-            dpg.delete_item("radarPlot", children_only=True)
+            if not self.headless:
+                dpg.delete_item("Canvas", children_only=True)
+                dpg.delete_item("movingScene", children_only=True)
+                dpg.delete_item("simInfo", children_only=True)
+                dpg.delete_item("radarPlot", children_only=True)
+            self.vehSub.update()
             self.ms.updateScene(self.dataQue, self.timeStep)
             self.ms.updateSurroudVeh()
 
@@ -552,9 +598,11 @@ class Model:
                     self.getVehInfo(v)
 
             self.update_evluation_data()
+            self.recordScene()
 
-            self.drawScene()
-            self.plotVState()
+            if not self.headless:
+                self.drawScene()
+                self.plotVState()
         else:
             if self.tpStart:
                 print('[cyan]The ego car has reached the destination.[/cyan]')
@@ -611,7 +659,7 @@ class Model:
                           size=20,
                           parent=bgNode)
 
-    def drawMapBG(self):
+    def netBoundaryCommit(self):
         # left-bottom: x1, y1
         # top-right: x2, y2
         ((x1, y1), (x2, y2)) = traci.simulation.getNetBoundary()
@@ -621,6 +669,10 @@ class Model:
         cur.execute(f"""UPDATE simINFO SET netBoundary = '{netBoundary}';""")
         conn.commit()
         conn.close()
+        self.netBoundary = ((x1, y1), (x2, y2))
+
+    def drawMapBG(self):
+        ((x1, y1), (x2, y2)) = self.netBoundary
         self.mapCoordTF = MapCoordTF((x1, y1), (x2, y2), 'macroMap')
         mNode = dpg.add_draw_node(parent='mapBackground')
         for jid in self.nb.junctions.keys():
@@ -629,26 +681,36 @@ class Model:
         self.gui.drawMainWindowWhiteBG((x1-100, y1-100), (x2+100, y2+100))
 
     def render(self):
-        self.gui.update_inertial_zoom()
+        if not self.headless:
+            self.gui.update_inertial_zoom()
         self.getSce()
-        dpg.render_dearpygui_frame()
+        if not self.headless:
+            dpg.render_dearpygui_frame()
 
+    # without the GUI, the simulation is paced by SUMO and the planner only,
+    # it can't be paused or stopped from the window.
     def moveStep(self):
-        if self.gui.is_running:
+        if self.headless or self.gui.is_running:
             traci.simulationStep()
             self.timeStep += 1
-        if not dpg.is_dearpygui_running():
+        if not self.headless and not dpg.is_dearpygui_running():
             self.tpEnd = 1
         if self.ego.id in traci.vehicle.getIDList():
             if not self.tpStart:
-                self.gui.start()
-                self.drawRadarBG()
-                self.drawMapBG()
+                self.netBoundaryCommit()
+                if not self.headless:
+                    self.gui.start()
+                    self.drawRadarBG()
+                    self.drawMapBG()
                 self.tpStart = 1
             self.render()
 
     def destroy(self):
-        # stop the saveThread.
+        # wait for the saveThread to store the queued data.
+        while not self.dataQue.empty():
+            time.sleep(0.1)
         time.sleep(1.1)
         traci.close()
-        self.gui.destroy()
+        controlBuffer.logSummary()
+        if not self.headless:
+            self.gui.destroy()
@@ -1,21 +1,28 @@
-import traci
-from traci import TraCIException
+from __future__ import annotations
+
+import traci.constants as tc
 from math import sqrt
 from queue import Queue
-import dearpygui.dearpygui as dpg
+from utils.lazy_import import dpg
 import sqlite3
 
 
 from simModel.common.networkBuild import NetworkBuild, Rebuild
+from simModel.common.simBackend import traci, TraCIException
 from simModel.common.carFactory import Vehicle, egoCar, DummyVehicle
+from simModel.common.subscription import VehicleSubscription
 from utils.roadgraph import RoadGraph
 from utils.simBase import CoordTF
 
 
 class MovingScene:
-    def __init__(self, netInfo: NetworkBuild, ego: egoCar) -> None:
+    def __init__(
+        self, netInfo: NetworkBuild, ego: egoCar,
+        vehSub: VehicleSubscription
+    ) -> None:
         self.netInfo = netInfo
         self.ego = ego
+        self.vehSub = vehSub
         self.edges: set = None
         self.junctions: set = None
         self.currVehicles: dict[str, Vehicle] = {}
@@ -27,7 +34,7 @@ class MovingScene:
     # else, judge if the upstream intersection or downstream intersection
     # is in the range of the vehicle's deArea.
     def updateScene(self, dataQue: Queue, timeStep: int):
-        ex, ey = traci.vehicle.getPosition(self.ego.id)
+        ex, ey = self.vehSub[self.ego.id][tc.VAR_POSITION]
         currGeox = int(ex // 100)
         currGeoy = int(ey // 100)
 
@@ -90,39 +97,39 @@ class MovingScene:
             vdict[vid] = vehIns
 
     # getSurroundVeh will update all vehicle's attributes
-    # so don't update again in other steps
+    # so don't update again in other steps.
+    # the vehicles and their positions are read from the subscription
+    # results, vehicles missing from them are out of the subscription range
+    # or are leaving the network.
     def updateSurroudVeh(self):
-        nextStepVehicles = set()
-        for ed in self.edges:
-            nextStepVehicles = nextStepVehicles | set(
-                traci.edge.getLastStepVehicleIDs(ed)
-            )
-
+        juncLanes = set()
         for jc in self.junctions:
             jinfo = self.netInfo.getJunction(jc)
             if jinfo.JunctionLanes:
-                for il in jinfo.JunctionLanes:
-                    nextStepVehicles = nextStepVehicles | set(
-                        traci.lane.getLastStepVehicleIDs(il)
-                    )
+                juncLanes = juncLanes | jinfo.JunctionLanes
+
+        nextStepVehicles = set()
+        for vid, vres in self.vehSub.results.items():
+            if vres[tc.VAR_ROAD_ID] in self.edges or \
+                    vres[tc.VAR_LANE_ID] in juncLanes:
+                nextStepVehicles.add(vid)
 
         newVehicles = nextStepVehicles - self.currVehicles.keys()
         for nv in newVehicles:
             self.addVeh(self.currVehicles, nv)
 
-        ex, ey = traci.vehicle.getPosition(self.ego.id)
+        ex, ey = self.vehSub[self.ego.id][tc.VAR_POSITION]
         vehInAoI = {}
         outOfAoI = {}
         outOfRange = set()
         for vk, vv in self.currVehicles.items():
             if vk == self.ego.id:
                 continue
-            try:
-                x, y = traci.vehicle.getPosition(vk)
-            except TraCIException:
-                # vehicle is leaving the network.
+            if vk not in self.vehSub:
+                vv.exitControlMode()
                 outOfRange.add((vk, 0))
                 continue
+            x, y = self.vehSub[vk][tc.VAR_POSITION]
             if sqrt(pow((ex - x), 2) + pow((ey - y), 2)) <= self.ego.deArea:
                 try:
                     vehArrive = vv.arriveDestination(self.netInfo)
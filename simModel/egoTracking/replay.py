@@ -12,7 +12,7 @@ from simModel.common.networkBuild import Rebuild
 from simModel.common.carFactory import Vehicle, egoCar
 from simModel.common.gui import GUI
 from simModel.egoTracking.movingScene import SceneReplay
-from utils.trajectory import Trajectory, State
+from utils.trajectory import Trajectory
 from utils.simBase import MapCoordTF
 from evaluation.evaluation import RealTimeEvaluation
 
@@ -174,20 +174,12 @@ class ReplayModel:
                 if frameData[i + 1][0] - frameData[i][0] == 1:
                     validSeq.append(frameData[i + 1])
 
-            tState = []
-            for vs in validSeq:
-                state = State(
-                    x=vs[1],
-                    y=vs[2],
-                    yaw=vs[3],
-                    vel=vs[4],
-                    acc=vs[5],
-                    laneID=vs[6],
-                    s=vs[7],
-                    routeIdx=vs[8],
-                )
-                tState.append(state)
-            dbTrajectory = Trajectory(states=tState)
+            (_, x, y, yaw, vel, acc, laneID, lanePos,
+             routeIdx) = zip(*validSeq)
+            dbTrajectory = Trajectory.from_columns(
+                x=x, y=y, yaw=yaw, vel=vel, acc=acc,
+                laneID=laneID, s=lanePos, routeIdx=routeIdx
+            )
         else:
             self.sr.outOfRange.add(vehid)
             return
@@ -239,7 +231,7 @@ class ReplayModel:
 
     def updateVeh(self, veh: Vehicle | egoCar):
         self.setDBTrajectory(veh)
-        if veh.dbTrajectory and veh.dbTrajectory.xQueue:
+        if veh.dbTrajectory:
             (x, y, yaw, speed, accel, laneID, lanePos,
              routeIdx) = veh.dbTrajectory.pop_last_state_r()
             veh.xQ.append(x)
@@ -247,7 +239,8 @@ class ReplayModel:
             veh.yawQ.append(yaw)
             veh.speedQ.append(speed)
             veh.accelQ.append(accel)
-            if veh.dbTrajectory.laneIDQueue:
+            # after the pop, the lane of the last state is not appended
+            if len(veh.dbTrajectory):
                 veh.laneIDQ.append(laneID)
                 veh.lanePosQ.append(lanePos)
                 veh.routeIdxQ.append(routeIdx)
@@ -279,14 +272,12 @@ class ReplayModel:
             dpg.set_value('a_series_tag', [ax, ay])
 
         if self.ego.dbTrajectory:
-            if self.ego.dbTrajectory.velQueue:
-                vfy = list(self.ego.dbTrajectory.velQueue)
-                vfx = list(range(1, len(vfy) + 1))
-                dpg.set_value('v_series_tag_future', [vfx, vfy])
-            if self.ego.dbTrajectory.accQueue:
-                afy = list(self.ego.dbTrajectory.accQueue)
-                afx = list(range(1, len(afy) + 1))
-                dpg.set_value('a_series_tag_future', [afx, afy])
+            vfy = self.ego.dbTrajectory.column("vel").tolist()
+            vfx = list(range(1, len(vfy) + 1))
+            dpg.set_value('v_series_tag_future', [vfx, vfy])
+            afy = self.ego.dbTrajectory.column("acc").tolist()
+            afx = list(range(1, len(afy) + 1))
+            dpg.set_value('a_series_tag_future', [afx, afy])
 
     def drawSce(self):
         node = dpg.add_draw_node(parent="Canvas")
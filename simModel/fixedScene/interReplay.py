@@ -12,7 +12,7 @@ from simModel.common.gui import GUI
 from simModel.common.networkBuild import Rebuild
 from simModel.common.carFactory import Vehicle, DummyVehicle
 from simModel.fixedScene.localScene import LocalSceneReplay
-from utils.trajectory import Trajectory, State, Rectangle, RecCollide
+from utils.trajectory import Trajectory, Rectangle, RecCollide
 from utils.simBase import vehType
 
 
@@ -240,14 +240,12 @@ class InterReplayModel:
                 if frameData[i+1][0] - frameData[i][0] == 1:
                     validSeq.append(frameData[i+1])
 
-            tState = []
-            for vs in validSeq:
-                state = State(
-                    x=vs[1], y=vs[2], yaw=vs[3], vel=vs[4],
-                    acc=vs[5], laneID=vs[6], s=vs[7], routeIdx=vs[8]
-                )
-                tState.append(state)
-            dbTrajectory = Trajectory(states=tState)
+            (_, x, y, yaw, vel, acc, laneID, lanePos,
+             routeIdx) = zip(*validSeq)
+            dbTrajectory = Trajectory.from_columns(
+                x=x, y=y, yaw=yaw, vel=vel, acc=acc,
+                laneID=laneID, s=lanePos, routeIdx=routeIdx
+            )
         else:
             self.lsr.outOfRange.add(vehid)
             return
@@ -290,7 +288,7 @@ class InterReplayModel:
     def isInvolved(self, veh: Vehicle, currVehs: dict[str, Vehicle]) -> bool:
         # if the vehicle's dbTrajectory is too short, limsim will take over it 
         # until the vehicle drive out of the AoI, avoiding the vhicles's suddenly fading.
-        if len(veh.dbTrajectory.states) <= 10:
+        if len(veh.dbTrajectory) <= 10:
             return True
         else:
             for cv in currVehs.values():
@@ -390,14 +388,16 @@ class InterReplayModel:
             # when veh2 doesn't have planned trajectory, it will drive according
             # to the database, so veh1 and veh2 won't collide.
             return False
-        duration = min(len(tjA.states), len(tjB.states))
-        for i in range(0, duration, 3):
-            stateA = tjA.states[i]
-            stateB = tjB.states[i]
-            recA = Rectangle([stateA.x, stateB.x],
-                             veh1.length, veh1.width, stateA.yaw)
-            recB = Rectangle([stateB.x, stateB.y],
-                             veh2.length, veh2.width, stateB.yaw)
+        duration = min(len(tjA), len(tjB))
+        xA, yA, yawA = (tjA.column(name)[:duration:3].tolist()
+                        for name in ('x', 'y', 'yaw'))
+        xB, yB, yawB = (tjB.column(name)[:duration:3].tolist()
+                        for name in ('x', 'y', 'yaw'))
+        for i in range(len(xA)):
+            recA = Rectangle([xA[i], yA[i]],
+                             veh1.length, veh1.width, yawA[i])
+            recB = Rectangle([xB[i], yB[i]],
+                             veh2.length, veh2.width, yawB[i])
             rc = RecCollide(recA, recB)
             if rc.isCollide():
                 return True
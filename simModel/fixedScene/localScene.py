@@ -1,12 +1,13 @@
-import traci
-from traci import TraCIException
+from __future__ import annotations
+
 from math import sqrt
 from queue import Queue
-import dearpygui.dearpygui as dpg
+from utils.lazy_import import dpg
 import sqlite3
 
 
 from simModel.common.networkBuild import NetworkBuild, Rebuild
+from simModel.common.simBackend import traci, TraCIException
 from simModel.common.carFactory import Vehicle, egoCar, DummyVehicle
 from utils.roadgraph import RoadGraph
 from utils.simBase import CoordTF
@@ -6,11 +6,12 @@ import xml.etree.ElementTree as ET
 from datetime import datetime
 from queue import Queue
 
-import dearpygui.dearpygui as dpg
-import traci
+from utils.lazy_import import dpg
 
 from simModel.common.carFactory import Vehicle, DummyVehicle
+from simModel.common.controlBuffer import controlBuffer
 from simModel.common.gui import GUI
+from simModel.common.simBackend import traci
 from simModel.common.networkBuild import NetworkBuild
 from simModel.fixedScene.localScene import LocalScene
 from utils.trajectory import Trajectory
@@ -33,6 +34,12 @@ class Model:
         simNote: the simulation note information, which can be any information you 
                 wish to record. For example, the version of your trajectory 
                 planning algorithm, or the user name of this simulation.
+        port: the port of the TraCI connection. if it is not specified, a free
+                port is used;
+        seed: the random seed of SUMO, if it is not specified, SUMO's default
+                seed is used;
+        headless: boolean variable, if it is true, the simulation runs without
+                the dearpygui interface and only writes the database.
     '''
 
     def __init__(self,
@@ -43,12 +50,18 @@ class Model:
                  obsFile: str = None,
                  dataBase: str = None,
                  SUMOGUI: bool = 1,
-                 simNote: str = None
+                 simNote: str = None,
+                 port: int = None,
+                 seed: int = None,
+                 headless: bool = False
                  ) -> None:
         self.netFile = netFile
         self.rouFile = rouFile
         self.obsFile = obsFile
         self.SUMOGUI = SUMOGUI
+        self.port = port
+        self.seed = seed
+        self.headless = headless
         self.sim_mode: str = 'RealTime'
         self.timeStep = 0
 
@@ -73,7 +86,10 @@ class Model:
 
         self.allvTypes = None
 
-        self.gui = GUI('real-time-local')
+        if headless:
+            self.gui = None
+        else:
+            self.gui = GUI('real-time-local')
 
     def createDatabase(self):
         # if database exist then delete it
@@ -213,7 +229,9 @@ class Model:
         cnt = 0
         conn = sqlite3.connect(self.dataBase, check_same_thread=False)
         cur = conn.cursor()
-        while cnt < 1000 and not self.dataQue.empty():
+        # the GUI stays responsive with at most 1000 rows per second,
+        # without it all the queued rows are stored.
+        while (cnt < 1000 or self.headless) and not self.dataQue.empty():
             tableName, data = self.dataQue.get()
             sql = 'INSERT INTO %s VALUES ' % tableName + \
                 '(' + '?,'*(len(data)-1) + '?' + ')'
@@ -250,8 +268,11 @@ class Model:
         return allvTypesID
 
     def start(self):
-        traci.start(
-            [
+        controlBuffer.reset()
+        # run SUMO in this process through libsumo, unless the SUMO GUI
+        # is requested.
+        traci.select(not self.SUMOGUI)
+        cmd = [
             'sumo-gui' if self.SUMOGUI else 'sumo',
             '-n',
             self.netFile,
@@ -266,8 +287,12 @@ class Model:
             '-W',
             '--collision.action',
             'remove',
-            ]
-        )
+        ]
+        if self.seed is not None:
+            cmd += ['--seed', str(self.seed)]
+        # the connection is labelled with the database, which is unique to
+        # the simulation.
+        traci.start(cmd, port=self.port, label=self.dataBase)
 
         allvTypeID = self.getAllvTypeID()
         allvTypes = {}
@@ -294,11 +319,12 @@ class Model:
             self.allvTypes = allvTypes
         self.allvTypes = allvTypes
 
-        self.gui.start()
-        self.gui.drawMainWindowWhiteBG(
-            (self.dv.x-100, self.dv.y-100), 
-            (self.dv.x+100, self.dv.y+100)
-            )
+        if not self.headless:
+            self.gui.start()
+            self.gui.drawMainWindowWhiteBG(
+                (self.dv.x-100, self.dv.y-100), 
+                (self.dv.x+100, self.dv.y+100)
+                )
 
     def putFrameInfo(self, vid: str, vtag: str, veh: Vehicle):
         self.dataQue.put(
@@ -318,6 +344,16 @@ class Model:
             )
         )
 
+    # put the frame information of the current step into the database
+    # queue, with or without the GUI.
+    def recordScene(self):
+        if self.ls.vehINAoI:
+            for v1 in self.ls.vehINAoI.values():
+                self.putFrameInfo(v1.id, 'AoI', v1)
+        if self.ls.outOfAoI:
+            for v2 in self.ls.outOfAoI.values():
+                self.putFrameInfo(v2.id, 'outOfAoI', v2)
+
     def drawScene(self):
         # ex, ey refers to the center position of the local area
         ex, ey = self.dv.x, self.dv.y
@@ -328,12 +364,10 @@ class Model:
             for v1 in self.ls.vehINAoI.values():
                 v1.plotSelf('AoI', node, ex, ey, self.gui.ctf)
                 v1.plotTrajectory(node, ex, ey, self.gui.ctf)
-                self.putFrameInfo(v1.id, 'AoI', v1)
         if self.ls.outOfAoI:
             for v2 in self.ls.outOfAoI.values():
                 v2.plotSelf('outOfAoI', node, ex, ey, self.gui.ctf)
                 v2.plotTrajectory(node, ex, ey, self.gui.ctf)
-                self.putFrameInfo(v2.id, 'outOfAoI', v2)
 
         dpg.draw_text(
             (10, 20),
@@ -390,7 +424,7 @@ class Model:
     def vehMoveStep(self, veh: Vehicle):
         # control vehicles after update its data
         # control happens next timestep
-        if veh.plannedTrajectory and veh.plannedTrajectory.xQueue:
+        if veh.plannedTrajectory:
             centerx, centery, yaw, speed, accel = veh.plannedTrajectory.pop_last_state()
             try:
                 veh.controlSelf(centerx,  centery, yaw, speed, accel)
@@ -403,6 +437,8 @@ class Model:
         if self.ls.currVehicles:
             for v in self.ls.currVehicles.values():
                 self.vehMoveStep(v)
+        # send the control commands of this step together
+        controlBuffer.flush()
 
     def setTrajectories(self, trajectories: dict[str, Trajectory]):
         for k, v in trajectories.items():
@@ -410,7 +446,8 @@ class Model:
             veh.plannedTrajectory = v
 
     def getSce(self):
-        dpg.delete_item("Canvas", children_only=True)
+        if not self.headless:
+            dpg.delete_item("Canvas", children_only=True)
         self.ls.updateScene(self.dataQue, self.timeStep)
         self.ls.updateSurroundVeh()
 
@@ -418,15 +455,19 @@ class Model:
             for v in self.ls.currVehicles.values():
                 self.getVehInfo(v)
 
-        self.drawScene()
+        self.recordScene()
+        if not self.headless:
+            self.drawScene()
 
     def exportSce(self):
         return self.ls.exportScene()
 
     def render(self):
-        self.gui.update_inertial_zoom()
+        if not self.headless:
+            self.gui.update_inertial_zoom()
         self.getSce()
-        dpg.render_dearpygui_frame()
+        if not self.headless:
+            dpg.render_dearpygui_frame()
 
     @property
     def simEnd(self):
@@ -435,13 +476,19 @@ class Model:
         else:
             return True
 
+    # without the GUI, the simulation is paced by SUMO and the planner only.
     def moveStep(self):
-        if self.gui.is_running:
+        if self.headless or self.gui.is_running:
             traci.simulationStep()
             self.timeStep += 1
             self.render()
 
     def destroy(self):
+        # wait for the saveThread to store the queued data.
+        while not self.dataQue.empty():
+            time.sleep(0.1)
         time.sleep(1.1)
         traci.close()
-        self.gui.destroy()
+        controlBuffer.logSummary()
+        if not self.headless:
+            self.gui.destroy()
@@ -9,7 +9,7 @@ from simModel.common.networkBuild import Rebuild
 from simModel.common.carFactory import Vehicle, DummyVehicle
 from simModel.common.gui import GUI
 from simModel.fixedScene.localScene import LocalSceneReplay
-from utils.trajectory import Trajectory, State
+from utils.trajectory import Trajectory
 
 
 class ReplayModel:
@@ -95,20 +95,12 @@ class ReplayModel:
                 if frameData[i + 1][0] - frameData[i][0] == 1:
                     validSeq.append(frameData[i + 1])
 
-            tState = []
-            for vs in validSeq:
-                state = State(
-                    x=vs[1],
-                    y=vs[2],
-                    yaw=vs[3],
-                    vel=vs[4],
-                    acc=vs[5],
-                    laneID=vs[6],
-                    s=vs[7],
-                    routeIdx=vs[8],
-                )
-                tState.append(state)
-            dbTrajectory = Trajectory(states=tState)
+            (_, x, y, yaw, vel, acc, laneID, lanePos,
+             routeIdx) = zip(*validSeq)
+            dbTrajectory = Trajectory.from_columns(
+                x=x, y=y, yaw=yaw, vel=vel, acc=acc,
+                laneID=laneID, s=lanePos, routeIdx=routeIdx
+            )
         else:
             self.lsr.outOfRange.add(vehid)
             return
@@ -156,7 +148,7 @@ class ReplayModel:
 
     def updateVeh(self, veh: Vehicle):
         self.setDBTrajectory(veh)
-        if veh.dbTrajectory and veh.dbTrajectory.xQueue:
+        if veh.dbTrajectory:
             (x, y, yaw, speed, accel, laneID, lanePos,
              routeIdx) = veh.dbTrajectory.pop_last_state_r()
             veh.xQ.append(x)
@@ -164,7 +156,8 @@ class ReplayModel:
             veh.yawQ.append(yaw)
             veh.speedQ.append(speed)
             veh.accelQ.append(accel)
-            if veh.dbTrajectory.laneIDQueue:
+            # after the pop, the lane of the last state is not appended
+            if len(veh.dbTrajectory):
                 veh.laneIDQ.append(laneID)
                 veh.lanePosQ.append(lanePos)
                 veh.routeIdxQ.append(routeIdx)
@@ -6,10 +6,11 @@ stop, and lane change costs. The module also provides a main function to run the
 from typing import Union
 import numpy as np
 import obstacle_cost
+from common.occupancy import OccupancyIndex
 from trafficManager.common.vehicle import Vehicle
 from utils.cubic_spline import Spline2D
 from utils.obstacles import ObsType
-from utils.trajectory import Trajectory
+from utils.trajectory import Trajectory, TrajectoryBatch
 
 
 def smoothness(trajectory: Trajectory,
@@ -27,11 +28,16 @@ def smoothness(trajectory: Trajectory,
     """
     cost_yaw_diff = 0
     cost_cur = 0
-    for state in trajectory.states:
-        if state.s >= ref_line.s[-1] or state.laneID != trajectory.states[0].laneID:
-            break
-        cost_yaw_diff += (state.yaw - ref_line.calc_yaw(state.s)) ** 2
-        cost_cur += state.cur ** 2
+    s = trajectory.column("s")
+    if s.size > 0:
+        lane_ids = trajectory.column("laneID")
+        # only the states before leaving the reference line are evaluated
+        invalid = (s >= ref_line.s[-1]) | (lane_ids != lane_ids[0])
+        valid_num = np.argmax(invalid) if np.any(invalid) else s.size
+        ref_yaw = ref_line.calc_yaw_batch(s[:valid_num])
+        cost_yaw_diff = np.sum(
+            (trajectory.column("yaw")[:valid_num] - ref_yaw) ** 2)
+        cost_cur = np.sum(trajectory.column("cur")[:valid_num] ** 2)
 
     return weight_config["W_YAW"] * cost_yaw_diff + weight_config["W_CUR"] * cost_cur
 
@@ -49,7 +55,7 @@ def vel_diff(trajectory: Trajectory, ref_vel_list: Union[float, np.ndarray],
     Returns:
         float: The velocity difference cost.
     """
-    velocities = np.array([state.vel for state in trajectory.states])
+    velocities = trajectory.column("vel")
     cost_vel_diff = np.linalg.norm(velocities - ref_vel_list, 2)**2
     return weight_config["W_VEL_DIFF"] * cost_vel_diff
 
@@ -65,7 +71,7 @@ def time(trajectory: Trajectory, weight_config: dict) -> float:
     Returns:
         float: The time cost.
     """
-    return weight_config["W_T"] * trajectory.states[-1].t
+    return weight_config["W_T"] * trajectory.column("t")[-1]
 
 
 def obs(vehicle: Vehicle, trajectory: Trajectory,
@@ -112,7 +118,7 @@ def guidance(trajectory: Trajectory, weight_config: dict) -> float:
     # cost_guidance = 0
     # for state in trajectory.states:
     #     cost_guidance += state.d ** 2
-    offset = np.array([state.d for state in trajectory.states])
+    offset = trajectory.column("d")
     cost_guidance = np.sum(np.power(offset, 2))
     return weight_config["W_GUIDE"] * cost_guidance
 
@@ -144,9 +150,7 @@ def acc(trajectory: Trajectory, weight_config: dict) -> float:
     Returns:
         float: The acceleration cost.
     """
-    cost_acc = 0
-    for state in trajectory.states:
-        cost_acc += state.acc ** 2
+    cost_acc = np.sum(trajectory.column("acc") ** 2)
     return weight_config["W_ACC"] * cost_acc
 
 
@@ -161,12 +165,190 @@ def jerk(trajectory: Trajectory, weight_config: dict) -> float:
     Returns:
         float: The jerk cost.
     """
-    cost_jerk = 0
-    for state in trajectory.states:
-        cost_jerk += state.s_ddd ** 2 + state.d_ddd ** 2
+    cost_jerk = np.sum(trajectory.column("s_ddd") ** 2 +
+                       trajectory.column("d_ddd") ** 2)
     return weight_config["W_JERK"] * cost_jerk
 
 
+def _masked_sum(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    return np.sum(np.where(mask, values, 0), axis=1)
+
+
+def smoothness_batch(trajectories: TrajectoryBatch, ref_line: Spline2D,
+                     weight_config: dict) -> np.ndarray:
+    """
+    Vectorized version of smoothness.
+
+    Args:
+        trajectories (TrajectoryBatch): The candidate paths to evaluate.
+        ref_line (Spline2D): The reference line for the paths.
+        weight_config (dict): The weight configuration for the cost calculation.
+
+    Returns:
+        np.ndarray: The smoothness cost of every candidate.
+    """
+    s = trajectories.column("s")
+    lane_ids = trajectories.column("laneID")
+    # only the states before leaving the reference line are evaluated
+    invalid = ((s >= ref_line.s[-1]) | (lane_ids != lane_ids[:, :1]) |
+               ~trajectories.mask)
+    valid_num = np.where(np.any(invalid, axis=1), np.argmax(invalid, axis=1),
+                         s.shape[1])
+    evaluated = np.arange(s.shape[1]) < valid_num[:, np.newaxis]
+    yaw_diff = np.zeros(s.shape)
+    yaw_diff[evaluated] = (trajectories.column("yaw")[evaluated] -
+                           ref_line.calc_yaw_batch(s[evaluated]))
+    cost_yaw_diff = _masked_sum(yaw_diff**2, evaluated)
+    cost_cur = _masked_sum(trajectories.column("cur")**2, evaluated)
+
+    return weight_config["W_YAW"] * cost_yaw_diff + weight_config["W_CUR"] * cost_cur
+
+
+def vel_diff_batch(trajectories: TrajectoryBatch,
+                   ref_vel_list: Union[float, np.ndarray],
+                   weight_config: dict) -> np.ndarray:
+    """
+    Vectorized version of vel_diff.
+
+    Args:
+        trajectories (TrajectoryBatch): The candidate paths to evaluate.
+        ref_vel_list (Union[float, np.ndarray]): The reference velocity list for the paths.
+        weight_config (dict): The weight configuration for the cost calculation.
+
+    Returns:
+        np.ndarray: The velocity difference cost of every candidate.
+    """
+    cost_vel_diff = _masked_sum((trajectories.column("vel") - ref_vel_list)**2,
+                                trajectories.mask)
+    return weight_config["W_VEL_DIFF"] * cost_vel_diff
+
+
+def time_batch(trajectories: TrajectoryBatch,
+               weight_config: dict) -> np.ndarray:
+    """
+    Vectorized version of time.
+
+    Args:
+        trajectories (TrajectoryBatch): The candidate paths to evaluate.
+        weight_config (dict): The weight configuration for the cost calculation.
+
+    Returns:
+        np.ndarray: The time cost of every candidate.
+    """
+    last_t = trajectories.column("t")[np.arange(len(trajectories)),
+                                      trajectories.sizes - 1]
+    return weight_config["W_T"] * last_t
+
+
+def obs_batch(vehicle: Vehicle, trajectories: TrajectoryBatch,
+              obs_list: list, config: dict, offset_frame: int = 0) -> np.ndarray:
+    """
+    Obstacle cost of every candidate, see obs.
+
+    Args:
+        vehicle (Vehicle): The vehicle object.
+        trajectories (TrajectoryBatch): The candidate paths to evaluate.
+        obs_list (list): A list of Obstacle objects or an OccupancyIndex,
+            which only yields the obstacles near the candidates.
+        config (dict): The configuration for the cost calculation.
+        offset_frame (int>0): The offset frame for start frame of vehicle trajectory.
+
+    Returns:
+        np.ndarray: The obstacle cost of every candidate.
+    """
+    cost_obs = np.zeros(len(trajectories))
+    if isinstance(obs_list, OccupancyIndex) and len(trajectories):
+        obs_list = obs_list.nearby(vehicle, trajectories, offset_frame)
+    if obs_list:
+        for i in range(len(trajectories)):
+            cost_obs[i] = obs(vehicle, trajectories.trajectory(i), obs_list,
+                              config, offset_frame)
+    return cost_obs
+
+
+def guidance_batch(trajectories: TrajectoryBatch,
+                   weight_config: dict) -> np.ndarray:
+    """
+    Vectorized version of guidance.
+
+    Args:
+        trajectories (TrajectoryBatch): The candidate paths to evaluate.
+        weight_config (dict): The weight configuration for the cost calculation.
+
+    Returns:
+        np.ndarray: The guidance cost of every candidate.
+    """
+    cost_guidance = _masked_sum(trajectories.column("d")**2,
+                                trajectories.mask)
+    return weight_config["W_GUIDE"] * cost_guidance
+
+
+def acc_batch(trajectories: TrajectoryBatch,
+              weight_config: dict) -> np.ndarray:
+    """
+    Vectorized version of acc.
+
+    Args:
+        trajectories (TrajectoryBatch): The candidate paths to evaluate.
+        weight_config (dict): The weight configuration for the cost calculation.
+
+    Returns:
+        np.ndarray: The acceleration cost of every candidate.
+    """
+    cost_acc = _masked_sum(trajectories.column("acc")**2, trajectories.mask)
+    return weight_config["W_ACC"] * cost_acc
+
+
+def jerk_batch(trajectories: TrajectoryBatch,
+               weight_config: dict) -> np.ndarray:
+    """
+    Vectorized version of jerk.
+
+    Args:
+        trajectories (TrajectoryBatch): The candidate paths to evaluate.
+        weight_config (dict): The weight configuration for the cost calculation.
+
+    Returns:
+        np.ndarray: The jerk cost of every candidate.
+    """
+    cost_jerk = _masked_sum(
+        trajectories.column("s_ddd")**2 + trajectories.column("d_ddd")**2,
+        trajectories.mask)
+    return weight_config["W_JERK"] * cost_jerk
+
+
+def candidate_costs(vehicle: Vehicle, trajectories: TrajectoryBatch,
+                    ref_line: Spline2D, ref_vel_list: Union[float, np.ndarray],
+                    obs_list: list, config: dict,
+                    offset_frame: int = 0) -> dict:
+    """
+    Score all the candidates of a generator at once.
+
+    Args:
+        vehicle (Vehicle): The vehicle object.
+        trajectories (TrajectoryBatch): The candidate paths to evaluate.
+        ref_line (Spline2D): The reference line for the paths.
+        ref_vel_list (Union[float, np.ndarray]): The reference velocity for the paths.
+        obs_list (list): A list of Obstacle objects.
+        config (dict): The configuration for the cost calculation.
+        offset_frame (int>0): The offset frame for start frame of vehicle trajectory.
+
+    Returns:
+        dict: cost term name -> cost vector over the candidates, the per
+            state terms are already multiplied by DT
+    """
+    dt = config["DT"]
+    weight_config = config["weights"]
+    return {
+        "smoothness": smoothness_batch(trajectories, ref_line, weight_config) * dt,
+        "vel_diff": vel_diff_batch(trajectories, ref_vel_list, weight_config) * dt,
+        "guidance": guidance_batch(trajectories, weight_config) * dt,
+        "acc": acc_batch(trajectories, weight_config) * dt,
+        "jerk": jerk_batch(trajectories, weight_config) * dt,
+        "obs": obs_batch(vehicle, trajectories, obs_list, config, offset_frame),
+    }
+
+
 def stop(weight_config):
     return weight_config["W_STOP"]
 
@@ -30,6 +30,71 @@ def rotate_yaw(yaw: float) -> np.ndarray:
                      [-np.sin(yaw), np.cos(yaw)]], dtype=np.float32,)
 
 
+def check_collision_batch(
+    ego_center: np.ndarray,
+    ego_length: float,
+    ego_width: float,
+    ego_yaw: np.ndarray,
+    obs_center: np.ndarray,
+    obs_length: float,
+    obs_width: float,
+    obs_yaw: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized version of check_collsion_new. The poses are broadcast
+    against each other, e.g. ego poses of shape (M, 1) and obstacle poses of
+    shape (1, K) check all M x K pairs in one call.
+
+    Args:
+        ego_center (np.ndarray): The center coordinates of the ego vehicle, shape (..., 2).
+        ego_length (float): The length of the ego vehicle.
+        ego_width (float): The width of the ego vehicle.
+        ego_yaw (np.ndarray): The yaw angle of the ego vehicle.
+        obs_center (np.ndarray): The center coordinates of the obstacle, shape (..., 2).
+        obs_length (float): The length of the obstacle.
+        obs_width (float): The width of the obstacle.
+        obs_yaw (np.ndarray): The yaw angle of the obstacle.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The collision flags, and the corner of the
+                                       obstacle nearest to the ego center in the
+                                       ego frame, shape (..., 2). The corner is
+                                       only meaningful where there is no collision.
+    """
+    ego_center = np.asarray(ego_center, dtype=float)
+    obs_center = np.asarray(obs_center, dtype=float)
+
+    # obstacle center in the ego frame
+    cos_ego, sin_ego = np.cos(ego_yaw), np.sin(ego_yaw)
+    rel_x = obs_center[..., 0] - ego_center[..., 0]
+    rel_y = obs_center[..., 1] - ego_center[..., 1]
+    center_x = cos_ego * rel_x + sin_ego * rel_y
+    center_y = cos_ego * rel_y - sin_ego * rel_x
+
+    # separating axes of the ego box: the obstacle half extents projected on
+    # the ego axes plus the ego half extents must cover the center distance
+    rel_yaw = np.subtract(obs_yaw, ego_yaw)
+    cos_rel, sin_rel = np.cos(rel_yaw), np.sin(rel_yaw)
+    length_x, width_x = cos_rel * (obs_length / 2), sin_rel * (obs_width / 2)
+    length_y, width_y = sin_rel * (obs_length / 2), cos_rel * (obs_width / 2)
+    collide = (
+        (np.abs(center_x) - np.abs(length_x) - np.abs(width_x) <= ego_length / 2)
+        & (np.abs(center_y) - np.abs(length_y) - np.abs(width_y) <= ego_width / 2))
+
+    # the corners of the obstacle are center +- length axis +- width axis,
+    # the two axes are orthogonal so the corner nearest to the ego center
+    # goes against the center along each axis (first corner on ties)
+    length_sign = np.where(center_x * length_x + center_y * length_y >= 0,
+                           -1.0, 1.0)
+    width_sign = np.where(center_y * width_y - center_x * width_x >= 0,
+                          -1.0, 1.0)
+    nearest_corner = np.stack((
+        center_x + length_sign * length_x - width_sign * width_x,
+        center_y + length_sign * length_y + width_sign * width_y,
+    ), axis=-1)
+    return collide, nearest_corner
+
+
 def check_collsion_new(
     ego_center: np.ndarray,
     ego_length: float,
@@ -62,45 +127,14 @@ def check_collsion_new(
         https://juejin.cn/post/6974320430538883108
     """
 
-    # x,y一半的长度
-    ego_shape = np.array([ego_length / 2, ego_width / 2])
-    obs_shape = np.array([obs_length / 2, obs_width / 2])
-
-    rotate_ego = rotate_yaw(-ego_yaw)
-    rotate_obs = rotate_yaw(-obs_yaw)
-
-    iRotate_ego = np.linalg.inv(rotate_ego)  # A的逆矩阵，后续有用
-
-    obs_corner = (
-        np.array(
-            [
-                [-obs_shape[0], -obs_shape[1]],
-                [-obs_shape[0], obs_shape[1]],
-                [obs_shape[0], obs_shape[1]],
-                [obs_shape[0], -obs_shape[1]],
-            ]
-        )
-        @ rotate_yaw(-obs_yaw).T
-    ) + obs_center
-
-    # aBase = np.array([iRotate_ego.dot(item) for item in ego_corner])
-    iAPos = iRotate_ego.dot(ego_center)
-
-    bBase = np.array([iRotate_ego.dot(item) for item in obs_corner])
-    iBPos = iRotate_ego.dot(obs_center)
-
-    posTotal = abs(iBPos - iAPos)
-
-    rotateC = iRotate_ego.dot(rotate_obs)
-    bh = np.array([abs(item) for item in rotateC]).dot(obs_shape)
-    test_matrix = posTotal - bh - ego_shape
-    if test_matrix[0] <= 0 and test_matrix[1] <= 0:
+    collide, nearest_corner = check_collision_batch(
+        ego_center, ego_length, ego_width, ego_yaw,
+        obs_center, obs_length, obs_width, obs_yaw,
+    )
+    if collide:
         return True, None
     else:
-        obs_relative_corner = bBase - iAPos
-        dist = np.hypot(obs_relative_corner[:, 0], obs_relative_corner[:, 1])
-        index = np.where(dist == np.min(dist))
-        return False, obs_relative_corner[index][0]
+        return False, nearest_corner
 
 
 def calculate_static(vehicle: Vehicle, obs: dict, 
@@ -117,48 +151,42 @@ def calculate_static(vehicle: Vehicle, obs: dict,
     Returns:
         float: The static cost value.
     """
-    cost = 0
     car_width = vehicle.width
     car_length = vehicle.length
     dist_thershold = math.hypot(
         car_length + obs["length"], car_width + obs["width"])
 
-    # rotate and translate the obstacle
-    for i in range(0, len(trajectory.states), 2):
-        state = trajectory.states[i]
-        # todo: can change to AABB filt
-        dist = math.hypot(state.x - obs["pos"]
-                          ["x"], state.y - obs["pos"]["y"],)
-        if dist > dist_thershold:
-            continue
-        result, nearest_corner = check_collsion_new(
-            np.array([state.x, state.y]),
-            car_length,
-            car_width,
-            state.yaw,
-            np.array([obs["pos"]["x"], obs["pos"]["y"]]),
-            obs["length"],
-            obs["width"],
-            obs["pos"]["yaw"],
-        )
-        if result:
-            cost += math.inf
-            return cost
-        elif abs(nearest_corner[0]) > car_length or abs(nearest_corner[1]) > car_width:
-            continue
-        else:
-            if abs(nearest_corner[0]) > car_length / 2:
-                cost += (
-                    1 - (abs(nearest_corner[0]) -
-                         car_length / 2) / (car_length / 2)
-                ) * config["weights"]["W_COLLISION"]
-            if abs(nearest_corner[1]) > car_width / 2:
-                cost += (
-                    1 - (abs(nearest_corner[1]) -
-                         car_width / 2) / (car_width / 2)
-                ) * config["weights"]["W_COLLISION"]
-
-    return cost
+    # only every other state is checked
+    xs, ys = trajectory.column("x")[::2], trajectory.column("y")[::2]
+    obs_center = np.array([obs["pos"]["x"], obs["pos"]["y"]])
+    # todo: can change to AABB filt
+    near = np.hypot(xs - obs_center[0], ys - obs_center[1]) <= dist_thershold
+    if not np.any(near):
+        return 0
+    result, nearest_corner = check_collision_batch(
+        np.column_stack((xs, ys))[near],
+        car_length,
+        car_width,
+        trajectory.column("yaw")[::2][near],
+        obs_center,
+        obs["length"],
+        obs["width"],
+        obs["pos"]["yaw"],
+    )
+    if np.any(result):
+        return math.inf
+
+    corner_x, corner_y = np.abs(nearest_corner[:, 0]), np.abs(nearest_corner[:, 1])
+    close = (corner_x <= car_length) & (corner_y <= car_width)
+    corner_x, corner_y = corner_x[close], corner_y[close]
+    cost = np.sum(np.where(
+        corner_x > car_length / 2,
+        1 - (corner_x - car_length / 2) / (car_length / 2), 0))
+    cost += np.sum(np.where(
+        corner_y > car_width / 2,
+        1 - (corner_y - car_width / 2) / (car_width / 2), 0))
+
+    return cost * config["weights"]["W_COLLISION"]
 
 
 def calculate_pedestrian(vehicle: Vehicle,
@@ -178,62 +206,51 @@ def calculate_pedestrian(vehicle: Vehicle,
         float: The pedestrian cost value.
     """
     reaction_time = 2.0  # important param for avoid pedestrian
-    cost = 0
 
     car_width = vehicle.width
     car_length = vehicle.length
 
     dist_to_collide = (
-        reaction_time * trajectory.states[0].vel
+        reaction_time * trajectory.column("vel")[0]
         + 1 * car_length  # Reaction dist + Hard Collision
     )
-    for i in range(0, min(len(trajectory.states), int(reaction_time / config["DT"])), 2):
-        dist = math.hypot(
-            trajectory.states[i].x -
-            obs["pos"]["x"], trajectory.states[i].y - obs["pos"]["y"],
-        )
-        if dist > dist_to_collide:
-            continue
-
-        result, nearest_corner = check_collsion_new(
-            np.array([trajectory.states[i].x, trajectory.states[i].y]),
-            car_length,
-            car_width,
-            trajectory.states[i].yaw,
-            np.array([obs["pos"]["x"], obs["pos"]["y"]]),
-            obs["length"],
-            obs["width"] + car_width * 1.0,
-            0,
-        )
-        if result:
-            cost += math.inf
-            return cost
-        elif (
-            nearest_corner[0] > dist_to_collide
-            or nearest_corner[0] < -car_length
-            or abs(nearest_corner[1]) > 1.0 * car_width
-        ):
-            continue
-        else:
-            if nearest_corner[0] < -0.5 * car_length:
-                cost += (
-                    1 - (nearest_corner[0] + car_length *
-                         0.5) / (-car_length * 0.5)
-                ) * config["weights"]["W_COLLISION"]
-            if nearest_corner[0] > 0.5 * car_length:
-                cost += (
-                    1
-                    - (nearest_corner[0] - car_length * 0.5)
-                    / (dist_to_collide - car_length * 0.5)
-                ) * config["weights"]["W_COLLISION"]
-                # cost += config["weights"]["W_COLLISION"] * 10
-            if abs(nearest_corner[1]) > car_width / 2:
-                cost += (
-                    1 - (abs(nearest_corner[1]) -
-                         car_width / 2) / (0.5 * car_width)
-                ) * config["weights"]["W_COLLISION"]
-
-    return cost
+    # only every other state within the reaction time is checked
+    checked = slice(0, int(reaction_time / config["DT"]), 2)
+    xs, ys = trajectory.column("x")[checked], trajectory.column("y")[checked]
+    obs_center = np.array([obs["pos"]["x"], obs["pos"]["y"]])
+    near = np.hypot(xs - obs_center[0], ys - obs_center[1]) <= dist_to_collide
+    if not np.any(near):
+        return 0
+
+    result, nearest_corner = check_collision_batch(
+        np.column_stack((xs, ys))[near],
+        car_length,
+        car_width,
+        trajectory.column("yaw")[checked][near],
+        obs_center,
+        obs["length"],
+        obs["width"] + car_width * 1.0,
+        0,
+    )
+    if np.any(result):
+        return math.inf
+
+    corner_x, corner_y = nearest_corner[:, 0], np.abs(nearest_corner[:, 1])
+    close = ((corner_x <= dist_to_collide) & (corner_x >= -car_length) &
+             (corner_y <= 1.0 * car_width))
+    corner_x, corner_y = corner_x[close], corner_y[close]
+    cost = np.sum(np.where(
+        corner_x < -0.5 * car_length,
+        1 - (corner_x + car_length * 0.5) / (-car_length * 0.5), 0))
+    cost += np.sum(np.where(
+        corner_x > 0.5 * car_length,
+        1 - (corner_x - car_length * 0.5) / (dist_to_collide - car_length * 0.5),
+        0))
+    cost += np.sum(np.where(
+        corner_y > car_width / 2,
+        1 - (corner_y - car_width / 2) / (0.5 * car_width), 0))
+
+    return cost * config["weights"]["W_COLLISION"]
 
 
 def calculate_car(vehicle: Vehicle, obs: dict, 
@@ -250,63 +267,68 @@ def calculate_car(vehicle: Vehicle, obs: dict,
     Returns:
         float: The car cost value.
     """
-    cost = 0
     car_length = vehicle.length
     car_width = vehicle.width
     
     if vehicle.lane_id == obs.lane_id and vehicle.current_state.s > obs.current_state.s: # obs car is behind ego car on the same lane
-            return cost
+            return 0
     # ATTENSION: for speed up, we only check every 2 points
-    for i in range(0, min(len(trajectory.states), len(obs.future_trajectory.states) - offset_frame), 2):
-        ego_state = trajectory.states[i]
-        obs_state = obs.future_trajectory.states[i + offset_frame]
-        dist = math.hypot(
-            ego_state.x - obs_state.x,
-            ego_state.y - obs_state.y,
-        )
-        dist_to_collide = (
-            3 * (max(0, ego_state.vel - obs_state.vel))  # TTC
-            + 0.5* ego_state.vel  # Reaction dist
-            + 1 * car_length  # Hard Collision
-        )
-        if dist > dist_to_collide:
-            # if obs far away at beginning, we don't care
-            return cost
-        result, nearest_corner = check_collsion_new(
-            np.array([ego_state.x, ego_state.y]),
-            car_length*1.5,
-            car_width*1.1,
-            ego_state.yaw,
-            np.array([obs_state.x, obs_state.y]),
-            obs.shape.length,
-            obs.shape.width,
-            obs_state.yaw,
-        )
-        if result:
-            cost += math.inf
-            return cost
-        elif (
-            nearest_corner[0] > dist_to_collide
-            or nearest_corner[0] < -1.5 * car_length
-            or abs(nearest_corner[1]) > 0.9 * car_width
-        ):
-            continue
-        else:
-            if abs(nearest_corner[1]) > 0.5 * car_width:
-                cost += (
-                    1 - (abs(nearest_corner[1]) -
-                         car_width * 0.5) / (car_width * 0.2)
-                ) * config["weights"]["W_COLLISION"]
-            if nearest_corner[0] > 0.5 * car_length:
-                cost += (
-                    1
-                    - (nearest_corner[0] - car_length * 0.5)
-                    / (dist_to_collide - car_length * 0.5)
-                ) * config["weights"]["W_COLLISION"] * 10
-            if nearest_corner[0] < -0.5 * car_length:
-                cost += (
-                    1 - (nearest_corner[0] + car_length *
-                         0.5) / (-car_length * 1.0)
-                ) * config["weights"]["W_COLLISION"]
-
-    return cost
+    obs_trajectory = obs.future_trajectory
+    size = min(len(trajectory), len(obs_trajectory) - offset_frame)
+    if size <= 0:
+        return 0
+    ego_x, ego_y = trajectory.column("x"), trajectory.column("y")
+    ego_vel = trajectory.column("vel")
+    obs_x, obs_y = obs_trajectory.column("x"), obs_trajectory.column("y")
+    obs_vel = obs_trajectory.column("vel")
+    if math.hypot(ego_x[0] - obs_x[offset_frame],
+                  ego_y[0] - obs_y[offset_frame]) > (
+                      3 * max(0, ego_vel[0] - obs_vel[offset_frame]) +
+                      0.5 * ego_vel[0] + car_length):
+        # if obs far away at beginning, we don't care
+        return 0
+
+    ego, other = slice(0, size, 2), slice(offset_frame, offset_frame + size, 2)
+    ego_x, ego_y, ego_vel = ego_x[ego], ego_y[ego], ego_vel[ego]
+    obs_x, obs_y = obs_x[other], obs_y[other]
+    dist = np.hypot(ego_x - obs_x, ego_y - obs_y)
+    dist_to_collide = (
+        3 * np.maximum(0, ego_vel - obs_vel[other])  # TTC
+        + 0.5* ego_vel  # Reaction dist
+        + 1 * car_length  # Hard Collision
+    )
+    # stop checking once the obs is far away
+    far = dist > dist_to_collide
+    checked = np.argmax(far) if np.any(far) else len(far)
+
+    result, nearest_corner = check_collision_batch(
+        np.column_stack((ego_x, ego_y))[:checked],
+        car_length*1.5,
+        car_width*1.1,
+        trajectory.column("yaw")[ego][:checked],
+        np.column_stack((obs_x, obs_y))[:checked],
+        obs.shape.length,
+        obs.shape.width,
+        obs_trajectory.column("yaw")[other][:checked],
+    )
+    if np.any(result):
+        return math.inf
+
+    corner_x, corner_y = nearest_corner[:, 0], np.abs(nearest_corner[:, 1])
+    dist_to_collide = dist_to_collide[:checked]
+    close = ((corner_x <= dist_to_collide) & (corner_x >= -1.5 * car_length) &
+             (corner_y <= 0.9 * car_width))
+    corner_x, corner_y = corner_x[close], corner_y[close]
+    dist_to_collide = dist_to_collide[close]
+    cost = np.sum(np.where(
+        corner_y > 0.5 * car_width,
+        1 - (corner_y - car_width * 0.5) / (car_width * 0.2), 0))
+    cost += np.sum(np.where(
+        corner_x > 0.5 * car_length,
+        (1 - (corner_x - car_length * 0.5) /
+         (dist_to_collide - car_length * 0.5)) * 10, 0))
+    cost += np.sum(np.where(
+        corner_x < -0.5 * car_length,
+        1 - (corner_x + car_length * 0.5) / (-car_length * 1.0), 0))
+
+    return cost * config["weights"]["W_COLLISION"]
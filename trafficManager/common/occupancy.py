@@ -0,0 +1,211 @@
+"""
+A time-indexed occupancy index over the obstacles of one planning tick.
+
+The obstacles are built once from the prediction and shared by every planned
+vehicle. The predicted positions of the cars are bucketed into a uniform grid
+per time step, so that the obstacle cost of a vehicle only visits the cars
+that are close to its candidates.
+"""
+from __future__ import annotations
+
+import copy
+from typing import Iterator, List
+
+import numpy as np
+
+from common.observation import Observation
+from common.vehicle import Vehicle
+from predictor.abstract_predictor import Prediction
+
+from utils.obstacles import DynamicObstacle, Obstacle, ObsType, Rectangle
+from utils.trajectory import State, Trajectory, TrajectoryBatch
+
+PREDICTED_FIELDS = ("x", "y", "s", "d", "yaw", "vel")
+
+
+class OccupancyIndex:
+    """
+    The obstacles of a planning tick with a (time step, grid cell) index over
+    the future trajectories of the cars. Iterating the index yields the
+    obstacles like a plain obstacle list does.
+
+    Attributes:
+        obstacles (List[Obstacle]): all obstacles, in insertion order.
+        cell_size (float): side length of the grid cells [m].
+    """
+
+    def __init__(self, obstacles: List[Obstacle],
+                 cell_size: float = 20.0) -> None:
+        self.obstacles: List[Obstacle] = list(obstacles)
+        self.cell_size = cell_size
+        self._excluded = None
+        self._build()
+
+    @classmethod
+    def from_prediction(cls, observation: Observation, prediction: Prediction,
+                        cell_size: float = 20.0) -> OccupancyIndex:
+        """Build the obstacles of a tick: the static obstacles of the
+           observation and one car for every non-empty prediction.
+
+        Args:
+            observation (Observation): the observation of the tick
+            prediction (Prediction): the predicted states of the vehicles
+            cell_size (float, optional): grid cell size [m]. Defaults to 20.0.
+
+        Returns:
+            OccupancyIndex: the index over all obstacles
+        """
+        obstacles = list(observation.obstacles)
+        batch = prediction.batch
+        columns = {name: batch.column(name) for name in PREDICTED_FIELDS}
+        for i, vehicle in enumerate(prediction.vehicles):
+            size = batch.sizes[i]
+            if not size:
+                continue
+            current_state = State(**{
+                name: float(column[i, 0])
+                for name, column in columns.items()
+            })
+            future_trajectory = Trajectory.from_columns(**{
+                name: column[i, 1:size]
+                for name, column in columns.items()
+            })
+            obstacles.append(
+                DynamicObstacle(obstacle_id=vehicle.id,
+                                shape=Rectangle(vehicle.length, vehicle.width),
+                                obstacle_type=ObsType.CAR,
+                                current_state=current_state,
+                                lane_id=vehicle.lane_id,
+                                future_trajectory=future_trajectory))
+        return cls(obstacles, cell_size)
+
+    def _build(self) -> None:
+        cars = [
+            i for i, obs in enumerate(self.obstacles)
+            if obs.type == ObsType.CAR
+        ]
+        self._is_car = np.zeros(len(self.obstacles), dtype=bool)
+        self._is_car[cars] = True
+        steps = max((len(self.obstacles[i].future_trajectory) for i in cars),
+                    default=0)
+        # (obstacle, step) positions, nan after the end of a trajectory
+        self._x = np.full((len(self.obstacles), steps), np.nan)
+        self._y = np.full((len(self.obstacles), steps), np.nan)
+        self._vel = np.full((len(self.obstacles), steps), np.nan)
+        for i in cars:
+            trajectory = self.obstacles[i].future_trajectory
+            size = len(trajectory)
+            self._x[i, :size] = trajectory.column("x")
+            self._y[i, :size] = trajectory.column("y")
+            self._vel[i, :size] = trajectory.column("vel")
+
+        owners, step = np.nonzero(~np.isnan(self._x))
+        cell_x = np.floor(self._x[owners, step] / self.cell_size).astype(int)
+        cell_y = np.floor(self._y[owners, step] / self.cell_size).astype(int)
+        if owners.size:
+            self._origin = (cell_x.min(), cell_y.min())
+            self._grid_shape = (cell_x.max() - cell_x.min() + 1,
+                                cell_y.max() - cell_y.min() + 1)
+        else:
+            self._origin, self._grid_shape = (0, 0), (0, 0)
+        keys = self._cell_keys(step, cell_x - self._origin[0],
+                               cell_y - self._origin[1])
+        order = np.argsort(keys, kind="stable")
+        self._keys, self._owners = keys[order], owners[order]
+
+    def _cell_keys(self, step, cell_x, cell_y) -> np.ndarray:
+        width, height = self._grid_shape
+        return (np.asarray(step, dtype=np.int64) * width + cell_x) * height + cell_y
+
+    def __iter__(self) -> Iterator[Obstacle]:
+        return (obs for obs in self.obstacles
+                if self._excluded is None or obs.id != self._excluded)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def without(self, obstacle_id) -> OccupancyIndex:
+        """A view of the index that skips one obstacle, usually the vehicle
+           that is being planned. The view shares the index arrays."""
+        view = copy.copy(self)
+        view._excluded = obstacle_id
+        return view
+
+    def query(self, step: int, x: np.ndarray, y: np.ndarray,
+              radius: np.ndarray) -> np.ndarray:
+        """Find the cars whose predicted position at a time step is within
+           the radius of any of the given points.
+
+        Args:
+            step (int): index into the future trajectories of the cars
+            x (np.ndarray): x of the points
+            y (np.ndarray): y of the points
+            radius (np.ndarray): search radius around each point
+
+        Returns:
+            np.ndarray: sorted indices into self.obstacles
+        """
+        x, y, radius = np.broadcast_arrays(np.ravel(x), np.ravel(y),
+                                           np.ravel(radius))
+        if x.size == 0 or not 0 <= step < self._x.shape[1]:
+            return np.empty(0, dtype=int)
+
+        # cells covered by the bounding box of all search circles
+        width, height = self._grid_shape
+        low_x, high_x = np.floor(
+            np.array([np.min(x - radius), np.max(x + radius)]) /
+            self.cell_size).astype(int) - self._origin[0]
+        low_y, high_y = np.floor(
+            np.array([np.min(y - radius), np.max(y + radius)]) /
+            self.cell_size).astype(int) - self._origin[1]
+        cell_x = np.arange(max(low_x, 0), min(high_x, width - 1) + 1)
+        cell_y = np.arange(max(low_y, 0), min(high_y, height - 1) + 1)
+        if cell_x.size == 0 or cell_y.size == 0:
+            return np.empty(0, dtype=int)
+        keys = self._cell_keys(step, cell_x[:, np.newaxis],
+                               cell_y[np.newaxis, :]).ravel()
+        starts = np.searchsorted(self._keys, keys, side="left")
+        ends = np.searchsorted(self._keys, keys, side="right")
+        owners = np.unique(np.concatenate(
+            [self._owners[start:end] for start, end in zip(starts, ends)]))
+
+        dist = np.hypot(x - self._x[owners, step, np.newaxis],
+                        y - self._y[owners, step, np.newaxis])
+        owners = owners[np.any(dist <= radius, axis=1)]
+        if self._excluded is not None:
+            owners = np.array([
+                i for i in owners if self.obstacles[i].id != self._excluded
+            ], dtype=int)
+        return owners
+
+    def nearby(self, vehicle: Vehicle, trajectories: TrajectoryBatch,
+               offset_frame: int = 0) -> List[Obstacle]:
+        """Obstacles that may contribute to the obstacle cost of candidates.
+           The car cost ignores any car that is out of reach at the first
+           state of a candidate, so only that time step is queried. The
+           reach bound uses the slowest car at that step, which makes the
+           result a superset of the cars the cost evaluates. Obstacles that
+           are not cars are always returned.
+
+        Args:
+            vehicle (Vehicle): the planned vehicle
+            trajectories (TrajectoryBatch): the candidates
+            offset_frame (int, optional): the time step of the first state
+                of the candidates. Defaults to 0.
+
+        Returns:
+            List[Obstacle]: the obstacles in the order of self.obstacles
+        """
+        ego_x = trajectories.column("x")[:, 0]
+        ego_y = trajectories.column("y")[:, 0]
+        ego_vel = trajectories.column("vel")[:, 0]
+        keep = ~self._is_car
+        if 0 <= offset_frame < self._x.shape[1]:
+            min_vel = np.nanmin(self._vel[:, offset_frame], initial=np.inf)
+            reach = (3 * np.maximum(0, ego_vel - min_vel) + 0.5 * ego_vel +
+                     vehicle.length)
+            keep[self.query(offset_frame, ego_x, ego_y, reach)] = True
+        return [
+            obs for obs, kept in zip(self.obstacles, keep)
+            if kept and (self._excluded is None or obs.id != self._excluded)
+        ]
@@ -354,7 +354,8 @@ def find_lane_position(lane_id: str, roadgraph: RoadGraph,
             if abs(pos_d) < 2.0:
                 return available_lane_id, pos_s, pos_d
     else:
-        pos_s, pos_d = lane.course_spline.cartesian_to_frenet1D(pos_x, pos_y)
+        pos_s, pos_d = lane.course_spline.cartesian_to_frenet1D(
+            pos_x, pos_y, lane_pos)
         return lane_id, pos_s, pos_d
     return None, None, None
 
@@ -408,7 +409,7 @@ def create_vehicle_lastseen(vehicle_info: Dict, lastseen_vehicle: Vehicle,
         x = vehicle_info["xQ"][-1]
         y = vehicle_info["yQ"][-1]
         try:
-            s, d = lane.course_spline.cartesian_to_frenet1D(x, y)
+            s, d = lane.course_spline.cartesian_to_frenet1D(x, y, lanepos)
         except TypeError:
             logging.error("Vehicle line 185:", vehicle_info["lanePosQ"],
                           lanepos, lane.course_spline.s[-1])
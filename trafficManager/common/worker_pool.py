@@ -0,0 +1,129 @@
+"""
+A persistent process pool for the planning and decision making modules.
+
+The roadgraph is large and changes only with the scene, so it is written to a
+file once per scene and loaded by every worker once per version. The inputs
+of a planning tick are pickled once and unpickled once per tick by a worker,
+whatever the number of tasks it runs.
+"""
+import itertools
+import multiprocessing
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Tuple
+
+from utils.roadgraph import RoadGraph
+
+# cached inputs of a worker process
+_worker_scene = (None, None)  # (scene version, roadgraph)
+_worker_tick = (None, None)  # (tick id, tick inputs)
+
+
+def load_scene(scene: Tuple[int, str]) -> RoadGraph:
+    """Roadgraph of a scene in a worker process, only loaded from the file
+       when the version changes."""
+    global _worker_scene
+    if _worker_scene[0] != scene[0]:
+        with open(scene[1], "rb") as f:
+            _worker_scene = (scene[0], pickle.load(f))
+    return _worker_scene[1]
+
+
+def load_tick(tick: Tuple[int, bytes]) -> Any:
+    """Inputs of a tick in a worker process, only unpickled when the id
+       changes."""
+    global _worker_tick
+    if _worker_tick[0] != tick[0]:
+        _worker_tick = (tick[0], pickle.loads(tick[1]))
+    return _worker_tick[1]
+
+
+class _RecordingContext:
+    """
+    The default multiprocessing context, except that it records the worker
+    processes a pool starts with it, so that they can be terminated.
+    """
+
+    def __init__(self) -> None:
+        self._context = multiprocessing.get_context()
+        self.processes: List[multiprocessing.Process] = []
+
+    def Process(self, *args, **kwargs) -> multiprocessing.Process:
+        process = self._context.Process(*args, **kwargs)
+        self.processes.append(process)
+        return process
+
+    def __getattr__(self, name: str):
+        return getattr(self._context, name)
+
+
+class WorkerPool:
+    """
+    A ProcessPoolExecutor that is kept across ticks, together with the
+    roadgraph file and the tick ids handed to its workers.
+    """
+
+    def __init__(self, prefix: str = "worker_scene_") -> None:
+        self._prefix = prefix
+        self._pool: ProcessPoolExecutor = None
+        self._pool_context: _RecordingContext = None
+        self._pool_workers = 0
+        self._scene_dir: tempfile.TemporaryDirectory = None
+        self._scene_key = None
+        self._scene: Tuple[int, str] = None
+        self._tick_ids = itertools.count()
+
+    def executor(self, workers: int) -> ProcessPoolExecutor:
+        """The pool, created again when the number of workers changes."""
+        if self._pool is None or self._pool_workers != workers:
+            self.close()
+            self._pool_context = _RecordingContext()
+            self._pool = ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=self._pool_context)
+            self._pool_workers = workers
+            self._scene_dir = tempfile.TemporaryDirectory(prefix=self._prefix)
+        return self._pool
+
+    def share_scene(self, roadgraph: RoadGraph) -> Tuple[int, str]:
+        """Write the roadgraph to a file for the workers when the lanes of
+           the scene have changed.
+
+        Returns:
+            Tuple[int, str]: version and path of the roadgraph file
+        """
+        scene_key = (frozenset(roadgraph.lanes),
+                     frozenset(roadgraph.junction_lanes))
+        if scene_key != self._scene_key:
+            version = 0 if self._scene is None else self._scene[0] + 1
+            path = os.path.join(self._scene_dir.name, f"roadgraph_{version}.pkl")
+            with open(path, "wb") as f:
+                pickle.dump(roadgraph, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if self._scene is not None:
+                os.remove(self._scene[1])
+            self._scene_key, self._scene = scene_key, (version, path)
+        return self._scene
+
+    def share_tick(self, inputs: Any) -> Tuple[int, bytes]:
+        """Pickle the inputs of a tick under a new id."""
+        return (next(self._tick_ids),
+                pickle.dumps(inputs, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def close(self, wait: bool = True) -> None:
+        """Shut down the pool, if any. Without waiting, the worker processes
+           are terminated, which also stops the tasks they are running."""
+        if self._pool is not None:
+            if wait:
+                self._pool.shutdown(cancel_futures=True)
+            else:
+                # shutdown only cancels the tasks that have not started
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                for process in self._pool_context.processes:
+                    if process.is_alive():
+                        process.terminate()
+            self._pool, self._pool_context = None, None
+        if self._scene_dir is not None:
+            self._scene_dir.cleanup()
+            self._scene_dir = None
+        self._scene_key, self._scene = None, None
@@ -57,3 +57,8 @@ class AbstractMultiDecisionMaker(ABC):
         prediction: Prediction = None,
     ) -> MultiDecision:
         pass
+
+    def close(self) -> None:
+        """Release the resources of the decision maker, e.g. worker
+           processes."""
+        pass
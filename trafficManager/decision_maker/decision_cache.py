@@ -0,0 +1,114 @@
+"""
+Description:
+A cache of the decisions of vehicle groups, keyed by a quantized snapshot of
+the group. Steady traffic, such as a platoon on a long corridor, gives the
+same snapshot decision after decision, and its cached joint actions are
+replayed from the current states instead of searching the group again.
+
+Copyright (c) 2023 by PJLab, All Rights Reserved.
+"""
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+from common.vehicle import Vehicle
+from utils.roadgraph import JunctionLane, NormalLane, RoadGraph
+
+import logger
+
+logging = logger.get_logger(__name__)
+
+
+class DecisionCache:
+    """
+    LRU cache of the joint actions decided for vehicle groups. An entry lives
+    for at most DECISION_CACHE_TTL seconds of simulation time after the
+    search that produced it, and the least recently used entries are evicted
+    beyond DECISION_CACHE_SIZE entries.
+    """
+
+    def __init__(self) -> None:
+        # signature -> (decision time, moves of the decided branch)
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def signature(vehicles: List[Vehicle], road_graph: RoadGraph,
+                  config: dict) -> Tuple[Hashable, ...]:
+        """Quantized snapshot of a group. Each vehicle is described by its
+           id, lane, behaviour, binned d and velocity, binned gap to the
+           first vehicle of the group and binned distance to the end of its
+           lane. The distance is only kept when the vehicle can reach the
+           end of the lane within MAX_DECISION_TIME, so a group far from
+           any lane end keeps its signature while it moves along the lanes.
+           The signals of the junction lanes ahead are part of it too.
+
+        Args:
+            vehicles (List[Vehicle]): vehicles of the group
+            road_graph (RoadGraph): road graph of the decision
+            config (dict): the decision config
+
+        Returns:
+            Tuple[Hashable, ...]: the signature of the group
+        """
+        horizon = config["MAX_DECISION_TIME"]
+        s_bin = config["DECISION_CACHE_S_BIN"]
+        d_bin = config["DECISION_CACHE_D_BIN"]
+        vel_bin = config["DECISION_CACHE_VEL_BIN"]
+        vehicles = sorted(vehicles, key=lambda veh: veh.id)
+        first_s = vehicles[0].current_state.s
+        snapshot = []
+        for veh in vehicles:
+            state = veh.current_state
+            lane = road_graph.get_lane_by_id(veh.lane_id)
+            lane_end = None
+            signals = ()
+            if lane is not None:
+                reach = (state.vel * horizon +
+                         0.5 * config["DEFAULT_ACC"] * horizon**2)
+                if lane.spline_length - state.s <= reach:
+                    lane_end = round((lane.spline_length - state.s) / s_bin)
+                if isinstance(lane, JunctionLane):
+                    signals = ((lane.id, lane.currTlState), )
+                elif isinstance(lane, NormalLane):
+                    signals = tuple(sorted(
+                        (via_lane_id, road_graph.junction_lanes[via_lane_id].currTlState)
+                        for via_lane_id, _ in lane.next_lanes.values()
+                        if via_lane_id in road_graph.junction_lanes))
+            snapshot.append((
+                veh.id,
+                veh.lane_id,
+                veh.behaviour,
+                round((state.s - first_s) / s_bin),
+                round(state.d / d_bin),
+                round(state.vel / vel_bin),
+                lane_end,
+                signals,
+            ))
+        return tuple(snapshot)
+
+    def get(self, signature: Tuple[Hashable, ...], T: float,
+            config: dict) -> Optional[List[tuple]]:
+        """Moves cached for the signature, None if there are none or they
+           are older than DECISION_CACHE_TTL."""
+        entry = self._entries.get(signature)
+        if entry is not None and T - entry[0] > config["DECISION_CACHE_TTL"]:
+            del self._entries[signature]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(signature)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, signature: Tuple[Hashable, ...], T: float,
+            moves: List[tuple], config: dict) -> None:
+        """Cache the moves decided at time T for the signature."""
+        self._entries[signature] = (T, moves)
+        self._entries.move_to_end(signature)
+        while len(self._entries) > config["DECISION_CACHE_SIZE"]:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -6,50 +6,217 @@ Flow state is used to represent the state of the flow in the MCTS tree.
 
 Copyright (c) 2023 by PJLab, All Rights Reserved. 
 """
+import copy
 import itertools
 import math
 import random
 
 import numpy as np
 from common.vehicle import State, Vehicle, Behaviour, VehicleType
-from common.obstacle_cost import check_collsion_new
+from common.obstacle_cost import check_collision_batch
 from utils.roadgraph import RoadGraph, NormalLane, JunctionLane
-from utils import data_copy
 from abstract_decision_maker import MultiDecision
 from predictor.abstract_predictor import Prediction
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple
 
 
-class FlowState:
+class FlowContext:
     """
-    states_list:[[veh_1,veh_2,...],[veh_1,veh_2,...],...]
-
-    actions:{'id1':[action1,action2,...],'id2':[action1,action2,...],...}
+    Data shared by all flow states of one decision group: the vehicles, a
+    table of the lanes they can reach and the obstacles of the other groups
+    and of the vehicles out of AoI.
     """
 
     def __init__(
         self,
-        states_list: List,
+        vehicles: List[Vehicle],
         road_graph: RoadGraph,
-        actions: Dict[str, List],
         complete_decisions: MultiDecision,
         prediction: Prediction,
-        time: float,
         config: Dict,
     ) -> None:
-        self.states_list = states_list
-        self.time = time
+        self.vehicles = list(vehicles)
         self.road_graph = road_graph
-        self.actions = actions
         self.complete_decisions = complete_decisions
         self.prediction = prediction
-        self.num_moves = None
         self.config = config
 
-        self.next_action = []
+        self.length = np.array([veh.length for veh in self.vehicles],
+                               dtype=float)
+        self.width = np.array([veh.width for veh in self.vehicles],
+                              dtype=float)
+        self.yaw = np.array([veh.current_state.yaw for veh in self.vehicles],
+                            dtype=float)
+        self.max_speed = np.array([veh.max_speed for veh in self.vehicles],
+                                  dtype=float)
+        # rows of the prediction that are obstacles, the vehicles out of AoI
+        self.predicted_rows = np.array([
+            row for row, veh in enumerate(prediction.vehicles)
+            if veh.vtype == VehicleType.OUT_OF_AOI
+        ], dtype=int)
+        self.predicted_length = np.array(
+            [veh.length for veh in prediction.vehicles], dtype=float)
+        self.predicted_width = np.array(
+            [veh.width for veh in prediction.vehicles], dtype=float)
+
+        # lane table, lanes are referenced by their index in self.lanes
+        self.lanes = []
+        self.lane_ids: List[str] = []
+        self._lane_index: Dict[str, int] = {}
+        self._side_lanes: Dict[Tuple[int, str], int] = {}
+        self._next_lanes: Dict[Tuple[int, int], int] = {}
+        self._obstacles: Dict[Tuple[int, int], np.ndarray] = {}
+        self._screens: Dict[Tuple, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def lane_index(self, lane_id: str) -> int:
+        """Index of a lane in the lane table, -1 for unknown lanes."""
+        if lane_id not in self._lane_index:
+            lane = self.road_graph.get_lane_by_id(lane_id)
+            if lane is None:
+                return -1
+            self._lane_index[lane_id] = len(self.lanes)
+            self.lanes.append(lane)
+            self.lane_ids.append(lane_id)
+        return self._lane_index[lane_id]
+
+    def side_lane(self, lane_idx: int, side: str) -> int:
+        """Index of the left or right neighbour of a normal lane, -1 if
+           there is none in the roadgraph."""
+        key = (lane_idx, side)
+        if key not in self._side_lanes:
+            lane = self.lanes[lane_idx]
+            side_id = lane.left_lane() if side == "left" else lane.right_lane()
+            self._side_lanes[key] = self.lane_index(side_id)
+        return self._side_lanes[key]
+
+    def next_lane(self, veh_idx: int, lane_idx: int) -> int:
+        """Index of the next lane of a vehicle within its available lanes,
+           -1 if there is none."""
+        key = (veh_idx, lane_idx)
+        if key not in self._next_lanes:
+            next_lane = self.road_graph.get_available_next_lane(
+                self.lane_ids[lane_idx], self.vehicles[veh_idx].available_lanes)
+            self._next_lanes[key] = (-1 if next_lane is None else
+                                     self.lane_index(next_lane.id))
+        return self._next_lanes[key]
+
+    def is_available(self, veh_idx: int, lane_idx: int) -> bool:
+        return self.lane_ids[lane_idx] in self.vehicles[veh_idx].available_lanes
+
+    def obstacles(self, decision_idx: int, prediction_idx: int) -> np.ndarray:
+        """Boxes (x, y, yaw, length, width) of the decided vehicles of the
+           other groups and the predicted vehicles out of AoI, shape (K, 5)."""
+        key = (decision_idx, prediction_idx)
+        if key not in self._obstacles:
+            boxes = []
+            for other_veh, decisions in self.complete_decisions.results.items():
+                if decision_idx < len(decisions):
+                    state = decisions[decision_idx].expected_state
+                    boxes.append((state.x, state.y, state.yaw,
+                                  other_veh.length, other_veh.width))
+            boxes = np.array(boxes, dtype=float).reshape(-1, 5)
+            rows = self.predicted_rows[
+                self.prediction.batch.sizes[self.predicted_rows] > prediction_idx]
+            if rows.size:
+                predicted = np.empty((rows.size, 5))
+                for j, name in enumerate(("x", "y", "yaw")):
+                    predicted[:, j] = self.prediction.batch.column(name)[
+                        rows, prediction_idx]
+                predicted[:, 3] = self.predicted_length[rows]
+                predicted[:, 4] = self.predicted_width[rows]
+                boxes = np.concatenate((boxes, predicted))
+            self._obstacles[key] = boxes
+        return self._obstacles[key]
+
+    def screen(self, veh_idx: np.ndarray, decision_idx: int, prediction_idx: int
+               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The parts of the collision check of the deciding vehicles that do
+           not depend on their positions.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: the other boxes, i.e.
+                the obstacles followed by the deciding vehicles, shape
+                (K + N, 5), the distance under which each (vehicle, other
+                box) pair needs the exact check, -1 for the pairs that are
+                not checked, shape (N, K + N), and a (2, K + N) buffer of the
+                x, y of the other boxes whose last N columns are left to
+                fill. The distances are None if no pair is checked.
+        """
+        key = (decision_idx, prediction_idx, *veh_idx.tolist())
+        if key not in self._screens:
+            obstacles = self.obstacles(decision_idx, prediction_idx)
+            boxes = np.zeros((len(veh_idx), 5))
+            boxes[:, 2] = self.yaw[veh_idx]
+            boxes[:, 3] = self.length[veh_idx]
+            boxes[:, 4] = self.width[veh_idx]
+            others = np.concatenate((obstacles, boxes))
+            reach = np.hypot(boxes[:, np.newaxis, 3] + others[:, 3],
+                             boxes[:, np.newaxis, 4] + others[:, 4])
+            # every obstacle and the vehicles before them in the group
+            pairs = np.concatenate(
+                (np.ones((len(veh_idx), len(obstacles)), dtype=bool),
+                 np.tri(len(veh_idx), k=-1, dtype=bool)), axis=1)
+            self._screens[key] = (
+                others,
+                np.where(pairs, reach, -1.0) if pairs.any() else None,
+                others[:, :2].T.copy(),
+            )
+        return self._screens[key]
+
+
+class FlowState:
+    """
+    A node state of the decision group. The vehicles that are still deciding
+    are stored as arrays of (lane index, s, d, vel) plus their cartesian
+    position. The history of the flow is reached through the parent pointers.
+
+    veh_idx: indices of the deciding vehicles into context.vehicles
+    actions: the action of each deciding vehicle that led to this state
+    move: the joint action that led to this state, as sorted (vehicle id,
+        action) pairs of the vehicles deciding in the parent
+    actions_list: the actions available to each deciding vehicle, the joint
+        actions are their product and are numbered in mixed radix, so they
+        are sampled without being enumerated
+    finished: key entries of the vehicles that left the flow at the end of
+        their available lanes, see _final_entries
+    """
+
+    def __init__(
+        self,
+        context: FlowContext,
+        time: float,
+        veh_idx: np.ndarray,
+        lane: np.ndarray,
+        s: np.ndarray,
+        d: np.ndarray,
+        vel: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        actions: Tuple[str, ...] = (),
+        parent: "FlowState" = None,
+        move: Tuple[Tuple[str, str], ...] = (),
+        finished: Tuple = (),
+    ) -> None:
+        self.context = context
+        self.config = context.config
+        self.time = time
+        self.veh_idx, self.lane = veh_idx, lane
+        self.s, self.d, self.vel = s, d, vel
+        self.x, self.y = x, y
+        self.actions = actions
+        self.parent = parent
+        self.move = move
+        self.finished = finished
+        self._progress = None
+        self.num_moves = None
+
+        self.actions_list: List[List[str]] = []
+        # untried joint actions, a lazy Fisher-Yates shuffle of their numbers
+        self._untried = 0
+        self._shuffled: Dict[int, int] = {}
         if (
             self.time >= self.config["MAX_DECISION_TIME"]
-            or len(self.states_list[-1]) == 0
+            or len(self.veh_idx) == 0
         ):
             return
 
@@ -57,58 +224,26 @@ class FlowState:
         prediction_idx = int(self.time // self.config["DT"])
 
         # detect collision for states and prediction states
-        # todo: extract as a function
-        current_vehs = self.states_list[-1]
-        for i, decision_veh in enumerate(current_vehs):
-            current_state = decision_veh.current_state
-            for other_veh, decisions in self.complete_decisions.results.items():
-                if decision_idx < len(decisions):
-                    is_collide = self._check_collision(
-                        decision_veh,
-                        current_state,
-                        other_veh,
-                        decisions[decision_idx].expected_state,
-                    )
-                    if is_collide:
-                        self.num_moves = 0
-                        return
-            for other_veh, states in self.prediction.results.items():
-                if other_veh.vtype != VehicleType.OUT_OF_AOI:
-                    continue
-                if prediction_idx < len(states):
-                    is_collide = self._check_collision(
-                        decision_veh, current_state, other_veh, states[prediction_idx]
-                    )
-                    if is_collide:
-                        self.num_moves = 0
-                        return
-            for idx in range(i):
-                other_decision_veh = current_vehs[idx]
-                is_collide = self._check_collision(
-                    decision_veh,
-                    current_state,
-                    other_decision_veh,
-                    other_decision_veh.current_state,
-                )
-                if is_collide:
-                    self.num_moves = 0
-                    return
+        if self._collides(decision_idx, prediction_idx):
+            self.num_moves = 0
+            return
 
         # available actions for vehicles
         actions_list = []
-        for veh in current_vehs:
-            lane = road_graph.get_lane_by_id(veh.lane_id)
+        for i, veh_idx in enumerate(self.veh_idx):
+            veh = context.vehicles[veh_idx]
+            lane = context.lanes[self.lane[i]]
             actions = []
             if (
-                (veh.lane_id not in veh.available_lanes)
-                or abs(veh.current_state.d) >= lane.width / 4
+                (not context.is_available(veh_idx, self.lane[i]))
+                or abs(self.d[i]) >= lane.width / 4
                 or veh.behaviour == Behaviour.OVERTAKE
             ):
                 # need to lane change
                 if (
                     isinstance(lane, NormalLane)
-                    and lane.spline_length - veh.current_state.s
-                    > veh.current_state.vel * self.config["DECISION_RESOLUTION"]
+                    and lane.spline_length - self.s[i]
+                    > self.vel[i] * self.config["DECISION_RESOLUTION"]
                 ):
                     # enough space to change lane
                     actions.extend(["KS", "AC", "DC"])
@@ -117,7 +252,7 @@ class FlowState:
                         or veh.behaviour == Behaviour.LCL
                     ) and (
                         (lane.left_lane() is not None)
-                        or lane.width / 2 - veh.current_state.d
+                        or lane.width / 2 - self.d[i]
                         >= self.config["LATERAL_SPEED"]
                         * self.config["DECISION_RESOLUTION"]
                     ):
@@ -127,7 +262,7 @@ class FlowState:
                         or veh.behaviour == Behaviour.LCR
                     ) and (
                         lane.right_lane() is not None
-                        or veh.current_state.d + lane.width / 2
+                        or self.d[i] + lane.width / 2
                         >= self.config["LATERAL_SPEED"]
                         * self.config["DECISION_RESOLUTION"]
                     ):
@@ -139,141 +274,262 @@ class FlowState:
                 actions.extend(["KS", "AC", "DC"])
             actions_list.append(actions)
 
-        self.next_actions = list(itertools.product(*actions_list))
-        self.num_moves = len(self.next_actions)
+        self.actions_list = actions_list
+        self.num_moves = math.prod(len(actions) for actions in actions_list)
+        self._untried = self.num_moves
         return
 
-    def next_state(self, check_tried=False):
-        next_action = random.choice(self.next_actions)
-        if check_tried:
-            self.next_actions.remove(next_action)
-        next_time = self.time + self.config["DECISION_RESOLUTION"]
-        # actions_next_step = copy.deepcopy(self.actions)
-        actions_next_step = data_copy.deepcopy(self.actions)
-        vehs_next_step = []
-
-        current_vehs = self.states_list[-1]
-        for idx, veh in enumerate(current_vehs):
-            # veh_next_step = copy.deepcopy(veh)
-            veh_next_step = data_copy.deepcopy(veh)
-            veh_next_state = veh_next_step.current_state
-            action = next_action[idx]
-            lane = self.road_graph.get_lane_by_id(veh.lane_id)
-            if action == "KS":
-                veh_next_state.s += (
-                    veh_next_state.vel * self.config["DECISION_RESOLUTION"]
-                )
-                if abs(veh_next_state.d) < lane.width / 4:
-                    # allow for centreline adjustment
-                    veh_next_state.d = 0
-            elif action == "AC":
-                veh_next_state.vel += (
-                    self.config["DEFAULT_ACC"] * self.config["DECISION_RESOLUTION"]
-                )
-                veh_next_state.vel = min(veh_next_state.vel, veh_next_step.max_speed)
-                veh_next_state.s += (
-                    veh_next_state.vel * self.config["DECISION_RESOLUTION"]
-                    + 0.5
-                    * self.config["DEFAULT_ACC"]
-                    * self.config["DECISION_RESOLUTION"]
-                    * self.config["DECISION_RESOLUTION"]
-                )
-            elif action == "DC":
-                veh_next_state.vel -= (
-                    self.config["DEFAULT_ACC"] * self.config["DECISION_RESOLUTION"]
-                )
-                veh_next_state.vel = max(veh_next_state.vel, 0)
-                veh_next_state.s += max(
-                    0,
-                    (
-                        veh_next_state.vel * self.config["DECISION_RESOLUTION"]
-                        - 0.5
-                        * self.config["DEFAULT_ACC"]
-                        * self.config["DECISION_RESOLUTION"]
-                        * self.config["DECISION_RESOLUTION"]
-                    ),
-                )
-            elif action == "LCL":
-                veh_next_state.d += (
-                    self.config["LATERAL_SPEED"] * self.config["DECISION_RESOLUTION"]
-                )
-                veh_next_state.s += (
-                    veh_next_state.vel * self.config["DECISION_RESOLUTION"]
-                )
-            elif action == "LCR":
-                veh_next_state.d -= (
-                    self.config["LATERAL_SPEED"] * self.config["DECISION_RESOLUTION"]
-                )
-                veh_next_state.s += (
-                    veh_next_state.vel * self.config["DECISION_RESOLUTION"]
-                )
+    def joint_action(self, number: int) -> Tuple[str, ...]:
+        """The joint action with the given number in [0, num_moves)."""
+        joint_action = []
+        for actions in self.actions_list:
+            number, idx = divmod(number, len(actions))
+            joint_action.append(actions[idx])
+        return tuple(joint_action)
+
+    def _draw_untried(self) -> int:
+        """Draw the number of an untried joint action, uniformly and in
+           constant time."""
+        pick = random.randrange(self._untried)
+        number = self._shuffled.get(pick, pick)
+        self._untried -= 1
+        self._shuffled[pick] = self._shuffled.pop(self._untried, self._untried)
+        return number
+
+    @classmethod
+    def initial(
+        cls,
+        vehicles: List[Vehicle],
+        road_graph: RoadGraph,
+        complete_decisions: MultiDecision,
+        prediction: Prediction,
+        config: Dict,
+    ) -> "FlowState":
+        """Root state of a decision group at time 0."""
+        context = FlowContext(vehicles, road_graph, complete_decisions,
+                              prediction, config)
+        states = [veh.current_state for veh in vehicles]
+        return cls(
+            context,
+            0,
+            np.arange(len(vehicles)),
+            np.array([context.lane_index(veh.lane_id) for veh in vehicles]),
+            np.array([state.s for state in states], dtype=float),
+            np.array([state.d for state in states], dtype=float),
+            np.array([state.vel for state in states], dtype=float),
+            np.array([state.x for state in states], dtype=float),
+            np.array([state.y for state in states], dtype=float),
+        )
+
+    def next_state(self, check_tried=False, next_action=None):
+        if next_action is None:
+            if check_tried:
+                next_action = self.joint_action(self._draw_untried())
             else:
-                print("[EEROR] Unknown action: ", action)
-                exit(1)
+                next_action = self.joint_action(
+                    random.randrange(self.num_moves))
+        context = self.context
+        resolution = self.config["DECISION_RESOLUTION"]
+        acc = self.config["DEFAULT_ACC"]
+        next_time = self.time + resolution
+
+        action = np.array(next_action)
+        keep_s, acc_s, dec_s = action == "KS", action == "AC", action == "DC"
+        left, right = action == "LCL", action == "LCR"
+        if not np.all(keep_s | acc_s | dec_s | left | right):
+            print("[EEROR] Unknown action: ", next_action)
+            exit(1)
+
+        width = np.array([context.lanes[lane].width for lane in self.lane])
+        vel_up = np.minimum(self.vel + acc * resolution,
+                            context.max_speed[self.veh_idx])
+        vel_down = np.maximum(self.vel - acc * resolution, 0)
+        acc_dist = 0.5 * acc * resolution * resolution
+        vel = np.where(acc_s, vel_up, np.where(dec_s, vel_down, self.vel))
+        s = np.where(
+            acc_s, self.s + (vel_up * resolution + acc_dist),
+            np.where(dec_s,
+                     self.s + np.maximum(0, vel_down * resolution - acc_dist),
+                     self.s + self.vel * resolution))
+        # allow for centreline adjustment when keeping the lane
+        d = np.where(keep_s & (np.abs(self.d) < width / 4), 0.0, self.d)
+        d = np.where(left, self.d + self.config["LATERAL_SPEED"] * resolution, d)
+        d = np.where(right, self.d - self.config["LATERAL_SPEED"] * resolution, d)
 
-            current_lane = self.road_graph.get_lane_by_id(veh.lane_id)
+        lane = self.lane.copy()
+        keep = np.ones(len(self.veh_idx), dtype=bool)
+        x, y = np.zeros(len(self.veh_idx)), np.zeros(len(self.veh_idx))
+        for i, veh_idx in enumerate(self.veh_idx):
             # 车道更新
-            if action == "LCL" or action == "LCR":
-                if veh_next_state.d > current_lane.width / 2:
-                    next_lane = self.road_graph.get_lane_by_id(current_lane.left_lane())
-                    if next_lane is None:  # 车道变更失败
-                        veh_next_state.d = current_lane.width / 2
+            if left[i] or right[i]:
+                if d[i] > width[i] / 2:
+                    next_lane = context.side_lane(lane[i], "left")
+                    if next_lane < 0:  # 车道变更失败
+                        d[i] = width[i] / 2
                     else:
-                        veh_next_step.lane_id = next_lane.id
-                        veh_next_state.d -= current_lane.width / 2 + next_lane.width / 2
-                elif veh_next_state.d < -current_lane.width / 2:
-                    next_lane = self.road_graph.get_lane_by_id(
-                        current_lane.right_lane()
-                    )
-                    if next_lane is None:
-                        veh_next_state.d = -current_lane.width / 2
+                        lane[i] = next_lane
+                        d[i] -= width[i] / 2 + context.lanes[next_lane].width / 2
+                elif d[i] < -width[i] / 2:
+                    next_lane = context.side_lane(lane[i], "right")
+                    if next_lane < 0:
+                        d[i] = -width[i] / 2
                     else:
-                        veh_next_step.lane_id = next_lane.id
-                        veh_next_state.d += current_lane.width / 2 + next_lane.width / 2
+                        lane[i] = next_lane
+                        d[i] += width[i] / 2 + context.lanes[next_lane].width / 2
 
-            current_lane = self.road_graph.get_lane_by_id(veh_next_step.lane_id)
             # 处理超出 available lanes的情况
-            while veh_next_state.s > current_lane.spline_length:
-                next_lane = self.road_graph.get_available_next_lane(
-                    current_lane.id, veh_next_step.available_lanes
-                )
-                if next_lane is None:
-                    veh_next_step.lane_id = None
+            while s[i] > context.lanes[lane[i]].spline_length:
+                next_lane = context.next_lane(veh_idx, lane[i])
+                if next_lane < 0:
+                    # at the end of available_lanes range, not decision for this vehicle any more
+                    keep[i] = False
                     break
-                veh_next_state.s -= current_lane.spline_length
-                veh_next_step.lane_id = next_lane.id
-                current_lane = self.road_graph.get_lane_by_id(veh_next_step.lane_id)
-            if veh_next_step.lane_id == None:
-                # at the end of available_lanes range, not decision for this vehicle any more
+                s[i] -= context.lanes[lane[i]].spline_length
+                lane[i] = next_lane
+            if not keep[i]:
                 continue
 
             # calculate x and y coordinate
-            actual_lane = self.road_graph.get_lane_by_id(veh_next_step.lane_id)
-            (
-                veh_next_state.x,
-                veh_next_state.y,
-            ) = actual_lane.course_spline.frenet_to_cartesian1D(
-                veh_next_state.s, veh_next_state.d
-            )
-
-            veh_next_state.laneID = veh_next_step.lane_id
-            actions_next_step[veh_next_step.id].append(action)
-            vehs_next_step.append(veh_next_step)
+            x[i], y[i] = context.lanes[lane[i]].course_spline.frenet_to_cartesian1D(
+                s[i], d[i])
 
+        finished = self.finished
+        if not keep.all():
+            finished += self._final_entries(np.flatnonzero(~keep))
         return FlowState(
-            self.states_list + [vehs_next_step],
-            self.road_graph,
-            actions_next_step,
-            self.complete_decisions,
-            self.prediction,
+            context,
             next_time,
-            self.config,
+            self.veh_idx[keep],
+            lane[keep],
+            s[keep],
+            d[keep],
+            vel[keep],
+            x[keep],
+            y[keep],
+            tuple(itertools.compress(next_action, keep)),
+            self,
+            tuple(sorted(zip(
+                [context.vehicles[veh_idx].id for veh_idx in self.veh_idx],
+                next_action))),
+            finished,
+        )
+
+    def successor(self, move: Tuple[Tuple[str, str], ...]) -> "FlowState":
+        """The state reached by a move, e.g. to replay a branch found by a
+           search in another process."""
+        actions = dict(move)
+        return self.next_state(next_action=tuple(
+            actions[self.context.vehicles[veh_idx].id]
+            for veh_idx in self.veh_idx))
+
+    def progress(self) -> List[Tuple[int, int, int, int]]:
+        """Per deciding vehicle, the number of frames so far that earn each
+           of the procedure rewards of reward(): centred in the lane, speed,
+           action continuity and available lane."""
+        if self._progress is None:
+            if self.parent is None:
+                previous = [(0, 0, 0, 0)] * len(self.veh_idx)
+                previous_actions = [None] * len(self.veh_idx)
+            else:
+                position = {
+                    veh: i for i, veh in enumerate(self.parent.veh_idx.tolist())
+                }
+                parent_progress = self.parent.progress()
+                rows = [position[veh] for veh in self.veh_idx.tolist()]
+                previous = [parent_progress[row] for row in rows]
+                previous_actions = [
+                    self.parent.actions[row] if self.parent.actions else None
+                    for row in rows
+                ]
+            self._progress = []
+            for i, veh_idx in enumerate(self.veh_idx.tolist()):
+                action = self.actions[i] if self.actions else None
+                centred, speed, continuity, available = previous[i]
+                self._progress.append((
+                    centred + (abs(self.d[i]) < 0.5),
+                    speed + (action == "AC" or action == "KS"),
+                    continuity + (action is not None
+                                  and action == previous_actions[i]),
+                    available + self.context.is_available(
+                        veh_idx, self.lane[i]),
+                ))
+        return self._progress
+
+    def _final_entries(self, rows: np.ndarray) -> Tuple:
+        """Key entries (id, lane, binned d, centred, progress) of the
+           vehicles at the given rows, for which this state is the last
+           frame in the flow. The reward of such a vehicle only depends on
+           them."""
+        progress = self.progress()
+        d_bin = np.round(self.d[rows] / self.config["TRANSPOSITION_D_BIN"])
+        return tuple(
+            (self.context.vehicles[self.veh_idx[row]].id,
+             self.context.lane_ids[self.lane[row]],
+             d, bool(abs(self.d[row]) < 0.5), progress[row])
+            for row, d in zip(rows.tolist(), d_bin.astype(int).tolist()))
+
+    def key(self) -> Tuple:
+        """Hashable key of the discretized state, states with the same key
+           are merged in the transposition table. Besides the binned frenet
+           state, the key holds whether each vehicle is centred in its lane,
+           its last action and its progress, and the same for the vehicles
+           that left the flow, since the reward depends on the history of
+           the flow. Terminal states with the same key have the same
+           reward."""
+        context = self.context
+        s_bin = np.round(self.s / self.config["TRANSPOSITION_S_BIN"])
+        d_bin = np.round(self.d / self.config["TRANSPOSITION_D_BIN"])
+        vel_bin = np.round(self.vel / self.config["TRANSPOSITION_VEL_BIN"])
+        actions = self.actions or (None,) * len(self.veh_idx)
+        vehicles = sorted(zip(
+            [context.vehicles[veh_idx].id for veh_idx in self.veh_idx],
+            [context.lane_ids[lane] for lane in self.lane],
+            s_bin.astype(int).tolist(),
+            d_bin.astype(int).tolist(),
+            (np.abs(self.d) < 0.5).tolist(),
+            vel_bin.astype(int).tolist(),
+            actions,
+            self.progress(),
+        ))
+        return (
+            round(self.time / self.config["DECISION_RESOLUTION"]),
+            self.num_moves == 0,
+            tuple(vehicles),
+            tuple(sorted(self.finished)),
         )
 
+    def history(self) -> List["FlowState"]:
+        """States from the root of the tree to this one."""
+        states = []
+        state = self
+        while state is not None:
+            states.append(state)
+            state = state.parent
+        return states[::-1]
+
+    def expected_states(self) -> Iterator[Tuple[int, Vehicle, State, str]]:
+        """Rebuild the states of the vehicles along this branch.
+
+        Yields:
+            Tuple[int, Vehicle, State, str]: step index (from 1), vehicle,
+                its expected state and the action that led to it
+        """
+        context = self.context
+        for step, state in enumerate(self.history()[1:], start=1):
+            for i, veh_idx in enumerate(state.veh_idx):
+                veh = context.vehicles[veh_idx]
+                expected_state = copy.copy(veh.current_state)
+                expected_state.s = float(state.s[i])
+                expected_state.d = float(state.d[i])
+                expected_state.vel = float(state.vel[i])
+                expected_state.x, expected_state.y = state.x[i], state.y[i]
+                expected_state.laneID = context.lane_ids[state.lane[i]]
+                yield step, veh, expected_state, state.actions[i]
+
     def terminal(self):
         if (
             self.time >= self.config["MAX_DECISION_TIME"]
-            or len(self.states_list[-1]) == 0
+            or len(self.veh_idx) == 0
         ):
             # exceed max decision time or all vehicles have finished decision in available lanes
             return True
@@ -287,45 +543,46 @@ class FlowState:
         # reward have to limit to [0,1]
         if self.num_moves == 0:
             return 0.0
-        # find last exist frame index for each vehicle
-        last_exist_frame_idx = {}
-        for frame_idx in range(len(self.states_list)):
-            for veh in self.states_list[frame_idx]:
-                if veh.id not in last_exist_frame_idx:
-                    last_exist_frame_idx[veh.id] = [veh]
-                else:
-                    last_exist_frame_idx[veh.id].append(veh)
+        context = self.context
+        history = self.history()
+        # (d, lane index, action) of each vehicle in the frames it exists
+        veh_frames = {}
+        for state in history:
+            for i, veh_idx in enumerate(state.veh_idx.tolist()):
+                veh_frames.setdefault(veh_idx, []).append(
+                    (state.d[i], state.lane[i],
+                     state.actions[i] if state.parent is not None else None))
 
         rewards_for_each_veh = []
-        max_decision_num = len(self.states_list)
-        for veh_id, veh_list in last_exist_frame_idx.items():
+        max_decision_num = len(history)
+        for veh_idx, frames in veh_frames.items():
             reward_self = 0.0
             reward_others = 0.0
             # reward about the procedure
-            for idx in range(len(veh_list)):
-                veh = veh_list[idx]
+            for idx in range(len(frames)):
+                d, lane, _ = frames[idx]
                 # keep in lane center reward
-                if abs(veh.current_state.d) < 0.5:
+                if abs(d) < 0.5:
                     reward_self += 0.2 / max_decision_num
                 # speed reward
                 if idx > 0 and (
-                    self.actions[veh_id][idx - 1] == "AC"
-                    or self.actions[veh_id][idx - 1] == "KS"
+                    frames[idx][2] == "AC"
+                    or frames[idx][2] == "KS"
                 ):
                     reward_self += 0.2 / max_decision_num
                 # action coninuity reward
                 if (
                     idx > 1
-                    and self.actions[veh_id][idx - 2] == self.actions[veh_id][idx - 1]
+                    and frames[idx - 1][2] == frames[idx][2]
                 ):
                     reward_self += 0.2 / max_decision_num
                 # in available lanes reward
-                if veh.lane_id in veh.available_lanes:
+                if context.is_available(veh_idx, lane):
                     reward_self += 0.2 / max_decision_num
 
             # reward about the result
-            if veh_list[-1].lane_id in veh_list[-1].available_lanes:
-                if abs(veh_list[-1].current_state.d) < 0.5:
+            if context.is_available(veh_idx, frames[-1][1]):
+                if abs(frames[-1][0]) < 0.5:
                     reward_self += 0.8
                 else:
                     reward_self += 0.2
@@ -336,27 +593,36 @@ class FlowState:
         total_reward = sum(rewards_for_each_veh) / len(rewards_for_each_veh)
         return max(0.0, min(1.0, total_reward))
 
-    def _check_collision(
-        self, veh1: Vehicle, state1: State, veh2: Vehicle, state2: State
-    ) -> bool:
-        if veh1 == veh2:
-            print("Decision vehicle has already decision?!")
-            exit(1)
-
-        dist = math.hypot(state1.x - state2.x, state1.y - state2.y)
-        dist_thershold = math.hypot(veh1.length + veh2.length, veh1.width + veh2.width)
-        if dist > dist_thershold:
+    def _collides(self, decision_idx: int, prediction_idx: int) -> bool:
+        """Check the deciding vehicles against the obstacles and the vehicles
+           before them in the group in one batch. The pairs that are close
+           enough go through the oriented box test, with the deciding
+           vehicles inflated to twice their length and 1.5 times their width.
+        """
+        others, reach, position = self.context.screen(
+            self.veh_idx, decision_idx, prediction_idx)
+        if reach is None:
+            return False
+        num_obstacles = len(others) - len(self.veh_idx)
+        position[0, num_obstacles:] = self.x
+        position[1, num_obstacles:] = self.y
+        other_x, other_y = position
+        near = np.hypot(self.x[:, np.newaxis] - other_x,
+                        self.y[:, np.newaxis] - other_y) <= reach
+        if not near.any():
             return False
 
-        is_collide, _ = check_collsion_new(
-            np.array([state1.x, state1.y]),
-            veh1.length * 2,
-            veh1.width * 1.5,
-            state1.yaw,
-            np.array([state2.x, state2.y]),
-            veh2.length,
-            veh2.width,
-            state2.yaw,
+        ego, other = np.nonzero(near)
+        ego_box = others[num_obstacles + ego]
+        other_box = others[other]
+        is_collide, _ = check_collision_batch(
+            np.column_stack((self.x[ego], self.y[ego])),
+            ego_box[:, 3] * 2,
+            ego_box[:, 4] * 1.5,
+            ego_box[:, 2],
+            np.column_stack((other_x[other], other_y[other])),
+            other_box[:, 3],
+            other_box[:, 4],
+            other_box[:, 2],
         )
-
-        return is_collide
+        return bool(np.any(is_collide))
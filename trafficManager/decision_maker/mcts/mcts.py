@@ -11,6 +11,8 @@ Copyright (c) 2022 by PJLab, All Rights Reserved.
 """
 import random
 import math
+import time
+from logging import DEBUG
 
 import logger
 
@@ -20,28 +22,98 @@ logging = logger.get_logger(__name__)
 # MCTS scalar.  Larger scalar will increase exploitation, smaller will increase exploration.
 SCALAR = 2 / (2 * math.sqrt(2.0))
 EXPAND_NODE = 0
+# iterations between two checks of the early stopping rules
+STOP_CHECK_INTERVAL = 10
+
+
+class Statistics:
+    """Visits and total reward, shared by the nodes of equivalent states."""
+
+    __slots__ = ("visits", "reward")
+
+    def __init__(self, visits=1, reward=0.0):
+        self.visits = visits
+        self.reward = reward
 
 
 class Node:
-    def __init__(self, state, parent=None):
-        self.visits = 1
-        self.reward = 0.0
+    """
+    A node of the search tree. Nodes whose states have the same key() share
+    their Statistics through the transposition table, so an equivalent state
+    reached by another action order starts with the statistics gathered so
+    far. A node may also have a prior, the node of an earlier search that was
+    reached by the same moves, whose statistics it starts with.
+    """
+
+    def __init__(self, state, parent=None, prior=None):
         self.state = state
         self.children = []
         self.parent = parent
+        self.table = parent.table if parent is not None else {}
+        self.prior = prior
+        self._prior_children = None
+        key = state.key()
+        if key not in self.table:
+            if prior is not None:
+                self.table[key] = Statistics(prior.visits, prior.reward)
+            else:
+                self.table[key] = Statistics()
+        self.stats = self.table[key]
+
+    @property
+    def visits(self):
+        return self.stats.visits
+
+    @visits.setter
+    def visits(self, visits):
+        self.stats.visits = visits
+
+    @property
+    def reward(self):
+        return self.stats.reward
+
+    @reward.setter
+    def reward(self, reward):
+        self.stats.reward = reward
 
     def add_child(self, child_state):
-        child = Node(child_state, self)
+        prior = None
+        if self.prior is not None:
+            if self._prior_children is None:
+                self._prior_children = {
+                    child.state.move: child for child in self.prior.children
+                }
+            prior = self._prior_children.get(child_state.move)
+        child = Node(child_state, self, prior)
         self.children.append(child)
 
+    def subtree(self):
+        """This node and all its descendants."""
+        nodes = [self]
+        for node in nodes:
+            nodes.extend(node.children)
+        return nodes
+
+    def detach(self):
+        """Cut this node from its tree, to be used as the prior of the root
+           of a later search."""
+        self.parent = None
+        self.prior = self._prior_children = None
+        return self
+
     def update(self, reward):
         self.reward += reward
         self.visits += 1
 
-    def fully_expanded(self):
-        if len(self.children) == self.state.num_moves:
-            return True
-        return False
+    def fully_expanded(self, widening=None):
+        """Whether the node has all the children it may have. With
+           progressive widening (coefficient, exponent), a node visited n
+           times may only have coefficient * n ** exponent children."""
+        limit = self.state.num_moves
+        if widening is not None:
+            coefficient, exponent = widening
+            limit = min(limit, max(1, int(coefficient * self.visits**exponent)))
+        return len(self.children) >= limit
 
     def __repr__(self):
         s = "Node: %s\n\tChildren: %d; visits: %d; reward: %f, exploit: %f" % (
@@ -54,29 +126,83 @@ class Node:
         return s
 
 
-def uct_search(budget, root):
+def uct_search(budget, root, deadline=None, visit_share=1.0, confidence=1.0,
+               widening=None):
+    """Run up to budget iterations from the root and return its best child.
+
+    Args:
+        budget (float): maximum number of iterations
+        root (Node): the node to search from
+        deadline (float, optional): time.monotonic() value at which the
+            search stops, after at least one iteration. Defaults to None.
+        visit_share (float, optional): stop once the most visited child of
+            the fully expanded root has this share of its visits.
+            Defaults to 1.0, which never stops early.
+        confidence (float, optional): stop once the mean reward of the best
+            child of the fully expanded root is above all the others with
+            this confidence (Hoeffding bound). Defaults to 1.0, which never
+            stops early.
+        widening (tuple, optional): (coefficient, exponent) of progressive
+            widening, see Node.fully_expanded. Defaults to None, which
+            expands every child.
+    """
+    reason = "budget"
+    iterations = 0
     for iteration in range(int(budget)):
         if iteration % 100 == 0:
             logging.debug("simulation: %d" % iteration)
             logging.debug(root)
-        front = tree_policy(root)
+        front = tree_policy(root, widening)
         reward = default_policy(front.state)  # can parallelize here
         backpropagation(front, reward)
-        # try:
-        #     if best_child(root, 0).visits / budget > 0.5:
-        #         break
-        # except:
-        #     logging.debug("No best child in iteration: %d" % iteration)
+        iterations += 1
+        if deadline is not None and time.monotonic() >= deadline:
+            reason = "deadline"
+            break
+        if iterations % STOP_CHECK_INTERVAL == 0 and root.fully_expanded(widening):
+            converged = stop_reason(root, visit_share, confidence)
+            if converged is not None:
+                reason = converged
+                break
+    if logging.isEnabledFor(DEBUG):
+        # the tree is only walked for the message
+        logging.debug(
+            "UCT search stopped by %s after %d iterations, tree size %d",
+            reason, iterations, len(root.subtree()))
     return best_child(root, 0)
 
 
+def stop_reason(node, visit_share, confidence):
+    """The early stopping rule met by the children of the node, if any."""
+    if not node.children:
+        return None
+    if visit_share < 1.0:
+        most_visits = max(child.visits for child in node.children)
+        if most_visits >= visit_share * node.visits:
+            return "visit share"
+    if confidence < 1.0 and len(node.children) > 1:
+        def radius(child):
+            return math.sqrt(math.log(1.0 / (1.0 - confidence)) /
+                             (2.0 * child.visits))
+
+        ranked = sorted(node.children,
+                        key=lambda child: child.reward / child.visits,
+                        reverse=True)
+        best = ranked[0]
+        if all(best.reward / best.visits - radius(best) >
+               child.reward / child.visits + radius(child)
+               for child in ranked[1:]):
+            return "confidence"
+    return None
+
+
 def default_policy(state):
     while not state.terminal():
         state = state.next_state()
     return state.reward()
 
 
-def tree_policy(node):
+def tree_policy(node, widening=None):
     # a hack to force 'exploitation' in a game where there are many options,
     # and you may never/not want to fully expand first
     while node and not node.state.terminal():
@@ -85,7 +211,7 @@ def tree_policy(node):
         elif random.uniform(0, 1) < 0.5:
             node = best_child(node, SCALAR)
         else:
-            if not node.fully_expanded():
+            if not node.fully_expanded(widening):
                 return expand(node)
             else:
                 node = best_child(node, SCALAR)
@@ -0,0 +1,79 @@
+import os
+import random
+
+import numpy as np
+
+import trafficManager.decision_maker.mcts
+from common.vehicle import Behaviour, Vehicle, VehicleType
+from decision_maker.abstract_decision_maker import MultiDecision
+from mcts.flow_state import FlowState
+from predictor.abstract_predictor import Prediction
+from utils.cubic_spline import Spline2D
+from utils.load_config import load_config
+from utils.roadgraph import Edge, NormalLane, RoadGraph
+from utils.trajectory import State
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           "../../config.yaml")
+
+
+def straight_road(length=60.0, width=3.5):
+    """A two-lane edge E along the x axis, without next lanes, so the
+       vehicles leave the flow at its end."""
+    edge = Edge(id="E", lane_num=2, lane_width=width, lanes={"E_0", "E_1"})
+    road_graph = RoadGraph(edges={"E": edge})
+    for index in range(2):
+        lane_id = f"E_{index}"
+        road_graph.lanes[lane_id] = NormalLane(
+            id=lane_id,
+            width=width,
+            course_spline=Spline2D([0.0, length / 2, length],
+                                   [index * width] * 3),
+            affiliated_edge=edge,
+        )
+    return road_graph
+
+
+def group(road_graph):
+    """Two vehicles that have to change to the left lane, the first one
+       reaches the end of the road in the middle of the horizon."""
+    vehicles = []
+    for vehicle_id, s, vel in ((1, 40.0, 10.0), (2, 5.0, 5.0)):
+        state = State(s=s, d=0.0, s_d=vel, x=s, y=0.0, yaw=0.0, vel=vel)
+        vehicles.append(Vehicle(vehicle_id, state, "E_0",
+                                behaviour=Behaviour.LCL,
+                                vtype=VehicleType.IN_AOI,
+                                available_lanes=["E_1"]))
+    return vehicles
+
+
+def test_equal_keys_equal_rewards(rollouts=3000):
+    """Terminal flow states with the same transposition key have the same
+       reward, also when a vehicle left the flow before the end."""
+    random.seed(0)
+    config = load_config(CONFIG_PATH)
+    road_graph = straight_road()
+    root = FlowState.initial(group(road_graph), road_graph, MultiDecision(),
+                             Prediction(), config)
+
+    rewards = {}
+    branches = {}
+    for _ in range(rollouts):
+        state = root
+        moves = []
+        while not state.terminal():
+            state = state.next_state()
+            moves.append(state.move)
+        key = state.key()
+        rewards.setdefault(key, set()).add(state.reward())
+        branches.setdefault(key, set()).add(tuple(moves))
+
+    finished = [key for key in rewards if key[3]]
+    merged = [key for key in finished if len(branches[key]) > 1]
+    assert finished and merged
+    assert all(len(reward) == 1 for reward in rewards.values())
+
+
+if __name__ == "__main__":
+    test_equal_keys_equal_rewards()
+    print(True)
@@ -6,8 +6,13 @@ Description:
 Copyright (c) 2023 by PJLab, All Rights Reserved. 
 """
 
+import itertools
 from itertools import combinations
 import math
+import random
+import time
+from typing import Dict, List, Tuple
+
 from common.observation import Observation
 from decision_maker.abstract_decision_maker import (
     AbstractEgoDecisionMaker,
@@ -16,11 +21,13 @@ from decision_maker.abstract_decision_maker import (
     MultiDecision,
     SingleStepDecision,
 )
+from decision_maker.decision_cache import DecisionCache
 from predictor.abstract_predictor import Prediction
 
-from utils.roadgraph import RoadGraph, JunctionLane, NormalLane
+from utils.roadgraph import AbstractLane, RoadGraph, JunctionLane, NormalLane
 from utils.trajectory import State
 from common.vehicle import Behaviour, Vehicle, VehicleType
+from common.worker_pool import WorkerPool, load_scene, load_tick
 from mcts import mcts
 from mcts.flow_state import FlowState
 
@@ -28,6 +35,115 @@ import logger
 
 logging = logger.get_logger(__name__)
 
+# distance within which a vehicle in a junction interacts with another [m]
+JUNCTION_INTERACTION_DIST = 20
+
+
+def _search_group(root: mcts.Node, config: dict,
+                  time_limit: float = None) -> mcts.Node:
+    """Search the decision sequence of a group from the root node, one
+       DECISION_RESOLUTION step at a time.
+
+    Args:
+        root (mcts.Node): the root of the group
+        config (dict): the decision config
+        time_limit (float, optional): wall-clock limit of the whole search
+            [s], shared among the steps like the rollout budget. Defaults to
+            None, which only uses the rollout budget.
+
+    Returns:
+        mcts.Node: the leaf of the chosen branch, None if the search failed
+    """
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+    budgets = [
+        200 / (t / 2 + 1) for t in range(
+            int(config["MAX_DECISION_TIME"] / config["DECISION_RESOLUTION"]))
+    ]
+    widening = None
+    if config["DECISION_WIDENING_COEFFICIENT"] > 0:
+        widening = (config["DECISION_WIDENING_COEFFICIENT"],
+                    config["DECISION_WIDENING_EXPONENT"])
+    current_node = root
+    for t in range(len(budgets)):
+        budget = budgets[t]
+        if t == 0:
+            # rollouts kept from the last decision count to the budget
+            budget = max(budget - (root.visits - 1),
+                         root.state.num_moves or 0)
+        step_deadline = None
+        if deadline is not None:
+            now = time.monotonic()
+            step_deadline = now + max(0.0, deadline - now) * budgets[t] / sum(
+                budgets[t:])
+        current_node = mcts.uct_search(
+            budget,
+            current_node,
+            step_deadline,
+            config["DECISION_STOP_VISIT_SHARE"],
+            config["DECISION_STOP_CONFIDENCE"],
+            widening,
+        )
+        if current_node is None:
+            # decision failed
+            break
+        # print("Best Child: ", current_node.visits / (200 / (t / 2 + 1)) * 100, "%")
+        temp_best = current_node
+        while temp_best.children:
+            temp_best = mcts.best_child(temp_best, 0)
+        if temp_best.state.terminal() and temp_best.state.reward() > 0.8:
+            # Best child is at end
+            break
+
+    while (
+        current_node is not None
+        and current_node.children
+        and not current_node.state.terminal()
+    ):
+        current_node = mcts.best_child(current_node, 0)
+    return current_node
+
+
+def _search_in_worker(scene: Tuple[int, str], tick: Tuple[int, bytes],
+                      group: Tuple[str, ...], seed: str,
+                      time_limit: float = None):
+    """Search one tree of a decision group in a worker process of
+       MultiDecisionMaker.
+
+    Args:
+        scene (Tuple[int, str]): version and pickle file of the roadgraph
+        tick (Tuple[int, bytes]): id and pickled (vehicles by id,
+            prediction, config) of the decision
+        group (Tuple[str, ...]): ids of the vehicles of the group, in order
+        seed (str): seed of the random generator of the search
+        time_limit (float, optional): wall-clock limit of the search [s].
+            Defaults to None.
+
+    Returns:
+        Tuple[dict, List[tuple], float]: visits and reward of the first
+            moves, the moves of the chosen branch (None if the search failed)
+            and the reward of its leaf
+    """
+    road_graph = load_scene(scene)
+    vehicles, prediction, config = load_tick(tick)
+    random.seed(seed)
+    root = mcts.Node(
+        FlowState.initial(
+            [vehicles[veh_id] for veh_id in group],
+            road_graph,
+            MultiDecision(),
+            prediction,
+            config,
+        ))
+    leaf = _search_group(root, config, time_limit)
+    root_stats = {
+        child.state.move: (child.visits, child.reward)
+        for child in root.children
+    }
+    if leaf is None:
+        return root_stats, None, 0.0
+    moves = [state.move for state in leaf.state.history()[1:]]
+    return root_stats, moves, leaf.state.reward()
+
 
 class EgoDecisionMaker(AbstractEgoDecisionMaker):
     def make_decision(
@@ -41,152 +157,209 @@ class EgoDecisionMaker(AbstractEgoDecisionMaker):
 
 
 class MultiDecisionMaker(AbstractMultiDecisionMaker):
+    def __init__(self) -> None:
+        # subtrees kept from the executed part of the last decision
+        self._kept_subtrees = {}
+        self._cache = DecisionCache()
+        self._workers = WorkerPool(prefix="decision_scene_")
+
     def _judge_interactions(
         self, observation: Observation, roadgraph: RoadGraph
     ) -> dict:
+        """Find the vehicle pairs with a potential interaction. Only the
+           pairs that may interact are checked: vehicles in the same lane,
+           in a lane and its next lanes, in the lanes of the same edge, and
+           vehicles close to a vehicle in a junction.
+
+        Returns:
+            dict: interaction[(id_i, id_j)] = True for the pairs with an
+                interaction, in both orders
+        """
+        vehicles = [
+            veh for veh in observation.vehicles
+            if veh.vtype != VehicleType.OUT_OF_AOI
+        ]
+        lanes = {}
+        for veh in vehicles:
+            if veh.lane_id not in lanes:
+                lanes[veh.lane_id] = roadgraph.get_lane_by_id(veh.lane_id)
+
+        # lane, edge and grid cell buckets of the vehicle indices
+        by_lane, by_edge, by_cell = {}, {}, {}
+        cells = []
+        for idx, veh in enumerate(vehicles):
+            lane = lanes[veh.lane_id]
+            by_lane.setdefault(veh.lane_id, []).append(idx)
+            if isinstance(lane, NormalLane):
+                by_edge.setdefault(lane.affiliated_edge.id, []).append(idx)
+            cells.append((
+                math.floor(veh.current_state.x / JUNCTION_INTERACTION_DIST),
+                math.floor(veh.current_state.y / JUNCTION_INTERACTION_DIST),
+            ))
+            by_cell.setdefault(cells[-1], []).append(idx)
+
+        candidates = set()
+        for members in itertools.chain(by_lane.values(), by_edge.values()):
+            candidates.update(combinations(members, 2))
+        for idx, veh in enumerate(vehicles):
+            lane = lanes[veh.lane_id]
+            if isinstance(lane, NormalLane):
+                next_lane_ids = [lane.next_lanes[key][0] for key in lane.next_lanes]
+            elif isinstance(lane, JunctionLane):
+                next_lane_ids = [lane.next_lane_id]
+                # vehicles within the junction distance are in the 3x3 cells
+                cell_x, cell_y = cells[idx]
+                for offset_x, offset_y in itertools.product((-1, 0, 1), repeat=2):
+                    for other in by_cell.get((cell_x + offset_x, cell_y + offset_y), ()):
+                        candidates.add((min(idx, other), max(idx, other)))
+            else:
+                continue
+            for next_lane_id in next_lane_ids:
+                for other in by_lane.get(next_lane_id, ()):
+                    candidates.add((min(idx, other), max(idx, other)))
+
         # interaction which interaction(id_i,id_j) = True
         # means if there's a interaction between vehicle i and vehicle j
-        interaction = {
-            (veh_i.id, veh_j.id): False for veh_i in observation.vehicles
-            for veh_j in observation.vehicles
-            if veh_i.id != veh_j.id and veh_i.vtype != VehicleType.OUT_OF_AOI
-            and veh_j.vtype != VehicleType.OUT_OF_AOI
-        }
-        # vehicle pairs with interaction
-        # todo: add OVERTAKE behaviour support
-
-        for veh_i, veh_j in combinations(observation.vehicles, 2):
-            if VehicleType.OUT_OF_AOI in (veh_i.vtype, veh_j.vtype):
+        interaction = {}
+        for i, j in sorted(candidates):
+            if i == j:
                 continue
-            if veh_i.id != veh_j.id:
-                lane_i = roadgraph.get_lane_by_id(veh_i.lane_id)
-                lane_j = roadgraph.get_lane_by_id(veh_j.lane_id)
-                if isinstance(lane_i, JunctionLane) or isinstance(
-                    lane_j, JunctionLane
-                ):  # in junction
-                    dist = math.sqrt(
-                        (veh_i.current_state.x - veh_j.current_state.x) ** 2
-                        + (veh_i.current_state.y - veh_j.current_state.y) ** 2
-                    )
-                    if dist < 20:
-                        interaction[(veh_i.id, veh_j.id)] = interaction[
-                            (veh_j.id, veh_i.id)
-                        ] = True
-                        continue
-                if veh_i.lane_id == veh_j.lane_id:  # in same lane
-                    # make sure veh_j is in front of veh_i
-                    if veh_i.current_state.s > veh_j.current_state.s:
-                        veh_i, veh_j = veh_j, veh_i
-                    s_dist = veh_j.current_state.s - veh_i.current_state.s
-                    inter_dist = (3 + 0.5) * veh_i.current_state.s_d + veh_i.length
-                    if s_dist < inter_dist:
-                        interaction[(veh_i.id, veh_j.id)] = interaction[
-                            (veh_j.id, veh_i.id)
-                        ] = True
-                        continue
-                # veh_j is in next lane of veh_i
+            veh_i, veh_j = vehicles[i], vehicles[j]
+            if self._interacts(veh_i, veh_j, lanes[veh_i.lane_id],
+                               lanes[veh_j.lane_id]):
+                interaction[(veh_i.id, veh_j.id)] = True
+                interaction[(veh_j.id, veh_i.id)] = True
+        return interaction
+
+    @staticmethod
+    def _interacts(veh_i: Vehicle, veh_j: Vehicle, lane_i: AbstractLane,
+                   lane_j: AbstractLane) -> bool:
+        """Whether two vehicles, veh_i first in the observation, have a
+           potential interaction."""
+        # todo: add OVERTAKE behaviour support
+        if isinstance(lane_i, JunctionLane) or isinstance(
+            lane_j, JunctionLane
+        ):  # in junction
+            dist = math.sqrt(
+                (veh_i.current_state.x - veh_j.current_state.x) ** 2
+                + (veh_i.current_state.y - veh_j.current_state.y) ** 2
+            )
+            if dist < JUNCTION_INTERACTION_DIST:
+                return True
+        if veh_i.lane_id == veh_j.lane_id:  # in same lane
+            # make sure veh_j is in front of veh_i
+            if veh_i.current_state.s > veh_j.current_state.s:
+                veh_i, veh_j = veh_j, veh_i
+            s_dist = veh_j.current_state.s - veh_i.current_state.s
+            inter_dist = (3 + 0.5) * veh_i.current_state.s_d + veh_i.length
+            if s_dist < inter_dist:
+                return True
+        # veh_j is in next lane of veh_i
+        if (
+            isinstance(lane_i, NormalLane)
+            and lane_j.id
+            in [lane_i.next_lanes[key][0] for key in lane_i.next_lanes.keys()]
+        ) or (
+            isinstance(lane_i, JunctionLane)
+            and lane_j.id == lane_i.next_lane_id
+        ):
+            s_dist = (
+                lane_i.spline_length
+                - veh_i.current_state.s
+                + veh_j.current_state.s
+            )
+            inter_dist = (3 + 0.5) * veh_i.current_state.s_d + veh_i.length
+            if s_dist < inter_dist:
+                return True
+        # veh_i is in next lane of veh_j
+        if (
+            isinstance(lane_j, NormalLane)
+            and lane_i.id
+            in [lane_j.next_lanes[key][0] for key in lane_j.next_lanes.keys()]
+        ) or (
+            isinstance(lane_j, JunctionLane)
+            and lane_i.id == lane_j.next_lane_id
+        ):
+            s_dist = (
+                lane_j.spline_length
+                - veh_j.current_state.s
+                + veh_i.current_state.s
+            )
+            inter_dist = (3 + 0.5) * veh_j.current_state.s_d + veh_j.length
+            if s_dist < inter_dist:
+                return True
+        # veh_i and veh_j are in adjacent lanes and one of them is changing lane
+        if (
+            isinstance(lane_i, NormalLane)
+            and isinstance(lane_j, NormalLane)
+            and lane_i.affiliated_edge == lane_j.affiliated_edge
+        ):
+            if (
+                abs(veh_i.current_state.s - veh_j.current_state.s)
+                < veh_i.length + veh_j.length
+            ):
                 if (
-                    isinstance(lane_i, NormalLane)
-                    and lane_j.id
-                    in [lane_i.next_lanes[key][0] for key in lane_i.next_lanes.keys()]
+                    veh_i.behaviour == Behaviour.LCL
+                    and lane_j.id == lane_i.left_lane()
                 ) or (
-                    isinstance(lane_i, JunctionLane)
-                    and lane_j.id == lane_i.next_lane_id
+                    veh_i.behaviour == Behaviour.LCR
+                    and lane_j.id == lane_i.right_lane()
                 ):
-                    s_dist = (
-                        lane_i.spline_length
-                        - veh_i.current_state.s
-                        + veh_j.current_state.s
-                    )
-                    inter_dist = (3 + 0.5) * veh_i.current_state.s_d + veh_i.length
-                    if s_dist < inter_dist:
-                        interaction[(veh_i.id, veh_j.id)] = interaction[
-                            (veh_j.id, veh_i.id)
-                        ] = True
-                        continue
-                # veh_i is in next lane of veh_j
+                    return True
                 if (
-                    isinstance(lane_j, NormalLane)
-                    and lane_i.id
-                    in [lane_j.next_lanes[key][0] for key in lane_j.next_lanes.keys()]
+                    veh_j.behaviour == Behaviour.LCL
+                    and lane_i.id == lane_j.left_lane()
                 ) or (
-                    isinstance(lane_j, JunctionLane)
-                    and lane_i.id == lane_j.next_lane_id
-                ):
-                    s_dist = (
-                        lane_j.spline_length
-                        - veh_j.current_state.s
-                        + veh_i.current_state.s
-                    )
-                    inter_dist = (3 + 0.5) * veh_j.current_state.s_d + veh_j.length
-                    if s_dist < inter_dist:
-                        interaction[(veh_i.id, veh_j.id)] = interaction[
-                            (veh_j.id, veh_i.id)
-                        ] = True
-                        continue
-                # veh_i and veh_j are in adjacent lanes and one of them is changing lane
-                if (
-                    isinstance(lane_i, NormalLane)
-                    and isinstance(lane_j, NormalLane)
-                    and lane_i.affiliated_edge == lane_j.affiliated_edge
+                    veh_j.behaviour == Behaviour.LCR
+                    and lane_i.id == lane_j.right_lane()
                 ):
-                    if (
-                        abs(veh_i.current_state.s - veh_j.current_state.s)
-                        < veh_i.length + veh_j.length
-                    ):
-                        if (
-                            veh_i.behaviour == Behaviour.LCL
-                            and lane_j.id == lane_i.left_lane()
-                        ) or (
-                            veh_i.behaviour == Behaviour.LCR
-                            and lane_j.id == lane_i.right_lane()
-                        ):
-                            interaction[(veh_i.id, veh_j.id)] = interaction[
-                                (veh_j.id, veh_i.id)
-                            ] = True
-                            continue
-                        if (
-                            veh_j.behaviour == Behaviour.LCL
-                            and lane_i.id == lane_j.left_lane()
-                        ) or (
-                            veh_j.behaviour == Behaviour.LCR
-                            and lane_i.id == lane_j.right_lane()
-                        ):
-                            interaction[(veh_i.id, veh_j.id)] = interaction[
-                                (veh_j.id, veh_i.id)
-                            ] = True
-                            continue
-        return interaction
+                    return True
+        return False
 
     def _grouping(self, observation: Observation, interaction: dict) -> dict:
+        """Group the vehicles with a potential interaction by union-find.
+           The interacting pairs are merged in the order of the observation
+           as long as the merged group has at most max_group_size vehicles.
+
+        Returns:
+            dict: group_info = {groupid: [veh_a, veh_b, ...]}, the groups and
+                their vehicles in the order of the observation
+        """
         max_group_size = 3
-        # group_info = {groupid: [veh_a, veh_b, ...]}
-        group_info = {}
-        group_idx = {}
-        group_id = 0
+        vehicles = [
+            veh for veh in observation.vehicles
+            if veh.vtype != VehicleType.OUT_OF_AOI
+        ]
+        index = {veh.id: idx for idx, veh in enumerate(vehicles)}
+        parent = list(range(len(vehicles)))
+        size = [1] * len(vehicles)
 
-        # calculate group_info
-        #  group vehicles into several groups where vehicles in a group have at least one potential interaction with a vehicle in the same group.
-        for veh_i in observation.vehicles:
-            if veh_i.vtype == VehicleType.OUT_OF_AOI:
-                continue
-            if (
-                veh_i.id in group_idx
-                and len(group_info[group_idx[veh_i.id]]) >= max_group_size
-            ):
+        def find(idx: int) -> int:
+            while parent[idx] != idx:
+                parent[idx] = parent[parent[idx]]
+                idx = parent[idx]
+            return idx
+
+        pairs = sorted(
+            (index[id_i], index[id_j]) for id_i, id_j in interaction
+            if id_i in index and id_j in index and index[id_i] < index[id_j])
+        for i, j in pairs:
+            root_i, root_j = find(i), find(j)
+            if root_i == root_j or size[root_i] + size[root_j] > max_group_size:
                 continue
-            if veh_i.id not in group_idx:
-                group_id += 1
-                group_info[group_id] = [veh_i]
-                group_idx[veh_i.id] = group_id
-            for veh_j in observation.vehicles:
-                if veh_j.vtype == VehicleType.OUT_OF_AOI:
-                    continue
-                if veh_j.id not in group_idx and interaction[(veh_i.id, veh_j.id)]:
-                    group_info[group_idx[veh_i.id]].append(veh_j)
-                    group_idx[veh_j.id] = group_idx[veh_i.id]
-                if len(group_info[group_id]) >= max_group_size:
-                    break
+            # the root is the first vehicle of the group
+            root_i, root_j = min(root_i, root_j), max(root_i, root_j)
+            parent[root_j] = root_i
+            size[root_i] += size[root_j]
+
+        group_info = {}
+        group_ids = {}
+        for idx, veh in enumerate(vehicles):
+            root = find(idx)
+            if root not in group_ids:
+                group_ids[root] = len(group_ids) + 1
+                group_info[group_ids[root]] = []
+            group_info[group_ids[root]].append(veh)
         return group_info
 
     def make_decision(
@@ -207,6 +380,9 @@ class MultiDecisionMaker(AbstractMultiDecisionMaker):
                 the best decision sequence within each group.
         """
         # Step 0: Determine if there are any vehicles that require decision-making.
+        deadline = None
+        if config["DECISION_TIME_LIMIT"] > 0:
+            deadline = time.monotonic() + config["DECISION_TIME_LIMIT"]
         if not observation.vehicles:
             print("[ERROR] DecisionMaker: No vehicles to make decision.")
             return MultiDecision()
@@ -221,60 +397,84 @@ class MultiDecisionMaker(AbstractMultiDecisionMaker):
         # Step 3: Perform MCTS decision-making on each decision group in sequence,
         # searching for the best decision sequence within each group.
         complete_decisions = MultiDecision()
-        for group_idx, vehs_in_group in group_info.items():
+        kept_subtrees = self._kept_subtrees
+        self._kept_subtrees = {}
+        # branches decided for the same group snapshot are replayed first
+        signatures, cached = {}, {}
+        if config["DECISION_CACHE_SIZE"] > 0:
+            for vehs_in_group in group_info.values():
+                group_key = tuple(sorted(veh.id for veh in vehs_in_group))
+                signatures[group_key] = DecisionCache.signature(
+                    vehs_in_group, road_graph, config)
+                moves = self._cache.get(signatures[group_key], T, config)
+                if moves is not None:
+                    cached[group_key] = moves
+        branches = {}
+        if config["DECISION_WORKERS"] > 0:
+            branches = self._search_in_workers(
+                T, {
+                    group_idx: vehs_in_group
+                    for group_idx, vehs_in_group in group_info.items()
+                    if tuple(sorted(veh.id for veh in vehs_in_group)) not in cached
+                }, road_graph, prediction, config, deadline)
+        for group_pos, (group_idx, vehs_in_group) in enumerate(group_info.items()):
             # decide for group with group_idx
-            mcts_init_state = [veh for veh in vehs_in_group]
-            actions = {veh.id: [] for veh in vehs_in_group}
-
-            current_node = mcts.Node(
-                FlowState(
-                    [mcts_init_state],
-                    road_graph,
-                    actions,
-                    complete_decisions,
-                    prediction,
-                    time=0,
-                    config=config,
-                )
+            group_key = tuple(sorted(veh.id for veh in vehs_in_group))
+            root_state = FlowState.initial(
+                vehs_in_group,
+                road_graph,
+                complete_decisions,
+                prediction,
+                config,
             )
-
-            for t in range(
-                int(config["MAX_DECISION_TIME"] / config["DECISION_RESOLUTION"])
-            ):
-                current_node = mcts.uct_search(200 / (t / 2 + 1), current_node)
-                if current_node is None:
-                    # decision failed
-                    break
-                # print("Best Child: ", current_node.visits / (200 / (t / 2 + 1)) * 100, "%")
-                temp_best = current_node
-                while temp_best.children:
-                    temp_best = mcts.best_child(temp_best, 0)
-                if temp_best.state.terminal() and temp_best.state.reward() > 0.8:
-                    # Best child is at end
-                    break
-
-            while (
-                current_node is not None
-                and current_node.children
-                and not current_node.state.terminal()
-            ):
-                current_node = mcts.best_child(current_node, 0)
-            if current_node is None or current_node.state.reward() < 0.5:
+            leaf, moves, reused = None, None, False
+            if group_key in cached:
+                leaf = self._replay(root_state, cached[group_key])
+                reused = leaf is not None and leaf.reward() >= 0.5
+                if not reused:
+                    logging.debug(
+                        "Cached branch of group %d no longer holds, "
+                        "searching it again", group_idx)
+                    leaf = None
+            elif group_key in branches:
+                moves = branches[group_key]
+                if moves is not None:
+                    leaf = self._replay(root_state, moves)
+                    if leaf is None:
+                        logging.debug(
+                            "Branch of group %d collides with the decided "
+                            "groups, searching it again", group_idx)
+            if leaf is None and (group_key not in branches or moves is not None):
+                root = mcts.Node(root_state, prior=kept_subtrees.get(group_key))
+                time_limit = None
+                if deadline is not None:
+                    # the groups left share the time left
+                    time_limit = max(0.0, deadline - time.monotonic()) / (
+                        len(group_info) - group_pos)
+                current_node = _search_group(root, config, time_limit)
+                self._keep_executed_subtree(group_key, root, current_node,
+                                            config)
+                leaf = current_node.state if current_node is not None else None
+            if leaf is None or leaf.reward() < 0.5:
                 logging.warning(
                     "Decision failed for group %d, ignoring these vehicles", group_idx,
                 )
                 continue
-            logging.debug("Final reward: %f", current_node.state.reward())
+            logging.debug("Final reward: %f", leaf.reward())
+            if group_key in signatures and not reused:
+                self._cache.put(signatures[group_key], T,
+                                [state.move for state in leaf.history()[1:]],
+                                config)
             decisions = {}
-            for i in range(1, len(current_node.state.states_list)):
-                for veh in current_node.state.states_list[i]:
-                    decision_at_t = SingleStepDecision()
-                    decision_at_t.expected_state = veh.current_state
-                    decision_at_t.expected_time = T + i * config["DECISION_RESOLUTION"]
-                    decision_at_t.action = current_node.state.actions[veh.id][i - 1]
-                    if veh.id not in decisions:
-                        decisions[veh.id] = []
-                    decisions[veh.id].append(decision_at_t)
+            # rebuild the decisions of the chosen branch only
+            for i, veh, expected_state, action in leaf.expected_states():
+                decision_at_t = SingleStepDecision()
+                decision_at_t.expected_state = expected_state
+                decision_at_t.expected_time = T + i * config["DECISION_RESOLUTION"]
+                decision_at_t.action = action
+                if veh.id not in decisions:
+                    decisions[veh.id] = []
+                decisions[veh.id].append(decision_at_t)
             for veh in vehs_in_group:
                 if (
                     veh.id not in decisions
@@ -294,4 +494,109 @@ class MultiDecisionMaker(AbstractMultiDecisionMaker):
         #     for decision in decisions:
         #         print(decision.action, end="\t")
         #     print()
+        if signatures:
+            logging.debug("Decision cache: %d hits, %d misses in total",
+                          self._cache.hits, self._cache.misses)
         return complete_decisions
+
+    def _search_in_workers(self, T: float, group_info: dict,
+                           road_graph: RoadGraph, prediction: Prediction,
+                           config: dict,
+                           deadline: float = None) -> Dict[tuple, List[tuple]]:
+        """Search every group with DECISION_TREES independent trees on the
+           worker pool. The visits and rewards of the first moves are merged
+           over the trees of a group (root parallelism) and the branch of
+           the best tree starting with the best first move is returned.
+           The groups are searched concurrently, so they do not see the
+           decisions of each other; the branches are replayed against the
+           decided groups by make_decision. With a deadline, the trees
+           share the time left as if they ran in rounds on the workers.
+
+        Returns:
+            Dict[tuple, List[tuple]]: the moves of the best branch by group
+                key, None for a group whose search failed
+        """
+        pool = self._workers.executor(config["DECISION_WORKERS"])
+        scene = self._workers.share_scene(road_graph)
+        vehicles = {
+            veh.id: veh for vehs_in_group in group_info.values()
+            for veh in vehs_in_group
+        }
+        tick = self._workers.share_tick((vehicles, prediction, config))
+        seed = "%s:%d" % (config["DECISION_SEED"],
+                          round(T / config["DT"]))
+
+        trees = max(1, config["DECISION_TREES"])
+        time_limit = None
+        if deadline is not None:
+            rounds = math.ceil(len(group_info) * trees / config["DECISION_WORKERS"])
+            time_limit = max(0.0, deadline - time.monotonic()) / max(1, rounds)
+        tasks = []
+        for vehs_in_group in group_info.values():
+            group = tuple(veh.id for veh in vehs_in_group)
+            group_seed = "%s:%s" % (seed, "/".join(map(str, sorted(group))))
+            tasks.append((group, [
+                pool.submit(_search_in_worker, scene, tick, group,
+                            "%s:%d" % (group_seed, tree), time_limit)
+                for tree in range(trees)
+            ]))
+
+        branches = {}
+        for group, futures in tasks:
+            results = [future.result() for future in futures]
+            first_moves = {}
+            for root_stats, _, _ in results:
+                for move, (visits, reward) in root_stats.items():
+                    total = first_moves.setdefault(move, [0, 0.0])
+                    total[0] += visits
+                    total[1] += reward
+            best_move = max(first_moves,
+                            key=lambda move: (first_moves[move][1] /
+                                              first_moves[move][0],
+                                              first_moves[move][0]),
+                            default=None)
+            found = [(reward, moves) for _, moves, reward in results
+                     if moves is not None]
+            preferred = [(reward, moves) for reward, moves in found
+                         if moves and moves[0] == best_move]
+            # the first tree wins ties, which keeps the result reproducible
+            best = max(preferred or found, key=lambda result: result[0],
+                       default=(None, None))
+            branches[tuple(sorted(group))] = best[1]
+        return branches
+
+    @staticmethod
+    def _replay(root_state: FlowState, moves: List[tuple]) -> FlowState:
+        """Replay the moves of a branch from the root state, None if the
+           branch collides or one of its actions is no longer available."""
+        state = root_state
+        for move in moves:
+            actions = dict(move)
+            if state.terminal() or any(
+                    actions.get(state.context.vehicles[veh_idx].id) not in available
+                    for veh_idx, available in zip(state.veh_idx.tolist(),
+                                                  state.actions_list)):
+                return None
+            state = state.successor(move)
+            if state.num_moves == 0:
+                return None
+        return state
+
+    def close(self) -> None:
+        """Shut down the worker pool, if any."""
+        self._workers.close()
+
+    def _keep_executed_subtree(self, group_key: tuple, root: mcts.Node,
+                               leaf: mcts.Node, config: dict) -> None:
+        """Keep the subtree the vehicles will have reached at the next
+           decision, following the chosen branch from root to leaf. The next
+           search of the same group starts with its statistics."""
+        branch = []
+        while leaf is not None:
+            branch.append(leaf)
+            leaf = leaf.parent
+        branch.reverse()
+        depth = round(config["DECISION_INTERVAL"] / config["DECISION_RESOLUTION"])
+        if not branch or branch[0] is not root or depth >= len(branch):
+            return
+        self._kept_subtrees[group_key] = branch[depth].detach()
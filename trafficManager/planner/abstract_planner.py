@@ -10,6 +10,7 @@ from abc import ABC, abstractmethod
 from typing import Dict
 
 from common.observation import Observation
+from common.occupancy import OccupancyIndex
 from common.vehicle import Vehicle
 from decision_maker.abstract_decision_maker import EgoDecision, MultiDecision
 from predictor.abstract_predictor import Prediction
@@ -26,6 +27,7 @@ class AbstractEgoPlanner(ABC):
         road_graph: RoadGraph,
         prediction: Prediction = None,
         ego_decision: EgoDecision = None,
+        occupancy: OccupancyIndex = None,
     ) -> Trajectory:
         pass
 
@@ -38,5 +40,10 @@ class AbstractMultiPlanner(ABC):
         road_graph: RoadGraph,
         prediction: Prediction = None,
         multi_decision: MultiDecision = None,
+        occupancy: OccupancyIndex = None,
     ) -> Dict[Vehicle, Trajectory]:
         pass
+
+    def close(self) -> None:
+        """Release the resources of the planner, e.g. worker processes."""
+        pass
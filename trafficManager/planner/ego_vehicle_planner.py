@@ -1,6 +1,7 @@
 import time
 
 from common.observation import Observation
+from common.occupancy import OccupancyIndex
 from common.vehicle import Behaviour, Vehicle
 from decision_maker.abstract_decision_maker import EgoDecision, MultiDecision
 from trafficManager.planner.abstract_planner import AbstractEgoPlanner
@@ -8,9 +9,8 @@ from predictor.abstract_predictor import Prediction
 
 import logger
 import trafficManager.planner.trajectory_generator as traj_generator
-from utils.obstacles import DynamicObstacle, ObsType, Rectangle
 from utils.roadgraph import JunctionLane, NormalLane, RoadGraph
-from utils.trajectory import State, Trajectory
+from utils.trajectory import Trajectory
 
 logging = logger.get_logger(__name__)
 
@@ -23,44 +23,16 @@ class EgoPlanner(AbstractEgoPlanner):
              prediction: Prediction,
              T,
              config,
-             ego_decision: MultiDecision = None) -> Trajectory:
+             ego_decision: MultiDecision = None,
+             occupancy: OccupancyIndex = None) -> Trajectory:
 
         vehicle_id = ego_veh.id
         start = time.time()
         current_lane = roadgraph.get_lane_by_id(ego_veh.lane_id)
 
-        obs_list = []
-        # Process static obstacle
-        for obs in observation.obstacles:
-            obs_list.append(obs)
-
-        # Process dynamic_obstacles
-        for predict_veh, prediction in prediction.results.items():
-            if predict_veh.id == vehicle_id:
-                continue
-
-            shape = Rectangle(predict_veh.length, predict_veh.width)
-            current_state = State(x=prediction[0].x,
-                                  y=prediction[0].y,
-                                  s=prediction[0].s,
-                                  d=prediction[0].d,
-                                  yaw=prediction[0].yaw,
-                                  vel=prediction[0].vel)
-            dynamic_obs = DynamicObstacle(obstacle_id=predict_veh.id,
-                                          shape=shape,
-                                          obstacle_type=ObsType.CAR,
-                                          current_state=current_state,
-                                          lane_id=predict_veh.lane_id)
-            for i in range(1, len(prediction)):
-                state = State(x=prediction[i].x,
-                              y=prediction[i].y,
-                              s=prediction[i].s,
-                              d=prediction[i].d,
-                              yaw=prediction[i].yaw,
-                              vel=prediction[i].vel)
-                dynamic_obs.future_trajectory.states.append(state)
-
-            obs_list.append(dynamic_obs)
+        if occupancy is None:
+            occupancy = OccupancyIndex.from_prediction(observation, prediction)
+        obs_list = occupancy.without(vehicle_id)
 
         """
         Predict for current vehicle
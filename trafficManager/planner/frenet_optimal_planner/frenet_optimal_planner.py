@@ -18,13 +18,57 @@ import copy
 
 import common.cost as cost
 from utils.load_config import load_config
-from utils.trajectory import Trajectory, State
+from utils.trajectory import Trajectory, TrajectoryBatch, State
 from utils.cubic_spline import Spline2D
-from trafficManager.planner.frenet_optimal_planner.polynomial_curve import QuarticPolynomial, QuinticPolynomial
+from trafficManager.planner.frenet_optimal_planner.polynomial_curve import QuarticPolynomialBatch, QuinticPolynomialBatch
+
+
+def calc_path_columns(lat_qp, lon_qp, T, dt):
+    """Sample every pair of a lateral and a longitudinal polynomial.
+
+    Args:
+        lat_qp (QuinticPolynomialBatch): N_lat lateral polynomials
+        lon_qp (QuarticPolynomialBatch | QuinticPolynomialBatch): N_lon
+            longitudinal polynomials
+        T (float): horizon shared by all the polynomials
+        dt (float): time step
+
+    Returns:
+        dict: State field name -> (N_lat * N_lon, N_steps) array, the
+            candidate of lat_qp[i] and lon_qp[j] is the row i * N_lon + j
+    """
+    t = np.arange(0.0, T * 1.01, dt)
+    n_lat, n_lon = len(lat_qp), len(lon_qp)
+    columns = {"t": np.broadcast_to(t, (n_lat * n_lon, len(t)))}
+    for names, qp, repeat in (
+        (("d", "d_d", "d_dd", "d_ddd"), lat_qp, True),
+        (("s", "s_d", "s_dd", "s_ddd"), lon_qp, False),
+    ):
+        for name, values in zip(names, qp.calc_derivatives(t)):
+            columns[name] = (np.repeat(values, n_lon, axis=0)
+                             if repeat else np.tile(values, (n_lat, 1)))
+    return columns
+
+
+def calc_spec_paths(current_state, target_s, target_s_d, target_d, T, dt):
+    """Paths from current_state to every target (target_s[j], target_s_d[j])
+    reached in T, with zero acceleration and lateral speed at the end.
+    Candidates are ordered by lateral target first.
+
+    Returns:
+        TrajectoryBatch: the candidate paths
+    """
+    lat_qp = QuinticPolynomialBatch(current_state.d, current_state.d_d,
+                                    current_state.d_dd, target_d, 0.0, 0.0, T)
+    lon_qp = QuinticPolynomialBatch(current_state.s, current_state.s_d,
+                                    current_state.s_dd, target_s, target_s_d,
+                                    0.0, T)
+    return TrajectoryBatch.from_columns(
+        **calc_path_columns(lat_qp, lon_qp, T, dt))
 
 
 def calc_spec_path(current_state, target_state, T, dt):
-    lat_qp = QuinticPolynomial(
+    lat_qp = QuinticPolynomialBatch(
         current_state.d,
         current_state.d_d,
         current_state.d_dd,
@@ -33,7 +77,7 @@ def calc_spec_path(current_state, target_state, T, dt):
         target_state.d_dd,
         T,
     )
-    lon_qp = QuinticPolynomial(
+    lon_qp = QuinticPolynomialBatch(
         current_state.s,
         current_state.s_d,
         current_state.s_dd,
@@ -42,21 +86,8 @@ def calc_spec_path(current_state, target_state, T, dt):
         target_state.s_dd,
         T,
     )
-    fp = Trajectory()
-    for t in np.arange(0.0, T * 1.01, dt):
-        fp.states.append(
-            State(
-                t=t,
-                s=lon_qp.calc_point(t),
-                d=lat_qp.calc_point(t),
-                s_d=lon_qp.calc_first_derivative(t),
-                d_d=lat_qp.calc_first_derivative(t),
-                s_dd=lon_qp.calc_second_derivative(t),
-                d_dd=lat_qp.calc_second_derivative(t),
-                s_ddd=lon_qp.calc_third_derivative(t),
-                d_ddd=lat_qp.calc_third_derivative(t),
-            ))
-    return fp
+    return TrajectoryBatch.from_columns(
+        **calc_path_columns(lat_qp, lon_qp, T, dt)).trajectory(0)
 
 
 def calc_stop_path(current_state, decel, T, dt, config):
@@ -91,40 +122,36 @@ def calc_stop_path(current_state, decel, T, dt, config):
     return stop_path
 
 
+def calc_frenet_path_batch(current_state, sample_d, Ti, sample_v, dt):
+    """Velocity keeping paths to every (lateral offset, velocity) in Ti,
+    ordered by lateral offset, then velocity.
+
+    Returns:
+        TrajectoryBatch: the candidate paths
+    """
+    # Lateral motion planning
+    lat_qp = QuinticPolynomialBatch(current_state.d, current_state.d_d,
+                                    current_state.d_dd, sample_d, 0.0, 0.0,
+                                    Ti)
+    # Longitudinal motion planning (Velocity keeping)
+    lon_qp = QuarticPolynomialBatch(current_state.s, current_state.s_d,
+                                    current_state.s_dd, sample_v, 0.0, Ti)
+    return TrajectoryBatch.from_columns(
+        **calc_path_columns(lat_qp, lon_qp, Ti, dt))
+
+
 def calc_frenet_paths(current_state, sample_d, sample_t, sample_v, dt, config):
-    frenet_paths = []
-
-    # generate path to each offset goal
-    for di in sample_d:
-        # Lateral motion planning
-        for Ti in sample_t:
-            fp = Trajectory()
-            lat_qp = QuinticPolynomial(current_state.d, current_state.d_d,
-                                       current_state.d_dd, di, 0.0, 0.0, Ti)
-            for t in np.arange(0.0, Ti * 1.01, dt):
-                fp.states.append(
-                    State(
-                        t=t,
-                        d=lat_qp.calc_point(t),
-                        d_d=lat_qp.calc_first_derivative(t),
-                        d_dd=lat_qp.calc_second_derivative(t),
-                        d_ddd=lat_qp.calc_third_derivative(t),
-                    ))
-
-            # Longitudinal motion planning (Velocity keeping)
-            for tv in sample_v:
-                lon_qp = QuarticPolynomial(current_state.s, current_state.s_d,
-                                           current_state.s_dd, tv, 0.0, Ti)
-
-                for state in fp.states:
-                    state.s = lon_qp.calc_point(state.t)
-                    state.s_d = lon_qp.calc_first_derivative(state.t)
-                    state.s_dd = lon_qp.calc_second_derivative(state.t)
-                    state.s_ddd = lon_qp.calc_third_derivative(state.t)
-
-                frenet_paths.append(fp)
-
-    return frenet_paths
+    # every (lateral offset, time, velocity) gets its own path, ordered by
+    # lateral offset, then time, then velocity
+    frenet_paths = {}
+    for i, Ti in enumerate(sample_t):
+        paths = calc_frenet_path_batch(current_state, sample_d, Ti, sample_v,
+                                       dt)
+        for j in range(len(paths)):
+            frenet_paths[j // len(sample_v), i,
+                         j % len(sample_v)] = paths.trajectory(j)
+
+    return [frenet_paths[key] for key in sorted(frenet_paths)]
 
 
 def calc_global_paths(fplist, csp):
@@ -225,27 +252,19 @@ def main():
         csp = Spline2D(x, y)
         s = np.arange(0, csp.s[-1], 0.1)
 
-        rx, ry, ryaw, rk = [], [], [], []
-        for i_s in s:
-            ix, iy = csp.calc_position(i_s)
-            rx.append(ix)
-            ry.append(iy)
-            ryaw.append(csp.calc_yaw(i_s))
-            rk.append(csp.calc_curvature(i_s))
+        rx, ry = csp.calc_position_batch(s)
+        ryaw = csp.calc_yaw_batch(s)
+        rk = csp.calc_curvature_batch(s)
 
         return rx, ry, ryaw, rk, csp
 
     tx, ty, tyaw, tc, csp = generate_target_course(wx, wy)
     # generate left right boundaries
     s = np.arange(0, csp.s[-1], 0.1)
-    left_bound, right_bound = [], []
-    for si in s:
-        xi, yi = csp.frenet_to_cartesian1D(si, -config["MAX_ROAD_WIDTH"] / 2)  # left
-        left_bound.append([xi, yi])
-        xi, yi = csp.frenet_to_cartesian1D(si, config["MAX_ROAD_WIDTH"] / 2)  # right
-        right_bound.append([xi, yi])
-    left_bound = np.array(left_bound)
-    right_bound = np.array(right_bound)
+    left_bound = np.column_stack(
+        csp.frenet_to_cartesian1D_batch(s, -config["MAX_ROAD_WIDTH"] / 2))  # left
+    right_bound = np.column_stack(
+        csp.frenet_to_cartesian1D_batch(s, config["MAX_ROAD_WIDTH"] / 2))  # right
 
     # initial state
     c_speed = 10.0 / 3.6  # current speed [m/s]
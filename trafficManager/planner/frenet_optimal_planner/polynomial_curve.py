@@ -115,3 +115,72 @@ class QuinticPolynomial:
         xt = 6 * self.a3 + 24 * self.a4 * t + 60 * self.a5 * t**2
 
         return xt
+
+
+class _PolynomialBatch:
+    """Polynomials of degree <= 5 sharing the same horizon, one per row of
+    self.coefficients (shape (N, 6), lowest order first)."""
+
+    coefficients: np.ndarray
+
+    def __len__(self):
+        return len(self.coefficients)
+
+    def calc_derivatives(self, t):
+        """Evaluate every polynomial at the times t.
+
+        Args:
+            t (np.ndarray): sample times, shape (M,)
+
+        Returns:
+            np.ndarray: shape (4, N, M), the value and the first, second and
+                third derivatives
+        """
+        t = np.asarray(t, dtype=float)
+        powers = t[np.newaxis, :]**np.arange(6)[:, np.newaxis]
+        c = self.coefficients
+        return np.stack((
+            c @ powers,
+            c[:, 1:] @ (np.array([1.0, 2, 3, 4, 5])[:, np.newaxis] * powers[:5]),
+            c[:, 2:] @ (np.array([2.0, 6, 12, 20])[:, np.newaxis] * powers[:4]),
+            c[:, 3:] @ (np.array([6.0, 24, 60])[:, np.newaxis] * powers[:3]),
+        ))
+
+
+class QuarticPolynomialBatch(_PolynomialBatch):
+    """QuarticPolynomial for arrays of boundary conditions with the same
+    time. The 2x2 boundary matrix only depends on time, so its inverse is
+    written in closed form and applied to all the conditions at once."""
+
+    def __init__(self, xs, vxs, axs, vxe, axe, time):
+        xs, vxs, axs, vxe, axe = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(v, dtype=float))
+              for v in (xs, vxs, axs, vxe, axe)))
+        a2 = axs / 2.0
+        b = np.stack((vxe - vxs - 2 * a2 * time, axe - 2 * a2), axis=-1)
+        A_inv = np.array([[1 / time**2, -1 / (3 * time)],
+                          [-1 / (2 * time**3), 1 / (4 * time**2)]])
+        self.coefficients = np.column_stack(
+            (xs, vxs, a2, b @ A_inv.T, np.zeros_like(xs)))
+
+
+class QuinticPolynomialBatch(_PolynomialBatch):
+    """QuinticPolynomial for arrays of boundary conditions with the same
+    horizon T, see QuarticPolynomialBatch."""
+
+    def __init__(self, xs, vxs, axs, xe, vxe, axe, T):
+        xs, vxs, axs, xe, vxe, axe = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(v, dtype=float))
+              for v in (xs, vxs, axs, xe, vxe, axe)))
+        a2 = axs / 2.0
+        b = np.stack((
+            xe - xs - vxs * T - a2 * T**2,
+            vxe - vxs - 2 * a2 * T,
+            axe - 2 * a2,
+        ), axis=-1)
+        A_inv = np.array([
+            [10 / T**3, -4 / T**2, 0.5 / T],
+            [-15 / T**4, 7 / T**3, -1 / T**2],
+            [6 / T**5, -3 / T**4, 0.5 / T**3],
+        ])
+        self.coefficients = np.column_stack((xs, vxs, a2, b @ A_inv.T))
@@ -1,7 +1,16 @@
+import math
 import time
-from typing import Dict, List
+from collections import Counter, defaultdict
+from concurrent.futures import wait
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
 
+import numpy as np
+
+from common import cost
 from common.observation import Observation
+from common.occupancy import OccupancyIndex
+from common.worker_pool import WorkerPool, load_scene, load_tick
 from common.vehicle import Behaviour, Vehicle, VehicleType
 from decision_maker.abstract_decision_maker import (
     EgoDecision,
@@ -14,21 +23,85 @@ from predictor.abstract_predictor import Prediction
 import logger
 import trafficManager.planner.trajectory_generator as traj_generator
 from utils.roadgraph import AbstractLane, JunctionLane, NormalLane, RoadGraph
-from utils.trajectory import Trajectory, State
-from utils.obstacles import DynamicObstacle, ObsType, Rectangle
+from utils.trajectory import FIELD_INDEX, Trajectory, TrajectoryBatch
 
 logging = logger.get_logger(__name__)
 
 
+@dataclass
+class KeptPlan:
+    """The last path of a vehicle, kept for incremental replanning."""
+    T: float  # time of the first state of the path
+    sampled_T: float  # time a generator last sampled the path
+    path: TrajectoryBatch  # a copy of the path, as a single row
+    behaviour: Behaviour
+    decision_list: List[SingleStepDecision]
+    waiting: bool  # whether the vehicle was waiting for a green light
+
+
+def _plan_in_worker(scene: Tuple[int, str], tick: Tuple[int, bytes],
+                    vehicle: Vehicle,
+                    decision_list: List[SingleStepDecision]):
+    """Plan one vehicle in a worker process of MultiVehiclePlanner.
+
+    Args:
+        scene (Tuple[int, str]): version and pickle file of the roadgraph,
+            only loaded when the version changes
+        tick (Tuple[int, bytes]): id and pickled inputs of the planning tick,
+            only unpickled when the id changes
+        vehicle (Vehicle): the vehicle to plan
+        decision_list (List[SingleStepDecision]): decisions of the vehicle
+
+    Returns:
+        Tuple[Trajectory, List[SingleStepDecision]]: the planned path and
+            the decisions, which the decision generator may update
+    """
+    roadgraph = load_scene(scene)
+    T, config, traffic_lights, occupancy = load_tick(tick)
+    for lane_id, (curr_state, next_state, switch_time) in traffic_lights.items():
+        lane = roadgraph.junction_lanes[lane_id]
+        lane.currTlState, lane.nexttTlState = curr_state, next_state
+        lane.switchTime = switch_time
+
+    path = MultiVehiclePlanner().generate_trajectory(
+        roadgraph, T, config, vehicle,
+        roadgraph.get_lane_by_id(vehicle.lane_id),
+        occupancy.without(vehicle.id), decision_list)
+    return path, decision_list
+
+
 class MultiVehiclePlanner(AbstractMultiPlanner):
+    """
+    Plans every controlled vehicle in the AoI. With PLANNER_WORKERS > 0 in
+    the config, the vehicles are planned on a persistent pool of worker
+    processes, which receive the roadgraph only when the scene changes.
+    """
+
+    def __init__(self) -> None:
+        self._workers = WorkerPool(prefix="planner_scene_")
+        # last path of every planned vehicle, with INCREMENTAL_REPLANNING
+        self._kept_plans: Dict[int, KeptPlan] = {}
+        # "reused" and "replanned" ticks of every vehicle
+        self.replan_counts: Dict[int, Counter] = defaultdict(Counter)
+
     def plan(self,
              controlled_observation: Observation,
              roadgraph: RoadGraph,
              uncontrolled_prediction: Prediction,
              T,
              config,
-             multi_decision: MultiDecision = None) -> Dict[Vehicle, Trajectory]:
+             multi_decision: MultiDecision = None,
+             occupancy: OccupancyIndex = None) -> Dict[Vehicle, Trajectory]:
         plan_result: Dict[int, Trajectory] = {}
+        if occupancy is None:
+            occupancy = OccupancyIndex.from_prediction(controlled_observation,
+                                                       uncontrolled_prediction)
+        kept_plans = self._kept_plans
+        self._kept_plans = {}
+        if config["PLANNER_WORKERS"] > 0:
+            return self.plan_in_workers(controlled_observation, roadgraph,
+                                        occupancy, T, config, multi_decision,
+                                        kept_plans)
         for vehicle in controlled_observation.vehicles:
             start = time.time()
             if vehicle.vtype == VehicleType.OUT_OF_AOI:
@@ -38,22 +111,292 @@ class MultiVehiclePlanner(AbstractMultiPlanner):
 
             current_lane = roadgraph.get_lane_by_id(vehicle.lane_id)
 
-            obs_list = self.extract_obstacles(controlled_observation,
-                                              uncontrolled_prediction,
-                                              vehicle,roadgraph)
+            obs_list = occupancy.without(vehicle.id)
             decision_list = self.find_decision(vehicle, multi_decision, T,
                                                config)
             # Plan for current vehicle
-            path = self.generate_trajectory(
-                roadgraph, T, config, vehicle, current_lane, obs_list, decision_list
-            )
+            path = None
+            if config["INCREMENTAL_REPLANNING"]:
+                path = self.reuse_plan(kept_plans.get(vehicle.id), vehicle,
+                                       roadgraph, obs_list, T, config,
+                                       decision_list)
+            if path is None:
+                path = self.generate_trajectory(
+                    roadgraph, T, config, vehicle, current_lane, obs_list, decision_list
+                )
+                self.keep_plan(vehicle, path, roadgraph, T, config,
+                               decision_list)
             logging.debug(
                 f"Vehicle {vehicle.id} Total planning time: {time.time() - start}"
             )
             plan_result[vehicle.id] = path
 
+        self._log_replanning(config)
+        return plan_result
+
+    def plan_in_workers(self, controlled_observation: Observation,
+                        roadgraph: RoadGraph, occupancy: OccupancyIndex, T,
+                        config, multi_decision: MultiDecision = None,
+                        kept_plans: Dict[int, KeptPlan] = None
+                        ) -> Dict[int, Trajectory]:
+        """Plan the vehicles on the worker pool. The results are merged in
+           the order of the observation, so they match the sequential mode.
+           The vehicles whose results are not back PLANNER_TIMEOUT after
+           the tasks are submitted are planned again in the main process,
+           and the pool is replaced so that no stuck task holds a worker.
+
+        Args:
+            controlled_observation (Observation): the observation of the tick
+            roadgraph (RoadGraph): the roadgraph of the current scene
+            occupancy (OccupancyIndex): the obstacles of the tick
+            T (float): the current time
+            config (dict): the planning config
+            multi_decision (MultiDecision, optional): the decisions.
+                Defaults to None.
+            kept_plans (Dict[int, KeptPlan], optional): the last paths of
+                the vehicles, for incremental replanning. Defaults to None.
+
+        Returns:
+            Dict[int, Trajectory]: the planned paths by vehicle id
+        """
+        kept_plans = kept_plans or {}
+        pool = self._workers.executor(config["PLANNER_WORKERS"])
+        scene = self._workers.share_scene(roadgraph)
+        traffic_lights = {
+            lane.id: (lane.currTlState, lane.nexttTlState, lane.switchTime)
+            for lane in roadgraph.junction_lanes.values()
+        }
+        tick = self._workers.share_tick((T, config, traffic_lights, occupancy))
+
+        deadline = time.monotonic() + config["PLANNER_TIMEOUT"]
+        tasks = []
+        for vehicle in controlled_observation.vehicles:
+            if vehicle.vtype == VehicleType.OUT_OF_AOI:
+                continue
+            if config["EGO_PLANNER"] and vehicle.vtype == VehicleType.EGO:
+                continue
+            decision_list = self.find_decision(vehicle, multi_decision, T,
+                                               config)
+            if config["INCREMENTAL_REPLANNING"]:
+                path = self.reuse_plan(kept_plans.get(vehicle.id), vehicle,
+                                       roadgraph, occupancy.without(vehicle.id),
+                                       T, config, decision_list)
+                if path is not None:
+                    tasks.append((vehicle, decision_list, path))
+                    continue
+            tasks.append((vehicle, decision_list,
+                          pool.submit(_plan_in_worker, scene, tick, vehicle,
+                                      decision_list)))
+
+        _, pending = wait(
+            [future for _, _, future in tasks
+             if not isinstance(future, Trajectory)],
+            timeout=max(0.0, deadline - time.monotonic()))
+        if pending:
+            logging.warning(
+                "Planning of %d vehicles timed out in workers, planning them in the main process",
+                len(pending))
+            self._workers.close(wait=False)
+
+        plan_result: Dict[int, Trajectory] = {}
+        for vehicle, decision_list, future in tasks:
+            if isinstance(future, Trajectory):
+                # reused plan
+                plan_result[vehicle.id] = future
+                continue
+            if future in pending:
+                path = self.generate_trajectory(
+                    roadgraph, T, config, vehicle,
+                    roadgraph.get_lane_by_id(vehicle.lane_id),
+                    occupancy.without(vehicle.id), decision_list)
+            else:
+                path, planned_decisions = future.result()
+                # keep the lane change projections of the decision generator
+                for decision, planned in zip(decision_list or [],
+                                             planned_decisions or []):
+                    decision.expected_state.s = planned.expected_state.s
+                    decision.expected_state.d = planned.expected_state.d
+            self.keep_plan(vehicle, path, roadgraph, T, config, decision_list)
+            plan_result[vehicle.id] = path
+
+        self._log_replanning(config)
         return plan_result
 
+    def keep_plan(self, vehicle: Vehicle, path: Trajectory,
+                  roadgraph: RoadGraph, T: float, config: dict,
+                  decision_list: List[SingleStepDecision],
+                  sampled_T: float = None) -> None:
+        """Keep a new path of a vehicle for incremental replanning.
+
+        Args:
+            vehicle (Vehicle): the planned vehicle
+            path (Trajectory): its path, starting at time T
+            roadgraph (RoadGraph): the roadgraph of the current scene
+            T (float): the current time
+            config (dict): the planning config
+            decision_list (List[SingleStepDecision]): the decisions the path
+                was planned with
+            sampled_T (float, optional): the time a generator sampled the
+                path. Defaults to T, for a new path.
+        """
+        if not config["INCREMENTAL_REPLANNING"] or path is None:
+            return
+        self.replan_counts[vehicle.id][
+            "replanned" if sampled_T is None else "reused"] += 1
+        self._kept_plans[vehicle.id] = KeptPlan(
+            T=T,
+            sampled_T=T if sampled_T is None else sampled_T,
+            path=TrajectoryBatch.stack([path]),
+            behaviour=vehicle.behaviour,
+            decision_list=decision_list,
+            waiting=self._is_waiting(vehicle, roadgraph),
+        )
+
+    def reuse_plan(self, kept_plan: KeptPlan, vehicle: Vehicle,
+                   roadgraph: RoadGraph, obs_list, T: float, config: dict,
+                   decision_list: List[SingleStepDecision]) -> Trajectory:
+        """Continue the last path of a vehicle if it is still valid: the
+           vehicle has the same behaviour, decisions and traffic light to
+           wait for, it is on the lane and close to the position the path
+           planned, the path is not older than REPLAN_MAX_AGE, and no
+           obstacle adds to the cost of the rest of the path. The rest of
+           the path is extended at constant speed along the lane to its
+           former length.
+
+        Args:
+            kept_plan (KeptPlan): the last path of the vehicle, if any
+            vehicle (Vehicle): the vehicle to plan
+            roadgraph (RoadGraph): the roadgraph of the current scene
+            obs_list: the obstacles of the vehicle
+            T (float): the current time
+            config (dict): the planning config
+            decision_list (List[SingleStepDecision]): the current decisions
+
+        Returns:
+            Trajectory: the continued path, None if the vehicle needs a new
+                one
+        """
+        if kept_plan is None:
+            return None
+        dt = config["DT"]
+        offset = round((T - kept_plan.T) / dt)
+        size = kept_plan.path.sizes[0]
+        reason = None
+        if (vehicle.behaviour != kept_plan.behaviour
+                or decision_list is not kept_plan.decision_list):
+            reason = "new behaviour or decisions"
+        elif T - kept_plan.sampled_T > config["REPLAN_MAX_AGE"]:
+            reason = "age"
+        elif not 0 < offset < size - 1:
+            reason = "end of path"
+        elif self._is_waiting(vehicle, roadgraph) != kept_plan.waiting:
+            reason = "traffic light"
+        else:
+            values = kept_plan.path.values[:, 0, offset:size]
+            lane_ids = kept_plan.path.lane_ids[0, offset:size]
+            state = vehicle.current_state
+            if (lane_ids[0] != vehicle.lane_id and isinstance(
+                    roadgraph.get_lane_by_id(vehicle.lane_id), NormalLane)):
+                reason = "lane"
+            elif math.hypot(values[FIELD_INDEX["x"], 0] - state.x,
+                            values[FIELD_INDEX["y"], 0] -
+                            state.y) > config["REPLAN_TOLERANCE"]:
+                reason = "tracking error"
+        if reason is not None:
+            logging.debug("Vehicle %s is replanned: %s", vehicle.id, reason)
+            return None
+
+        paths = TrajectoryBatch(
+            *self._extend_path(values, lane_ids, size - values.shape[1],
+                               vehicle, roadgraph, dt))
+        paths.values[FIELD_INDEX["t"]] -= paths.values[FIELD_INDEX["t"], 0, 0]
+        obs_cost = cost.obs_batch(vehicle, paths, obs_list, config)[0]
+        if obs_cost != 0:
+            logging.debug("Vehicle %s is replanned: obstacle cost %f",
+                          vehicle.id, obs_cost)
+            return None
+        path = paths.trajectory(0)
+        self.keep_plan(vehicle, path, roadgraph, T, config, decision_list,
+                       kept_plan.sampled_T)
+        return path
+
+    @staticmethod
+    def _extend_path(values: np.ndarray, lane_ids: np.ndarray, steps: int,
+                     vehicle: Vehicle, roadgraph: RoadGraph,
+                     dt: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Append up to steps states to a path, at the speed and lateral
+           offset of its last state along its last lane and the next
+           available one.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: values of shape
+                (fields, 1, states) and lane ids of shape (1, states)
+        """
+        lane = roadgraph.get_lane_by_id(lane_ids[-1])
+        if steps <= 0 or lane is None:
+            return values[:, np.newaxis], lane_ids[np.newaxis]
+        last = values[:, -1]
+        s, d = lane.course_spline.cartesian_to_frenet1D(
+            last[FIELD_INDEX["x"]], last[FIELD_INDEX["y"]])
+        advance = last[FIELD_INDEX["vel"]] * dt * np.arange(1, steps + 1)
+        local_s = s + advance
+        lanes, lane_of = [lane], np.zeros(steps, dtype=int)
+        beyond = local_s > lane.spline_length
+        if beyond.any():
+            next_lane = roadgraph.get_available_next_lane(
+                lane.id, vehicle.available_lanes)
+            if next_lane is None:
+                steps = int(np.argmax(beyond))
+            else:
+                lanes.append(next_lane)
+                lane_of[beyond] = 1
+                local_s[beyond] -= lane.spline_length
+        extension = np.repeat(last[:, np.newaxis], steps, axis=1)
+        extension_ids = np.empty(steps, dtype=object)
+        for lane_idx, lane in enumerate(lanes):
+            on_lane = lane_of[:steps] == lane_idx
+            rx, ry = lane.course_spline.calc_position_batch(local_s[:steps][on_lane])
+            ryaw = lane.course_spline.calc_yaw_batch(local_s[:steps][on_lane])
+            extension[FIELD_INDEX["x"], on_lane] = rx - np.sin(ryaw) * d
+            extension[FIELD_INDEX["y"], on_lane] = ry + np.cos(ryaw) * d
+            extension[FIELD_INDEX["yaw"], on_lane] = ryaw
+            extension_ids[on_lane] = lane.id
+        extension[FIELD_INDEX["t"]] += dt * np.arange(1, steps + 1)
+        # s goes on in the frame of the path
+        extension[FIELD_INDEX["s"]] += advance[:steps]
+        for name in ("acc", "s_dd", "s_ddd", "d_d", "d_dd", "d_ddd"):
+            extension[FIELD_INDEX[name]] = 0
+        return (np.concatenate((values, extension), axis=1)[:, np.newaxis],
+                np.concatenate((lane_ids, extension_ids))[np.newaxis])
+
+    def _is_waiting(self, vehicle: Vehicle, roadgraph: RoadGraph) -> bool:
+        current_lane = roadgraph.get_lane_by_id(vehicle.lane_id)
+        return self.is_waiting_for_green_light(
+            current_lane,
+            roadgraph.get_available_next_lane(current_lane.id,
+                                              vehicle.available_lanes))
+
+    def reuse_rates(self) -> Dict[int, float]:
+        """Share of the ticks in which each vehicle continued its last path,
+           with INCREMENTAL_REPLANNING."""
+        return {
+            vehicle_id: counts["reused"] / (counts["reused"] + counts["replanned"])
+            for vehicle_id, counts in self.replan_counts.items()
+        }
+
+    def _log_replanning(self, config: dict) -> None:
+        if not config["INCREMENTAL_REPLANNING"]:
+            return
+        reused = sum(counts["reused"] for counts in self.replan_counts.values())
+        replanned = sum(counts["replanned"]
+                        for counts in self.replan_counts.values())
+        logging.debug("Incremental replanning: %d plans reused, %d replanned",
+                      reused, replanned)
+
+    def close(self) -> None:
+        """Shut down the worker pool, if any."""
+        self._workers.close()
+
     def generate_trajectory(
         self, roadgraph:RoadGraph, T, config, vehicle: Vehicle, current_lane : AbstractLane, obs_list, decision_list
     ):
@@ -175,49 +518,3 @@ class MultiVehiclePlanner(AbstractMultiPlanner):
         if not self.is_in_intersection(current_lane, next_lane):
             return False
         return next_lane.currTlState in ("R", "r")
-
-    def extract_obstacles(self, observation: Observation,
-                          predictions, ego: Vehicle, roadgraph: RoadGraph):
-        obs_list = []
-        # Process static obstacle
-        for obs in observation.obstacles:
-            obs_list.append(obs)
-
-        veh_edges = set()
-        for lane_id in ego.available_lanes:
-            lane = roadgraph.get_lane_by_id(lane_id)
-            if isinstance(lane, JunctionLane):
-                veh_edges.add(lane.affJunc)
-            elif isinstance(lane, NormalLane):
-                veh_edges.add(lane.affiliated_edge.id)
-        # Process dynamic obstacles
-        for vehicle, prediction in predictions.results.items():
-            if vehicle.id == ego.id:
-                continue
-            if not prediction:
-                continue
-            shape = Rectangle(vehicle.length, vehicle.width)
-            current_state = State(x=prediction[0].x,
-                                  y=prediction[0].y,
-                                  s=prediction[0].s,
-                                  d=prediction[0].d,
-                                  yaw=prediction[0].yaw,
-                                  vel=prediction[0].vel)
-            dynamic_obs = DynamicObstacle(obstacle_id=vehicle.id,
-                                          shape=shape,
-                                          obstacle_type=ObsType.CAR,
-                                          current_state=current_state,
-                                          lane_id=vehicle.lane_id)
-            for i in range(1, len(prediction)):
-                state = State(
-                    x=prediction[i].x,
-                    y=prediction[i].y,
-                    s=prediction[i].s,
-                    d=prediction[i].d,
-                    yaw=prediction[i].yaw,
-                    vel=prediction[i].vel,
-                )
-                dynamic_obs.future_trajectory.states.append(state)
-
-            obs_list.append(dynamic_obs)
-        return obs_list
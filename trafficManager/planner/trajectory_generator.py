@@ -16,7 +16,7 @@ from common import cost
 
 from utils.roadgraph import AbstractLane, JunctionLane, RoadGraph,NormalLane
 from utils.obstacles import ObsType, Obstacle
-from utils.trajectory import State, Trajectory
+from utils.trajectory import State, Trajectory, TrajectoryBatch
 
 from trafficManager.planner.frenet_optimal_planner import frenet_optimal_planner
 from trafficManager.decision_maker.abstract_decision_maker import SingleStepDecision
@@ -45,6 +45,38 @@ def check_path(vehicle, path):
         return True
 
 
+def check_paths(vehicle, paths: TrajectoryBatch) -> np.ndarray:
+    """Vectorized version of check_path, without the collision check."""
+    vel, s_dd = paths.column("vel"), paths.column("s_dd")
+    violation = ((vel > vehicle.max_speed) |  # Max speed check
+                 (s_dd > vehicle.max_accel) |  # Max acceleration check
+                 (s_dd < vehicle.max_decel))
+    return ~np.any(violation & paths.mask, axis=1)
+
+
+def select_best_path(paths: TrajectoryBatch, path_costs: np.ndarray,
+                     feasible: np.ndarray = None) -> Trajectory:
+    """Pick the cheapest feasible candidate, the first one on ties.
+
+    Args:
+        paths (TrajectoryBatch): the candidates
+        path_costs (np.ndarray): the total cost of every candidate
+        feasible (np.ndarray, optional): mask of the candidates to consider.
+            Defaults to all of them.
+
+    Returns:
+        Trajectory: the best candidate with its cost, None if no candidate
+            has a finite cost
+    """
+    path_costs = np.where(np.isnan(path_costs), math.inf, path_costs)
+    if feasible is not None:
+        path_costs = np.where(feasible, path_costs, math.inf)
+    if len(path_costs) == 0 or np.min(path_costs) == math.inf:
+        return None
+    best = int(np.argmin(path_costs))
+    return paths.trajectory(best, float(path_costs[best]))
+
+
 def lanechange_trajectory_generator(
     vehicle: Vehicle,
     target_lane: AbstractLane,
@@ -80,33 +112,24 @@ def lanechange_trajectory_generator(
 
     # Step 2: Calculate Paths
     best_path = None
-    best_cost = math.inf
     for t in sample_t:
-        for s in sample_s:
-            for s_d in sample_vel:
-                target_state = State(t=t, s=s, d=0, s_d=s_d)
-                path = frenet_optimal_planner.calc_spec_path(
-                    state_in_target_lane, target_state, target_state.t, dt)
-                if not path.states:
-                    continue
-                path.frenet_to_cartesian(target_lane, vehicle.current_state)
-                path.cost = (
-                    cost.smoothness(path, target_lane.course_spline,
-                                    config["weights"]) * dt +
-                    cost.vel_diff(path, target_vel, config["weights"]) * dt +
-                    cost.guidance(path, config["weights"]) * dt +
-                    cost.acc(path, config["weights"]) * dt +
-                    cost.jerk(path, config["weights"]) * dt +
-                    cost.obs(vehicle, path, obs_list, config) +
-                    cost.changelane(config["weights"]))
-                if not path.is_nonholonomic():
-                    continue
-                if path.cost < best_cost:
-                    best_cost = path.cost
-                    best_path = path
+        # all the (s, s_d) targets of this time are sampled and scored at once
+        target_s, target_s_d = np.meshgrid(sample_s, sample_vel, indexing="ij")
+        paths = frenet_optimal_planner.calc_spec_paths(
+            state_in_target_lane, target_s.ravel(), target_s_d.ravel(), 0, t,
+            dt)
+        paths.frenet_to_cartesian(target_lane, vehicle.current_state)
+        path_costs = sum(
+            cost.candidate_costs(vehicle, paths, target_lane.course_spline,
+                                 target_vel, obs_list, config).values()
+        ) + cost.changelane(config["weights"])
+        path = select_best_path(paths, path_costs)
+        if path is not None and (best_path is None or
+                                 path.cost < best_path.cost):
+            best_path = path
 
     if best_path is not None:
-        logging.debug(f"Vehicle {vehicle.id} found a lane change path with cost: {best_cost}")
+        logging.debug(f"Vehicle {vehicle.id} found a lane change path with cost: {best_path.cost}")
         return best_path
 
     # return stop path
@@ -190,17 +213,19 @@ def stop_trajectory_generator(vehicle: Vehicle,
                 ):
                     continue
 
-                for i in range(0, min(len(obs.future_trajectory.states), 20), 3):
-                    obs_s, obs_d = course_spline.cartesian_to_frenet1D(
-                        obs.future_trajectory.states[i].x,
-                        obs.future_trajectory.states[i].y)
-                    if obs_s <= s[0] or obs_s >= s[-1]:
-                        next_lane = roadgraph.get_lane_by_id(current_lane.next_lane_id)
-                        nextlane_spline = next_lane.course_spline
-                        obs_s, obs_d = nextlane_spline.cartesian_to_frenet1D(
-                            obs.future_trajectory.states[i].x,
-                            obs.future_trajectory.states[i].y)
-                        obs_s += current_lane.course_spline.s[-1]
+                obs_x = obs.future_trajectory.column("x")[0:20:3]
+                obs_y = obs.future_trajectory.column("y")[0:20:3]
+                obs_s_list, obs_d_list = course_spline.cartesian_to_frenet1D_batch(
+                    obs_x, obs_y)
+                out_of_lane = (obs_s_list <= s[0]) | (obs_s_list >= s[-1])
+                if np.any(out_of_lane):
+                    next_lane = roadgraph.get_lane_by_id(current_lane.next_lane_id)
+                    nextlane_spline = next_lane.course_spline
+                    next_s, next_d = nextlane_spline.cartesian_to_frenet1D_batch(
+                        obs_x[out_of_lane], obs_y[out_of_lane])
+                    obs_s_list[out_of_lane] = next_s + current_lane.course_spline.s[-1]
+                    obs_d_list[out_of_lane] = next_d
+                for obs_s, obs_d in zip(obs_s_list, obs_d_list):
                     obs_near_d = max(0, abs(obs_d) - obs.shape.width / 2)
                     if obs_near_d < current_lane.width / 2:
                         min_s = min(min_s, obs_s - obs.shape.length - car_length)
@@ -322,12 +347,15 @@ def stop_trajectory_generator(vehicle: Vehicle,
             target_state = State(s=min_s, s_d=0, d=d)
             path = frenet_optimal_planner.calc_spec_path(
                 current_state, target_state, stop_t, dt)
-            t = path.states[-1].t
-            s = path.states[-1].s
-            d = path.states[-1].d
-            while len(path.states) < course_t / dt:
-                t += dt
-                path.states.append(State(t=t, s=s, d=d))
+            # wait at the stop position until course_t, in column form
+            last_state = path.state(-1)
+            steps = max(0, math.ceil(course_t / dt - len(path)))
+            if steps > 0:
+                path.concatenate(Trajectory.from_columns(
+                    t=np.cumsum([0.0] + [dt] * steps),
+                    s=np.full(steps + 1, last_state.s),
+                    d=np.full(steps + 1, last_state.d),
+                ))
 
             path.frenet_to_cartesian(lanes, current_state)
             path.cost = (cost.smoothness(path, lanes[0].course_spline,
@@ -341,6 +369,29 @@ def stop_trajectory_generator(vehicle: Vehicle,
     return best_path
 
 
+def lanekeeping_best_path(vehicle: Vehicle, lanes: List[AbstractLane],
+                          obs_list, config, sample_d, sample_t,
+                          sample_vel) -> Trajectory:
+    """Score all the velocity keeping paths to the sampled (d, t, vel) and
+    return the best valid one, None if there is none."""
+    current_state = vehicle.current_state
+    best_path = None
+    for t in sample_t:
+        paths = frenet_optimal_planner.calc_frenet_path_batch(
+            current_state, sample_d, t, sample_vel, config["DT"])
+        paths.frenet_to_cartesian(lanes, current_state)
+        path_costs = sum(
+            cost.candidate_costs(vehicle, paths, lanes[0].course_spline,
+                                 vehicle.target_speed, obs_list,
+                                 config).values())
+        path = select_best_path(paths, path_costs,
+                                check_paths(vehicle, paths))
+        if path is not None and (best_path is None or
+                                 path.cost < best_path.cost):
+            best_path = path
+    return best_path
+
+
 def lanekeeping_trajectory_generator(vehicle: Vehicle,
                                      lanes: List[AbstractLane], obs_list,
                                      config, T) -> Trajectory:
@@ -379,49 +430,17 @@ def lanekeeping_trajectory_generator(vehicle: Vehicle,
         )
 
     # Step 2: Generate Center line trajectories
-    center_paths = frenet_optimal_planner.calc_frenet_paths(
-        current_state, center_d, sample_t, sample_vel, dt, config)
-    best_path = None
-    best_cost = math.inf
-    if center_paths is not None:
-        for path in center_paths:
-            path.frenet_to_cartesian(lanes, current_state)
-            path.cost = (
-                cost.smoothness(path, lanes[0].course_spline, config["weights"])
-                * dt + cost.vel_diff(path, target_vel, config["weights"]) * dt +
-                cost.guidance(path, config["weights"]) * dt +
-                cost.acc(path, config["weights"]) * dt +
-                cost.jerk(path, config["weights"]) * dt +
-                cost.obs(vehicle, path, obs_list, config))
-            if check_path(vehicle, path) and path.cost < best_cost:
-                best_cost = path.cost
-                best_path = path
-
+    best_path = lanekeeping_best_path(vehicle, lanes, obs_list, config,
+                                      center_d, sample_t, sample_vel)
     if best_path is not None:
         return best_path
     
     # Step 3: If no valid path, Generate nudge trajectories
-    paths = frenet_optimal_planner.calc_frenet_paths(current_state, sample_d,
-                                                     sample_t, sample_vel, dt,
-                                                     config)
-    best_cost = math.inf
-    if paths is not None:
-        for path in paths:
-            path.frenet_to_cartesian(lanes, current_state)
-            path.cost = (
-                cost.smoothness(path, lanes[0].course_spline, config["weights"])
-                * dt + cost.vel_diff(path, target_vel, config["weights"]) * dt +
-                cost.guidance(path, config["weights"]) * dt +
-                cost.acc(path, config["weights"]) * dt +
-                cost.jerk(path, config["weights"]) * dt +
-                cost.obs(vehicle, path, obs_list, config))
-            if check_path(vehicle, path) and path.cost < best_cost:
-                best_cost = path.cost
-                best_path = path
-
+    best_path = lanekeeping_best_path(vehicle, lanes, obs_list, config,
+                                      sample_d, sample_t, sample_vel)
     if best_path is not None:
         logging.debug(
-            f"Vehicle {vehicle.id} finds a lanekeeping NUDGE path with minimum cost: {best_cost}"
+            f"Vehicle {vehicle.id} finds a lanekeeping NUDGE path with minimum cost: {best_path.cost}"
         )
         return best_path
 
@@ -494,28 +513,20 @@ def decision_trajectory_generator(
             10,
         )
 
-        seg_paths = frenet_optimal_planner.calc_frenet_paths(
-            current_state, sample_d, [seg_time], sample_vel, dt, config
-        )  
-        offset_frame = len(fullpath.states)
-        best_path = None
-        best_cost = math.inf
-        for path in seg_paths:
-            path.frenet_to_cartesian(lanes, current_state)
-            path.cost = (
-                cost.smoothness(path, lanes[0].course_spline, config["weights"]) * dt
-                + cost.vel_diff(path, vehicle.target_speed, config["weights"]) * dt
-                + cost.guidance(path, config["weights"]) * dt
-                + cost.acc(path, config["weights"]) * dt
-                + cost.jerk(path, config["weights"]) * dt
-                + cost.obs(vehicle, path, obs_list, config, offset_frame)
-            )
-            if check_path(vehicle, path) and path.cost < best_cost:
-                best_cost = path.cost
-                best_path = path
+        seg_paths = frenet_optimal_planner.calc_frenet_path_batch(
+            current_state, sample_d, seg_time, sample_vel, dt
+        )
+        offset_frame = len(fullpath)
+        seg_paths.frenet_to_cartesian(lanes, current_state)
+        path_costs = sum(
+            cost.candidate_costs(vehicle, seg_paths, lanes[0].course_spline,
+                                 vehicle.target_speed, obs_list, config,
+                                 offset_frame).values())
+        best_path = select_best_path(seg_paths, path_costs,
+                                     check_paths(vehicle, seg_paths))
 
         if best_path is not None:
-            current_state = best_path.states[-1]
+            current_state = best_path.state(-1)
             fullpath.concatenate(best_path)
             current_time = decision.expected_time
         else:
@@ -527,12 +538,12 @@ def decision_trajectory_generator(
             break
         if (
             current_time - T > config["MIN_T"]
-            or current_time - T > fullpath.states[-1].t
+            or current_time - T > fullpath.state(-1).t
         ):
             # finish planning
             break
 
-    if fullpath is not None and len(fullpath.states) > 0:
+    if fullpath is not None and len(fullpath) > 0:
         return fullpath
     else:  # no valid path found
         return None
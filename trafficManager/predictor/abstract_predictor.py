@@ -7,19 +7,50 @@ Copyright (c) 2022 by PJLab, All Rights Reserved.
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
 from typing import Dict, List
 
 from common.observation import Observation
 from common.vehicle import Vehicle
 
 from utils.roadgraph import RoadGraph
-from utils.trajectory import State
+from utils.trajectory import State, Trajectory, TrajectoryBatch
 
 
-@dataclass(frozen=True)
 class Prediction:
-    results:  Dict[Vehicle, List[State]] = field(default_factory=dict)
+    """
+    Predicted states of the vehicles. Row i of the batch holds the states of
+    vehicles[i], so a field of all the predictions is read as one
+    (vehicles, time steps) array with batch.column(name), valid where
+    batch.mask is. results gives the same predictions as State lists, built
+    from the batch on first use; it is read only.
+    """
+
+    def __init__(self, vehicles: List[Vehicle] = None,
+                 batch: TrajectoryBatch = None) -> None:
+        self.vehicles: List[Vehicle] = vehicles if vehicles is not None else []
+        if batch is None:
+            batch = TrajectoryBatch.stack([Trajectory()] * len(self.vehicles))
+        self.batch = batch
+        self._results: Dict[Vehicle, List[State]] = None
+
+    @classmethod
+    def from_results(cls, results: Dict[Vehicle, List[State]]) -> Prediction:
+        """Pack the predicted states of each vehicle into a Prediction."""
+        prediction = cls(
+            list(results),
+            TrajectoryBatch.stack(
+                [Trajectory(list(states)) for states in results.values()]))
+        prediction._results = results
+        return prediction
+
+    @property
+    def results(self) -> Dict[Vehicle, List[State]]:
+        if self._results is None:
+            self._results = {
+                vehicle: self.batch.trajectory(i).states
+                for i, vehicle in enumerate(self.vehicles)
+            }
+        return self._results
 
 
 class AbstractPredictor(ABC):
@@ -6,42 +6,75 @@ Description:
 Copyright (c) 2022 by PJLab, All Rights Reserved. 
 '''
 
+from collections import defaultdict
+
 import numpy as np
 from common.observation import Observation
 from predictor.abstract_predictor import AbstractPredictor, Prediction
 from trafficManager.common.vehicle import VehicleType
 
 from utils.roadgraph import RoadGraph
-from utils.trajectory import State, Trajectory
+from utils.trajectory import TrajectoryBatch
 
 
 class UncontrolledPredictor(AbstractPredictor):
     def predict(
         self, observation: Observation, roadgraph: RoadGraph,
         lastseen_vehicles, through_timestep, config) -> Prediction:
-        prediction = Prediction()
-
+        """Predict the vehicles in AoI by the rest of their last planned
+           trajectories and the vehicles out of AoI by constant velocity
+           along their lane and the next one. The vehicles out of AoI are
+           advanced together and converted to cartesian states once per
+           pair of lanes.
+        """
+        vehicles, trajectories = [], []
+        uncontrolled = []
         for vehicle in observation.vehicles:
             if vehicle.vtype != VehicleType.OUT_OF_AOI:
                 if vehicle.id in lastseen_vehicles:
-                    prediction.results[vehicle] = lastseen_vehicles[vehicle.id].trajectory.states[through_timestep:]
+                    vehicles.append(vehicle)
+                    trajectory = lastseen_vehicles[vehicle.id].trajectory.copy(
+                        through_timestep)
+                    if len(trajectory):
+                        # the vehicle starts from its observed state
+                        trajectory.set_state(0, vehicle.current_state)
+                    trajectories.append(trajectory)
             else:
-                lane = roadgraph.get_lane_by_id(vehicle.lane_id)
-                predict_t = config["MIN_T"]
-                dt = config["DT"]
-                s = vehicle.current_state.s
-                d = vehicle.current_state.d
-                s_d = vehicle.current_state.s_d
-
-                predict_trajectory = Trajectory()
-                for t in np.arange(0, predict_t, dt):
-                    predict_trajectory.states.append(
-                        State(t=t, d=d, s=s, s_d=s_d,))
-                    s += s_d * dt
+                vehicles.append(vehicle)
+                trajectories.append(None)
+                uncontrolled.append(len(vehicles) - 1)
+
+        if uncontrolled:
+            dt = config["DT"]
+            t = np.arange(0, config["MIN_T"], dt)
+            states = [vehicles[row].current_state for row in uncontrolled]
+            s_d = np.array([state.s_d for state in states], dtype=float)
+            # accumulated step by step, as the vehicles advance
+            s = np.empty((len(uncontrolled), len(t)))
+            s[:, 0] = [state.s for state in states]
+            s[:, 1:] = (s_d * dt)[:, np.newaxis]
+            s = np.cumsum(s, axis=1)
+            batch = TrajectoryBatch.from_columns(
+                t=np.broadcast_to(t, s.shape),
+                s=s,
+                d=np.repeat([[state.d] for state in states], len(t), axis=1),
+                s_d=np.repeat(s_d[:, np.newaxis], len(t), axis=1),
+            )
+
+            rows_by_lanes = defaultdict(list)
+            for i, row in enumerate(uncontrolled):
+                lane = roadgraph.get_lane_by_id(vehicles[row].lane_id)
                 next_lane = roadgraph.get_next_lane(lane.id)
                 lanes = [lane, next_lane] if next_lane != None else [lane]
-                predict_trajectory.frenet_to_cartesian(
-                    lanes, vehicle.current_state)
+                rows_by_lanes[tuple(lane.id for lane in lanes)].append(
+                    (i, lanes))
+            for members in rows_by_lanes.values():
+                index = [i for i, _ in members]
+                lane_batch = TrajectoryBatch(batch.values[:, index],
+                                             batch.lane_ids[index])
+                lane_batch.frenet_to_cartesian(
+                    members[0][1], [states[i] for i in index])
+                for j, i in enumerate(index):
+                    trajectories[uncontrolled[i]] = lane_batch.trajectory(j)
 
-                prediction.results[vehicle] = predict_trajectory.states
-        return prediction
+        return Prediction(vehicles, TrajectoryBatch.stack(trajectories))
@@ -6,9 +6,15 @@ decision making, and planning. It uses the provided roadgraph and vehicle inform
 import copy
 import time
 from typing import Dict, List, Union
-from pynput import keyboard
+
+try:
+    from pynput import keyboard
+except ImportError:
+    # pynput needs a display, e.g. on headless servers
+    keyboard = None
 
 from common.observation import Observation
+from common.occupancy import OccupancyIndex
 from common.vehicle import Behaviour, Vehicle, VehicleType, create_vehicle, create_vehicle_lastseen
 from trafficManager.decision_maker.mcts_decision_maker import (
     EgoDecisionMaker,
@@ -24,7 +30,6 @@ from trafficManager.predictor.abstract_predictor import AbstractPredictor
 from utils.load_config import load_config
 from utils.obstacles import StaticObstacle
 from utils.roadgraph import AbstractLane, JunctionLane, NormalLane, RoadGraph
-from utils import data_copy
 from utils.trajectory import State, Trajectory
 
 import logger
@@ -74,7 +79,16 @@ class TrafficManager:
         self.multi_decision = multi_decision if multi_decision is not None else MultiDecisionMaker()
         self.multi_veh_planner = multi_veh_planner if multi_veh_planner is not None else MultiVehiclePlanner()
 
+    def close(self):
+        """Shut down the worker pools of the decision maker and the
+           planner."""
+        self.multi_decision.close()
+        self.multi_veh_planner.close()
+
     def _set_up_keyboard_listener(self):
+        if keyboard is None:
+            logging.info("pynput is not available, keyboard input is disabled")
+            return
 
         def on_press(key):
             """
@@ -127,6 +141,8 @@ class TrafficManager:
         prediction = self.predictor.predict(observation, roadgraph,
                                             self.lastseen_vehicles,
                                             through_timestep, self.config)
+        # obstacles shared by the planners of all vehicles
+        occupancy = OccupancyIndex.from_prediction(observation, prediction)
 
         # Update Behavior
         for vehicle_id, vehicle in vehicles.items():
@@ -154,13 +170,15 @@ class TrafficManager:
         result_paths = self.multi_veh_planner.plan(observation, roadgraph,
                                                    prediction,
                                                    multi_decision=self.mul_decisions,
-                                                   T=T, config=self.config)
+                                                   T=T, config=self.config,
+                                                   occupancy=occupancy)
 
         # an example of ego planner
         if self.config["EGO_PLANNER"]:
             ego_path = self.ego_planner.plan(vehicles[ego_id], observation,
                                              roadgraph, prediction, T,
-                                             self.config, ego_decision)
+                                             self.config, ego_decision,
+                                             occupancy=occupancy)
             result_paths[ego_id] = ego_path
 
         # Update Last Seen
@@ -171,8 +189,8 @@ class TrafficManager:
             if vehicle.vtype != VehicleType.OUT_OF_AOI)
         for vehicle_id, trajectory in result_paths.items():
             self.lastseen_vehicles[vehicle_id].trajectory = trajectory
-            output_trajectories[vehicle_id] = data_copy.deepcopy(trajectory)
-            del output_trajectories[vehicle_id].states[0]
+            # the first state is the current one
+            output_trajectories[vehicle_id] = trajectory.copy(1)
 
         # update self.T
         self.time_step = current_time_step
@@ -189,7 +207,8 @@ class TrafficManager:
             if vehicle_id not in self.lastseen_vehicles:
                 continue
             history_tracks[vehicle_id] = self.lastseen_vehicles[
-                vehicle_id].trajectory.states[self.time_step:current_time_step]
+                vehicle_id].trajectory.copy(self.time_step,
+                                            current_time_step).states
 
         return history_tracks
 
@@ -230,9 +249,9 @@ class TrafficManager:
             if not vehicle["xQ"]:
                 continue
             if vehicle["id"] in self.lastseen_vehicles  and \
-                len(self.lastseen_vehicles[vehicle["id"]].trajectory.states)> through_timestep:
+                len(self.lastseen_vehicles[vehicle["id"]].trajectory)> through_timestep:
                 last_state = self.lastseen_vehicles[
-                    vehicle["id"]].trajectory.states[through_timestep]
+                    vehicle["id"]].trajectory.state(through_timestep)
                 vehicles[vehicle["id"]] = create_vehicle_lastseen(
                     vehicle,
                     self.lastseen_vehicles[vehicle["id"]],
@@ -280,9 +299,9 @@ class TrafficManager:
 
         ego_id = ego_info["id"]
         if ego_id in self.lastseen_vehicles and \
-            len(self.lastseen_vehicles[ego_id].trajectory.states)> through_timestep:
-            last_state = self.lastseen_vehicles[ego_id].trajectory.states[
-                through_timestep]
+            len(self.lastseen_vehicles[ego_id].trajectory)> through_timestep:
+            last_state = self.lastseen_vehicles[ego_id].trajectory.state(
+                through_timestep)
             ego_car = create_vehicle_lastseen(
                 ego_info,
                 self.lastseen_vehicles[ego_id],
@@ -1,9 +1,113 @@
+from __future__ import annotations
 import bisect
 import math
-from typing import Tuple
+from collections import defaultdict
+from typing import List, Tuple
 
 import numpy as np
 
+# spacing and extension of the polyline used for nearest point projection
+PROJECTION_STEP = 0.5
+PROJECTION_MARGIN = 5.0
+# number of polyline segments searched on each side of a warm start hint
+PROJECTION_WINDOW_SEGMENTS = 20
+PROJECTION_NEWTON_ITERATIONS = 2
+
+
+def solve_tridiagonal(lower: np.ndarray, diag: np.ndarray, upper: np.ndarray,
+                      rhs: np.ndarray) -> np.ndarray:
+    """Solve the tridiagonal system A x = rhs with the Thomas algorithm.
+       All arguments have shape (..., n) and are broadcast against each
+       other, so the systems of many splines can be solved in one sweep.
+       A single matrix is swept on Python floats, which is faster than
+       numpy for the small systems of lane splines.
+
+    Args:
+        lower (np.ndarray): sub diagonal, lower[..., i] = A[i, i - 1]
+            (lower[..., 0] is ignored)
+        diag (np.ndarray): main diagonal, diag[..., i] = A[i, i]
+        upper (np.ndarray): super diagonal, upper[..., i] = A[i, i + 1]
+            (upper[..., -1] is ignored)
+        rhs (np.ndarray): right hand side
+
+    Returns:
+        np.ndarray: solution x with the broadcast shape of the arguments
+    """
+    shape = np.broadcast_shapes(np.shape(lower), np.shape(diag),
+                                np.shape(upper), np.shape(rhs))
+    n = shape[-1]
+    if len(shape) <= 2 and all(
+            np.ndim(arr) <= 1 for arr in (lower, diag, upper)):
+        # a single matrix, possibly with several right hand sides
+        lower, diag, upper = (np.broadcast_to(arr, (n,)).tolist()
+                              for arr in (lower, diag, upper))
+        c_prime = [0.0] * n
+        denom = [diag[0]] + [0.0] * (n - 1)
+        for i in range(1, n):
+            c_prime[i - 1] = upper[i - 1] / denom[i - 1]
+            denom[i] = diag[i] - lower[i] * c_prime[i - 1]
+        solutions = []
+        for row in np.broadcast_to(rhs, shape).reshape(-1, n).tolist():
+            row[0] /= denom[0]
+            for i in range(1, n):
+                row[i] = (row[i] - lower[i] * row[i - 1]) / denom[i]
+            for i in range(n - 2, -1, -1):
+                row[i] -= c_prime[i] * row[i + 1]
+            solutions.append(row)
+        return np.array(solutions).reshape(shape)
+
+    lower, diag, upper, rhs = (np.broadcast_to(arr, shape)
+                               for arr in (lower, diag, upper, rhs))
+    c_prime = np.zeros(shape)
+    x = np.empty(shape)
+    if n > 1:
+        c_prime[..., 0] = upper[..., 0] / diag[..., 0]
+    x[..., 0] = rhs[..., 0] / diag[..., 0]
+    for i in range(1, n):
+        denom = diag[..., i] - lower[..., i] * c_prime[..., i - 1]
+        if i < n - 1:
+            c_prime[..., i] = upper[..., i] / denom
+        x[..., i] = (rhs[..., i] - lower[..., i] * x[..., i - 1]) / denom
+    for i in range(n - 2, -1, -1):
+        x[..., i] -= c_prime[..., i] * x[..., i + 1]
+    return x
+
+
+def calc_spline_coefficients(
+    x_list: np.ndarray, y_list: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Fit the natural cubic spline coefficients of the points (x_list, y_list).
+       Leading axes are batch axes and are broadcast against each other,
+       e.g. x_list of shape (n,) with y_list of shape (2, n) fits two splines
+       sharing the same knots.
+
+    Args:
+        x_list (np.ndarray): strictly increasing knots, shape (..., n)
+        y_list (np.ndarray): values at the knots, shape (..., n)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: coefficients
+            a, c of shape (..., n) and b, d of shape (..., n - 1)
+    """
+    x_list = np.asarray(x_list, dtype=float)
+    a = np.asarray(y_list, dtype=float)
+    h = np.diff(x_list)
+
+    shape = np.broadcast_shapes(x_list.shape, a.shape)
+    lower = np.zeros(x_list.shape)
+    upper = np.zeros(x_list.shape)
+    diag = np.ones(x_list.shape)
+    lower[..., 1:-1] = h[..., :-1]
+    upper[..., 1:-1] = h[..., 1:]
+    diag[..., 1:-1] = 2 * (h[..., 1:] + h[..., :-1])
+    rhs = np.zeros(shape)
+    rhs[..., 1:-1] = 3 * (np.divide(np.diff(a[..., 1:]), h[..., 1:]) -
+                          np.divide(np.diff(a[..., :-1]), h[..., :-1]))
+
+    c = solve_tridiagonal(lower, diag, upper, rhs)
+    d = np.divide(np.diff(c), 3 * h)
+    b = np.divide(np.diff(a), h) - np.multiply(h, c[..., 1:] + 2 * c[..., :-1]) / 3
+    return np.broadcast_to(a, shape), b, c, d
 
 
 class Spline:
@@ -11,25 +115,24 @@ class Spline:
        See Numerical Analysis, 9th Edition, Algorithm 3.4, Natural Cubic Spline.
     """
 
-    def __init__(self, x_list: np.ndarray, y_list: np.ndarray) -> None:
+    def __init__(
+        self,
+        x_list: np.ndarray,
+        y_list: np.ndarray,
+        coefficients: Tuple[np.ndarray, np.ndarray, np.ndarray,
+                            np.ndarray] = None
+    ) -> None:
+        """
+        Args:
+            x_list (np.ndarray): strictly increasing knots
+            y_list (np.ndarray): values at the knots
+            coefficients (Tuple, optional): coefficients (a, b, c, d) already
+                fitted by calc_spline_coefficients. Defaults to None.
+        """
         self.x_list = x_list
-        n: int = x_list.size
-        h = np.diff(x_list)
-
-        main_diag = np.ones(n)
-        main_diag[1:-1] = 2 * (h[1:] + h[:-1])
-        A = np.diag(main_diag) + np.diag(h, k=1) + np.diag(h, k=-1)
-        A[0, 1] = 0
-        A[-1, -2] = 0
-        b = np.zeros(n)
-        b[1:-1] = 3 * (np.divide(np.diff(y_list[1:]), h[1:]) -
-                       np.divide(np.diff(y_list[:-1]), h[:-1]))
-
-        self.c = np.linalg.solve(A, b)
-        self.a = y_list
-        self.d = np.divide(np.diff(self.c), 3 * h)
-        self.b = np.divide(np.diff(self.a),
-                           h) - np.multiply(h, self.c[1:] + 2 * self.c[:-1]) / 3
+        if coefficients is None:
+            coefficients = calc_spline_coefficients(x_list, y_list)
+        self.a, self.b, self.c, self.d = coefficients
 
     def calculate_approximation(self, pos_x: float) -> float:
         """Given x coordinate, use Spline to approximate y coordinate
@@ -103,6 +206,95 @@ class Spline:
         index = max(min(index, self.x_list.size - 2), 0)
         return 6.0 * self.d[index]
 
+    def search_index_batch(
+            self, pos_x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the spline segment of every x coordinate in one call
+
+        Args:
+            pos_x (np.ndarray): x coordinates
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: segment indexes and the offsets
+                of pos_x from the start of their segments
+        """
+        pos_x = np.asarray(pos_x, dtype=float)
+        index = np.searchsorted(self.x_list, pos_x, side='right') - 1
+        index = np.minimum(np.maximum(index, 0), self.x_list.size - 2)
+        return index, pos_x - self.x_list[index]
+
+    def calculate_approximation_batch(self, pos_x: np.ndarray) -> np.ndarray:
+        """Vectorized version of calculate_approximation
+
+        Args:
+            pos_x (np.ndarray): x coordinates
+
+        Returns:
+            np.ndarray: approximated y coordinates
+        """
+        index, dx = self.search_index_batch(pos_x)
+        return self.a[index] + self.b[index] * dx + \
+               self.c[index] * dx**2.0 + self.d[index] * dx**3.0
+
+    def calculate_derivative_batch(self, pos_x: np.ndarray) -> np.ndarray:
+        """Vectorized version of calculate_derivative
+
+        Args:
+            pos_x (np.ndarray): x coordinates
+
+        Returns:
+            np.ndarray: approximated dy/dx at pos_x
+        """
+        index, dx = self.search_index_batch(pos_x)
+        return self.b[index] + 2.0 * self.c[index] * dx + \
+               3.0 * self.d[index] * dx**2.0
+
+    def calculate_second_derivative_batch(self,
+                                          pos_x: np.ndarray) -> np.ndarray:
+        """Vectorized version of calculate_second_derivative
+
+        Args:
+            pos_x (np.ndarray): x coordinates
+
+        Returns:
+            np.ndarray: approximated d^2y/dx^2 at pos_x
+        """
+        index, dx = self.search_index_batch(pos_x)
+        return 2.0 * self.c[index] + 6.0 * self.d[index] * dx
+
+    def calculate_third_derivative_batch(self,
+                                         pos_x: np.ndarray) -> np.ndarray:
+        """Vectorized version of calculate_third_derivative
+
+        Args:
+            pos_x (np.ndarray): x coordinates
+
+        Returns:
+            np.ndarray: approximated d^3y/dx^3 at pos_x
+        """
+        index, _ = self.search_index_batch(pos_x)
+        return 6.0 * self.d[index]
+
+    def calculate_derivatives_batch(
+        self, pos_x: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Evaluate the value and the first three derivatives at once,
+           sharing the segment search between them.
+
+        Args:
+            pos_x (np.ndarray): x coordinates
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+                y, dy/dx, d^2y/dx^2 and d^3y/dx^3 at pos_x
+        """
+        index, dx = self.search_index_batch(pos_x)
+        a, b, c, d = self.a[index], self.b[index], self.c[index], self.d[index]
+        y = a + b * dx + c * dx**2.0 + d * dx**3.0
+        dy = b + 2.0 * c * dx + 3.0 * d * dx**2.0
+        ddy = 2.0 * c + 6.0 * d * dx
+        dddy = 6.0 * d
+        return y, dy, ddy, dddy
+
 
 class Spline2D:
     """A 2 dimensional Spline with x coordinates and y coordinates are 1d spline 
@@ -122,11 +314,52 @@ class Spline2D:
 
         self.s = np.zeros_like(x_list)
         self.s[1:] = np.cumsum(ds)
-        self.sx = Spline(self.s, x_list)
-        self.sy = Spline(self.s, y_list)
+        # x(s) and y(s) share their knots, fit both with one solve
+        a, b, c, d = calc_spline_coefficients(self.s, np.stack((x_list, y_list)))
+        self.sx = Spline(self.s, x_list, (a[0], b[0], c[0], d[0]))
+        self.sy = Spline(self.s, y_list, (a[1], b[1], c[1], d[1]))
 
         self.x_list = x_list
         self.y_list = y_list
+        # densified reference line for find_nearest_rs, built on first use
+        self._projection = None
+
+    @classmethod
+    def batch(cls, x_lists: List[np.ndarray],
+              y_lists: List[np.ndarray]) -> List[Spline2D]:
+        """Build many 2d splines at once, e.g. all lanes of a network.
+           Splines with the same number of points are stacked and fitted in
+           a single batched tridiagonal sweep.
+
+        Args:
+            x_lists (List[np.ndarray]): x coordinates of every spline
+            y_lists (List[np.ndarray]): y coordinates of every spline
+
+        Returns:
+            List[Spline2D]: the splines, in the order of x_lists
+        """
+        groups = defaultdict(list)
+        for index, x_list in enumerate(x_lists):
+            groups[len(x_list)].append(index)
+
+        splines = [None] * len(x_lists)
+        for indexes in groups.values():
+            xs = np.array([x_lists[i] for i in indexes], dtype=float)
+            ys = np.array([y_lists[i] for i in indexes], dtype=float)
+            s = np.zeros_like(xs)
+            s[:, 1:] = np.cumsum(np.hypot(np.diff(xs), np.diff(ys)), axis=1)
+            a, b, c, d = calc_spline_coefficients(s[:, np.newaxis],
+                                                  np.stack((xs, ys), axis=1))
+            for j, i in enumerate(indexes):
+                spline = cls.__new__(cls)
+                spline.s = s[j]
+                spline.sx = Spline(s[j], xs[j], (a[j, 0], b[j, 0], c[j, 0], d[j, 0]))
+                spline.sy = Spline(s[j], ys[j], (a[j, 1], b[j, 1], c[j, 1], d[j, 1]))
+                spline.x_list = x_lists[i]
+                spline.y_list = y_lists[i]
+                spline._projection = None
+                splines[i] = spline
+        return splines
 
     def get_x_list(self):
         return self.x_list
@@ -201,6 +434,92 @@ class Spline2D:
         yaw = math.atan2(dy, dx)
         return yaw
 
+    def calc_position_batch(
+            self, pos_s: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized version of calc_position
+
+        Args:
+            pos_s (np.ndarray): longitudinal coordinates
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: cartesian x and y coordinates
+                corresponding to (pos_s, 0)
+        """
+        pos_x = self.sx.calculate_approximation_batch(pos_s)
+        pos_y = self.sy.calculate_approximation_batch(pos_s)
+
+        return pos_x, pos_y
+
+    def calc_yaw_batch(self, pos_s: np.ndarray) -> np.ndarray:
+        """Vectorized version of calc_yaw
+
+        Args:
+            pos_s (np.ndarray): longitudinal coordinates
+
+        Returns:
+            np.ndarray: yaw angles in radians
+        """
+        dx = self.sx.calculate_derivative_batch(pos_s)
+        dy = self.sy.calculate_derivative_batch(pos_s)
+        return np.arctan2(dy, dx)
+
+    def calc_curvature_batch(self, pos_s: np.ndarray) -> np.ndarray:
+        """Vectorized version of calc_curvature
+
+        Args:
+            pos_s (np.ndarray): longitudinal coordinates
+
+        Returns:
+            np.ndarray: curvature (absolute value) at (pos_s, 0)
+        """
+        _, dx, ddx, _ = self.sx.calculate_derivatives_batch(pos_s)
+        _, dy, ddy, _ = self.sy.calculate_derivatives_batch(pos_s)
+        return np.abs(ddy * dx - ddx * dy) / ((dx**2 + dy**2)**1.5)
+
+    def calc_curvature_derivative_batch(self,
+                                        pos_s: np.ndarray) -> np.ndarray:
+        """Vectorized version of calc_curvature_derivative
+
+        Args:
+            pos_s (np.ndarray): longitudinal coordinates
+
+        Returns:
+            np.ndarray: derivative of curvature at (pos_s, 0)
+        """
+        _, dx, ddx, dddx = self.sx.calculate_derivatives_batch(pos_s)
+        _, dy, ddy, dddy = self.sy.calculate_derivatives_batch(pos_s)
+
+        a = dx * ddy - dy * ddx
+        b = dx * dddy - dy * dddx
+        c = dx * ddx + dy * ddy
+        d = dx * dx + dy * dy
+        return (b * d - 3.0 * a * c) / (d * d * d)**(2.5)
+
+    def calc_reference_batch(
+        self, pos_s: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Evaluate everything a frenet conversion needs from the reference
+           line in one call: position, yaw, curvature and curvature derivative.
+
+        Args:
+            pos_s (np.ndarray): longitudinal coordinates
+
+        Returns:
+            Tuple[np.ndarray, ...]: x, y, yaw, curvature (absolute value) and
+                derivative of curvature at (pos_s, 0)
+        """
+        x, dx, ddx, dddx = self.sx.calculate_derivatives_batch(pos_s)
+        y, dy, ddy, dddy = self.sy.calculate_derivatives_batch(pos_s)
+
+        yaw = np.arctan2(dy, dx)
+        a = dx * ddy - dy * ddx
+        b = dx * dddy - dy * dddx
+        c = dx * ddx + dy * ddy
+        d = dx * dx + dy * dy
+        kappa = np.abs(ddy * dx - ddx * dy) / (d**1.5)
+        kappa_d = (b * d - 3.0 * a * c) / (d * d * d)**(2.5)
+        return x, y, yaw, kappa, kappa_d
+
     def frenet_to_cartesian1D(self, pos_s: float,
                               pos_d: float) -> Tuple[float, float]:
         """Given the frenet coordinate (pos_s, pos_d), compute its cartesian coordinate
@@ -218,6 +537,25 @@ class Spline2D:
         y = ry + math.cos(ryaw) * pos_d
         return x, y
 
+    def frenet_to_cartesian1D_batch(
+            self, pos_s: np.ndarray,
+            pos_d: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized version of frenet_to_cartesian1D
+
+        Args:
+            pos_s (np.ndarray): longitudinal coordinates
+            pos_d (np.ndarray): lateral coordinates, or a single offset
+                shared by all pos_s
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: cartesian coordinates of (pos_s, pos_d)
+        """
+        rx, ry = self.calc_position_batch(pos_s)
+        ryaw = self.calc_yaw_batch(pos_s)
+        x = rx - np.sin(ryaw) * pos_d
+        y = ry + np.cos(ryaw) * pos_d
+        return x, y
+
     def frenet_to_cartesian2D(self, s: float, d: float, s_d: float,
                               d_d: float) -> Tuple[float, float, float, float]:
         x, y = self.frenet_to_cartesian1D(s, d)
@@ -227,17 +565,20 @@ class Spline2D:
         yaw = np.fmod(yaw, np.pi)
         return x, y, speed, yaw
 
-    def cartesian_to_frenet1D(self, pos_x: float, pos_y: float) -> Tuple[float, float]:
+    def cartesian_to_frenet1D(self, pos_x: float, pos_y: float,
+                              s_hint: float = None) -> Tuple[float, float]:
         """Given the cartesian coordinate (pos_x, pos_y), computes its frenet coordinate
 
         Args:
             pos_x (float): x coordinate
             pos_y (float): y coordinate
+            s_hint (float, optional): guess of the s coordinate, e.g. the
+                previous s of a tracked vehicle. Defaults to None.
 
         Returns:
             Tuple[float ,float]: the corresponding frenet coordinate (s, d)
         """
-        s = self.find_nearest_rs(pos_x, pos_y)
+        s = self.find_nearest_rs(pos_x, pos_y, s_hint)
         rx, ry = self.calc_position(s)
         ryaw = self.calc_yaw(s)
 
@@ -248,6 +589,33 @@ class Spline2D:
 
         return s, d
 
+    def cartesian_to_frenet1D_batch(
+            self, pos_x: np.ndarray, pos_y: np.ndarray,
+            s_hint: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized version of cartesian_to_frenet1D
+
+        Args:
+            pos_x (np.ndarray): x coordinates
+            pos_y (np.ndarray): y coordinates
+            s_hint (np.ndarray, optional): guesses of the s coordinates.
+                Defaults to None.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: the corresponding frenet coordinates
+        """
+        pos_x = np.asarray(pos_x, dtype=float)
+        pos_y = np.asarray(pos_y, dtype=float)
+        s = self.find_nearest_rs_batch(pos_x, pos_y, s_hint)
+        rx, ry = self.calc_position_batch(s)
+        ryaw = self.calc_yaw_batch(s)
+
+        dx = pos_x - rx
+        dy = pos_y - ry
+        cross_rd_nd = np.cos(ryaw) * dy - np.sin(ryaw) * dx
+        d = np.copysign(np.sqrt(dx * dx + dy * dy), cross_rd_nd)
+
+        return s, d
+
     def cartesian_to_frenet2D(
             self, x: float, y: float, yaw: float,
             speed: float) -> Tuple[float, float, float, float]:
@@ -258,28 +626,137 @@ class Spline2D:
         d_d = speed * np.cos(yaw - r_yaw)
         return s, d, s_d, d_d
 
-    def find_nearest_rs(self, pos_x: float, pos_y: float) -> float:
+    def find_nearest_rs(self, pos_x: float, pos_y: float,
+                        s_hint: float = None) -> float:
         """find the closest frenet coordinate on reference line, i.e.
            argmin_{s} (x(s, 0) - pos_x)^2 + (y(s, 0) - pos_y)^2
            where x(s, 0), y(s, 0) are the cartesian coordinates of (s, 0)
-           The computation is from coarse to fine to reduce computational burden.
+           See find_nearest_rs_batch for details.
 
         Args:
             pos_x (float): x coordinate
             pos_y (float): y coordinate
+            s_hint (float, optional): guess of the s coordinate. Defaults to None.
 
         Returns:
             float: the corresponding s coordinate on reference line
         """
-        precision_list = [5, 1, 0.05]
-        left, right = self.s[0], self.s[-1]
-        for precision in precision_list:
-            refined_s = np.arange(left, right + precision, precision)
-            positions = np.array([list(self.calc_position(s)) for s in refined_s])
-            dists = np.linalg.norm(positions - np.array([pos_x, pos_y]), axis=1)
-            ri = np.argmin(dists)
-            rs = refined_s[ri]
-            
-            left, right = rs - precision, rs + precision
+        if s_hint is not None:
+            s_hint = [s_hint]
+        return float(self.find_nearest_rs_batch([pos_x], [pos_y], s_hint)[0])
+
+    def find_nearest_rs_batch(self, pos_x: np.ndarray, pos_y: np.ndarray,
+                              s_hint: np.ndarray = None) -> np.ndarray:
+        """find the closest frenet coordinates on reference line for a batch
+           of points. The reference line is densified once into a polyline,
+           every point is projected onto its nearest polyline segment and the
+           result is refined with a few Newton steps on the spline itself.
+
+           With s_hint, only the segments around the hint are searched, which
+           makes tracking a moving vehicle O(1). If the nearest segment lies on
+           the border of that window, the whole polyline is searched instead.
+
+        Args:
+            pos_x (np.ndarray): x coordinates
+            pos_y (np.ndarray): y coordinates
+            s_hint (np.ndarray, optional): guesses of the s coordinates,
+                nan entries are searched globally. Defaults to None.
+
+        Returns:
+            np.ndarray: the corresponding s coordinates on reference line
+        """
+        pos_x = np.atleast_1d(np.asarray(pos_x, dtype=float))
+        pos_y = np.atleast_1d(np.asarray(pos_y, dtype=float))
+        if self._projection is None:
+            self._build_projection()
+        seg_s, seg_x, seg_y = self._projection
+        seg_num = seg_s.size - 1
+
+        seg_idx = np.empty(pos_x.size, dtype=int)
+        global_search = np.ones(pos_x.size, dtype=bool)
+        if s_hint is not None:
+            s_hint = np.broadcast_to(np.asarray(s_hint, dtype=float),
+                                     pos_x.shape)
+            hinted = np.flatnonzero(~np.isnan(s_hint))
+            if hinted.size > 0 and seg_num > 2 * PROJECTION_WINDOW_SEGMENTS:
+                start = np.searchsorted(seg_s, s_hint[hinted]) - \
+                    PROJECTION_WINDOW_SEGMENTS
+                start = np.minimum(np.maximum(start, 0),
+                                   seg_num - 2 * PROJECTION_WINDOW_SEGMENTS)
+                window = start[:, None] + \
+                    np.arange(2 * PROJECTION_WINDOW_SEGMENTS)
+                best = self._nearest_segment(pos_x[hinted], pos_y[hinted],
+                                             window)
+                seg_idx[hinted] = best
+                # the minimum is trusted only inside the window or at the
+                # ends of the whole polyline
+                inside = ((best > window[:, 0]) | (best == 0)) & \
+                    ((best < window[:, -1]) | (best == seg_num - 1))
+                global_search[hinted[inside]] = False
+        searched = np.flatnonzero(global_search)
+        if searched.size > 0:
+            seg_idx[searched] = self._nearest_segment(
+                pos_x[searched], pos_y[searched],
+                np.broadcast_to(np.arange(seg_num),
+                                (searched.size, seg_num)))
+
+        # project onto the nearest segment
+        dx = seg_x[seg_idx + 1] - seg_x[seg_idx]
+        dy = seg_y[seg_idx + 1] - seg_y[seg_idx]
+        t = ((pos_x - seg_x[seg_idx]) * dx + (pos_y - seg_y[seg_idx]) * dy) / \
+            np.maximum(dx * dx + dy * dy, 1e-12)
+        t = np.minimum(np.maximum(t, 0.0), 1.0)
+        rs = seg_s[seg_idx] + t * (seg_s[seg_idx + 1] - seg_s[seg_idx])
+
+        # Newton refinement of (P(s) - pos) . P'(s) = 0 near that segment
+        lower = seg_s[np.maximum(seg_idx - 1, 0)]
+        upper = seg_s[np.minimum(seg_idx + 2, seg_num)]
+        for _ in range(PROJECTION_NEWTON_ITERATIONS):
+            x, dx, ddx, _ = self.sx.calculate_derivatives_batch(rs)
+            y, dy, ddy, _ = self.sy.calculate_derivatives_batch(rs)
+            ex, ey = x - pos_x, y - pos_y
+            grad = ex * dx + ey * dy
+            hess = dx * dx + dy * dy + ex * ddx + ey * ddy
+            step = np.divide(grad, hess, out=np.zeros_like(grad),
+                             where=hess > 1e-6)
+            rs = np.minimum(np.maximum(rs - step, lower), upper)
 
         return rs
+
+    def _build_projection(self) -> None:
+        """Densify the reference line into the polyline used by
+           find_nearest_rs_batch. The polyline is extended by
+           PROJECTION_MARGIN at both ends, so that points slightly beyond
+           the ends of the line are projected onto its extrapolation.
+        """
+        length = self.s[-1] - self.s[0] + 2 * PROJECTION_MARGIN
+        num = max(int(math.ceil(length / PROJECTION_STEP)), 1) + 1
+        seg_s = np.linspace(self.s[0] - PROJECTION_MARGIN,
+                            self.s[-1] + PROJECTION_MARGIN, num)
+        seg_x, seg_y = self.calc_position_batch(seg_s)
+        self._projection = (seg_s, seg_x, seg_y)
+
+    def _nearest_segment(self, pos_x: np.ndarray, pos_y: np.ndarray,
+                         candidates: np.ndarray) -> np.ndarray:
+        """For every point, pick the nearest polyline segment among its
+           candidate segment indexes.
+
+        Args:
+            pos_x (np.ndarray): x coordinates, shape (N,)
+            pos_y (np.ndarray): y coordinates, shape (N,)
+            candidates (np.ndarray): candidate segment indexes, shape (N, K)
+
+        Returns:
+            np.ndarray: index of the nearest segment of each point, shape (N,)
+        """
+        _, seg_x, seg_y = self._projection
+        x0, y0 = seg_x[candidates], seg_y[candidates]
+        dx = seg_x[candidates + 1] - x0
+        dy = seg_y[candidates + 1] - y0
+        px = pos_x[:, None] - x0
+        py = pos_y[:, None] - y0
+        t = (px * dx + py * dy) / np.maximum(dx * dx + dy * dy, 1e-12)
+        t = np.minimum(np.maximum(t, 0.0), 1.0)
+        dists = (px - t * dx)**2 + (py - t * dy)**2
+        return candidates[np.arange(candidates.shape[0]),
+                          np.argmin(dists, axis=1)]
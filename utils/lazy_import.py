@@ -0,0 +1,22 @@
+import importlib
+
+
+class LazyModule:
+    '''
+        A module that is only imported when one of its attributes is first
+        used, e.g. a GUI library that headless runs never need.
+    '''
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, name: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, name)
+
+
+# dearpygui is only imported by the GUI, the models in headless mode run
+# without loading it.
+dpg = LazyModule('dearpygui.dearpygui')
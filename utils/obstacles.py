@@ -1,6 +1,8 @@
+from __future__ import annotations
+
 from abc import ABC
 from enum import IntEnum
-import dearpygui.dearpygui as dpg
+from utils.lazy_import import dpg
 import numpy as np
 
 from trafficManager.common.coord_conversion import cartesian_to_frenet2D
@@ -162,6 +164,10 @@ class Obstacle(ABC):
         self._lane_id: str = lane_id
         self._affiliated_edge: str = edge
 
+    @property
+    def id(self) -> str:
+        return self._obstacle_id
+
     @property
     def type(self) -> ObsType:
         return self._obstacle_type
@@ -27,18 +27,7 @@ def plot_roadgraph(roadgraph: RoadGraph) -> None:
             lane_id = edge.id + '_' + str(lane_index)
             lane = lanes[lane_id]
 
-            lane.center_line, lane.left_bound, lane.right_bound = [], [], []
-            s = np.linspace(0, lane.course_spline.s[-1], num=50)
-            for si in s:
-                lane.center_line.append(lane.course_spline.calc_position(si))
-                lane.left_bound.append(
-                    lane.course_spline.frenet_to_cartesian1D(
-                        si, lane.width / 2)
-                )
-                lane.right_bound.append(
-                    lane.course_spline.frenet_to_cartesian1D(
-                        si, -lane.width / 2)
-                )
+            lane.getPlotElem()
             ax.plot(*zip(*lane.center_line), "w:", linewidth=1.5)
             plt.arrow(
                 lane.center_line[0][0],
@@ -76,11 +65,9 @@ def plot_roadgraph(roadgraph: RoadGraph) -> None:
     for lane in lanes.values():
         for junctionlane, dir in lane.next_lanes.values():
             s = np.linspace(0, junctionlane.course_spline.s[-1], num=50)
-            junctionlane.center_line = []
-            for si in s:
-                junctionlane.center_line.append(
-                    junctionlane.course_spline.frenet_to_cartesian1D(si, 0)
-                )
+            junctionlane.center_line = list(
+                zip(*junctionlane.course_spline.calc_position_batch(s))
+            )
             if roadgraph.traffic_lights.lights[junctionlane] == TrafficLightStatus.GREEN:
                 color = "green"
             elif roadgraph.traffic_lights.lights[junctionlane] == TrafficLightStatus.RED:
@@ -79,15 +79,14 @@ class AbstractLane(ABC):
 
     def getPlotElem(self):
         s = np.linspace(0, self.course_spline.s[-1], num=50)
-        self.center_line = [
-            self.course_spline.calc_position(si) for si in s
-        ]
-        self.left_bound = [
-            self.course_spline.frenet_to_cartesian1D(si, self.width / 2) for si in s
-        ]
-        self.right_bound = [
-            self.course_spline.frenet_to_cartesian1D(si, -self.width / 2) for si in s
-        ]
+        rx, ry = self.course_spline.calc_position_batch(s)
+        ryaw = self.course_spline.calc_yaw_batch(s)
+        # offsets of the bounds, same as frenet_to_cartesian1D(s, width / 2)
+        dx = -np.sin(ryaw) * (self.width / 2)
+        dy = np.cos(ryaw) * (self.width / 2)
+        self.center_line = list(zip(rx.tolist(), ry.tolist()))
+        self.left_bound = list(zip((rx + dx).tolist(), (ry + dy).tolist()))
+        self.right_bound = list(zip((rx - dx).tolist(), (ry - dy).tolist()))
 
 
 @dataclass
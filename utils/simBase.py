@@ -1,4 +1,4 @@
-import dearpygui.dearpygui as dpg
+from utils.lazy_import import dpg
 from typing import Tuple
 class CoordTF:
     # Ego is always in the center of the window
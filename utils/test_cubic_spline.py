@@ -17,6 +17,16 @@ def main():
         np.allclose(spline.d, np.array([0.25228, 1.69107, -1.94336]),
                     atol=1e-5))
 
+    # test batched construction against the single one
+    x2 = [-2.5, 0.0, 2.5, 5.0, 7.5, 3.0, -1.0]
+    y2 = [0.7, -6, 5, 6.5, 0.0, 5.0, -2.0]
+    splines = Spline2D.batch([x2, y2, x2[:4]], [y2, x2, y2[:4]])
+    for sp_batch, (ix, iy) in zip(splines, [(x2, y2), (y2, x2), (x2[:4], y2[:4])]):
+        sp_single = Spline2D(ix, iy)
+        print(np.allclose(sp_batch.s, sp_single.s) and
+              np.allclose(sp_batch.sx.c, sp_single.sx.c) and
+              np.allclose(sp_batch.sy.b, sp_single.sy.b))
+
     ds = 0.01
     x_list = np.arange(spline.x_list[0], spline.x_list[-1], ds)
     y_list = np.array([spline.calculate_approximation(x) for x in x_list])
@@ -41,6 +51,34 @@ def main():
         ryaw.append(sp.calc_yaw(i_s))
         rk.append(sp.calc_curvature(i_s))
 
+    # test batch evaluation against the scalar one
+    brx, bry = sp.calc_position_batch(s)
+    print(np.allclose(brx, rx) and np.allclose(bry, ry))
+    print(np.allclose(sp.calc_yaw_batch(s), ryaw))
+    print(np.allclose(sp.calc_curvature_batch(s), rk))
+    bx, by, byaw, bk, bkd = sp.calc_reference_batch(s)
+    print(np.allclose(bk, rk) and np.allclose(
+        bkd, [sp.calc_curvature_derivative(i_s) for i_s in s]))
+    fx, fy = sp.frenet_to_cartesian1D_batch(s, 1.5)
+    print(np.allclose(
+        np.column_stack((fx, fy)),
+        [sp.frenet_to_cartesian1D(i_s, 1.5) for i_s in s]))
+
+    # test nearest point projection against a dense brute force search
+    px = np.array([-3.0, 1.0, 4.0, 6.0, 8.0])
+    py = np.array([1.0, -4.0, 5.0, 3.0, 0.5])
+    dense_s = np.arange(-5.0, sp.s[-1] + 5.0, 0.001)  # ends are extrapolated
+    dense_x, dense_y = sp.calc_position_batch(dense_s)
+    nearest_s = np.array([
+        dense_s[np.argmin(np.hypot(dense_x - ix, dense_y - iy))]
+        for ix, iy in zip(px, py)
+    ])
+    print(np.allclose(sp.find_nearest_rs_batch(px, py), nearest_s, atol=1e-2))
+    print(np.allclose([sp.find_nearest_rs(ix, iy) for ix, iy in zip(px, py)],
+                      nearest_s, atol=1e-2))
+    print(np.allclose(sp.find_nearest_rs_batch(px, py, nearest_s + 1.0),
+                      nearest_s, atol=1e-2))
+
     plt.subplots(1)
     plt.plot(x, y, "*", label="input")
     plt.plot(rx, ry, "-r", label="spline")
@@ -8,10 +8,10 @@ from __future__ import annotations
 from utils.roadgraph import AbstractLane
 from utils.cubic_spline import Spline2D
 import numpy as np
-from dataclasses import dataclass, field
+from dataclasses import dataclass, fields
 from collections import deque
-import warnings
 import math
+import operator
 
 import logger
 
@@ -160,63 +160,242 @@ class State(CertesianState, FrenetState):
         return
 
 
-@dataclass
+# per-state fields of a Trajectory, laneID is the only non numeric one
+STATE_FIELDS = tuple(f.name for f in fields(State))
+NUMERIC_FIELDS = tuple(name for name in STATE_FIELDS if name != "laneID")
+FIELD_INDEX = {name: i for i, name in enumerate(NUMERIC_FIELDS)}
+STATE_DEFAULTS = {f.name: f.default for f in fields(State)}
+_NUMERIC_GETTER = operator.attrgetter(*NUMERIC_FIELDS)
+_POP_INDEX = [FIELD_INDEX[name] for name in ("x", "y", "yaw", "vel", "acc")]
+_POP_R_INDEX = [
+    FIELD_INDEX[name]
+    for name in ("x", "y", "yaw", "vel", "acc", "s", "routeIdx")
+]
+
+
+def _values_from_columns(columns: dict,
+                         shape: tuple) -> tuple[np.ndarray, np.ndarray]:
+    """Pack per-field arrays into the numeric values and the lane ids.
+       Missing fields take the defaults of State, and a missing vel is
+       derived from s_d and d_d as State.__post_init__ does."""
+    values = np.empty((len(NUMERIC_FIELDS), ) + shape)
+    for name, i in FIELD_INDEX.items():
+        values[i] = columns.get(name, STATE_DEFAULTS[name])
+    if "vel" not in columns:
+        s_d = values[FIELD_INDEX["s_d"]]
+        d_d = values[FIELD_INDEX["d_d"]]
+        values[FIELD_INDEX["vel"]] = np.where(s_d != 0,
+                                              np.sqrt(s_d**2 + d_d**2), 0)
+    lane_ids = np.empty(shape, dtype=object)
+    lane_ids[...] = columns.get("laneID", STATE_DEFAULTS["laneID"])
+    return values, lane_ids
+
+
 class Trajectory:
-    """Trajectory class."""
+    """Trajectory class.
+
+    The states are kept either as a list of State objects, which the
+    planners build and edit in place, or as contiguous numpy columns (one
+    row per State field) with a cursor over the consumed prefix, which is
+    what the simulator reads every step. Each form is built lazily from the
+    other: `states` returns the list, `column` and `pop_last_state` work on
+    the columns. None values are stored as nan in the columns.
+    """
+
+    def __init__(self, states: list[State] = None, cost: float = 0.0) -> None:
+        self._states: list[State] = states if states is not None else []
+        self._values: np.ndarray = None  # shape (len(NUMERIC_FIELDS), n)
+        self._lane_ids: np.ndarray = None  # shape (n,), dtype object
+        self._cursor = 0
+        self.cost = cost
+
+    @classmethod
+    def from_columns(cls, cost: float = 0.0, **columns) -> Trajectory:
+        """Build a trajectory from per-field arrays of the same length.
+           Missing fields take the defaults of State, and a missing vel is
+           derived from s_d and d_d as State.__post_init__ does.
+
+        Args:
+            cost (float, optional): cost of the trajectory. Defaults to 0.0.
+            **columns: arrays keyed by State field names
+
+        Returns:
+            Trajectory: the array-backed trajectory
+        """
+        size = len(next(iter(columns.values()))) if columns else 0
+        values, lane_ids = _values_from_columns(columns, (size, ))
+        return cls._from_values(values, lane_ids, cost)
+
+    @classmethod
+    def _from_values(cls, values: np.ndarray, lane_ids: np.ndarray,
+                     cost: float = 0.0) -> Trajectory:
+        trajectory = cls(cost=cost)
+        trajectory._states = None
+        trajectory._values, trajectory._lane_ids = values, lane_ids
+        return trajectory
+
+    @property
+    def states(self) -> list[State]:
+        if self._states is None:
+            self._states = [
+                self._make_state(values, lane_id) for values, lane_id in zip(
+                    self._values[:, self._cursor:].T.tolist(),
+                    self._lane_ids[self._cursor:])
+            ]
+        if self._values is not None:
+            # the caller may edit the states, so the columns are out of date
+            self._values, self._lane_ids, self._cursor = None, None, 0
+        return self._states
+
+    @states.setter
+    def states(self, states: list[State]) -> None:
+        self._states = states
+        self._values, self._lane_ids, self._cursor = None, None, 0
+
+    @staticmethod
+    def _make_state(values: list[float], lane_id: str) -> State:
+        # bypass __init__ so that the stored vel is kept as it is
+        state = State.__new__(State)
+        state.__dict__.update(
+            (name, None if value != value else value)
+            for name, value in zip(NUMERIC_FIELDS, values))
+        state.routeIdx = int(state.routeIdx)
+        state.laneID = lane_id
+        return state
+
+    def _build_columns(self) -> None:
+        if self._values is not None:
+            return
+        self._values = np.ascontiguousarray(np.array(
+            [_NUMERIC_GETTER(state) for state in self._states],
+            dtype=float).reshape(len(self._states), len(NUMERIC_FIELDS)).T)
+        self._lane_ids = np.empty(len(self._states), dtype=object)
+        self._lane_ids[:] = [state.laneID for state in self._states]
+        self._cursor = 0
+
+    def column(self, name: str) -> np.ndarray:
+        """Read-only view of one State field over the remaining states.
+
+        Args:
+            name (str): State field name, e.g. "x", "vel" or "laneID"
+
+        Returns:
+            np.ndarray: the field values, without copying
+        """
+        self._build_columns()
+        if name == "laneID":
+            view = self._lane_ids[self._cursor:]
+        else:
+            view = self._values[FIELD_INDEX[name], self._cursor:]
+        view.flags.writeable = False
+        return view
 
-    states: list[State] = field(default_factory=list)
-    cost: float = 0.0
+    def copy(self, start: int = 0, stop: int = None) -> Trajectory:
+        """Copy the remaining states[start:stop] in column form, without
+           building State objects or dropping the columns of self.
+
+        Args:
+            start (int, optional): first state to copy. Defaults to 0.
+            stop (int, optional): end of the copy. Defaults to None, the
+                last state.
+
+        Returns:
+            Trajectory: the array-backed copy, with the same cost
+        """
+        self._build_columns()
+        return self._from_values(
+            self._values[:, self._cursor:][:, start:stop].copy(),
+            self._lane_ids[self._cursor:][start:stop].copy(), self.cost)
+
+    def state(self, index: int) -> State:
+        """Copy of the remaining state at index, built from the columns
+           without dropping them."""
+        self._build_columns()
+        return self._make_state(
+            self._values[:, self._cursor:][:, index].tolist(),
+            self._lane_ids[self._cursor:][index])
+
+    def set_state(self, index: int, state: State) -> None:
+        """Replace the remaining state at index in the columns."""
+        self._build_columns()
+        self._states = None
+        index = range(self._cursor, self._values.shape[1])[index]
+        self._values[:, index] = np.array(_NUMERIC_GETTER(state), dtype=float)
+        self._lane_ids[index] = state.laneID
 
     def __len__(self):
-        return len(self.states)
+        if self._states is not None:
+            return len(self._states)
+        return self._values.shape[1] - self._cursor
+
+    def __repr__(self) -> str:
+        return f"Trajectory(len={len(self)}, cost={self.cost})"
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        if self._states is not None:
+            # the columns are only a cache of the states
+            state["_values"], state["_lane_ids"] = None, None
+        return state
+
+    def _pop_index(self) -> int:
+        self._build_columns()
+        # from now on the columns are the only storage
+        self._states = None
+        if self._cursor >= self._values.shape[1]:
+            raise IndexError("pop from empty trajectory")
+        self._cursor += 1
+        return self._cursor - 1
 
     def pop_last_state(self) -> tuple:
         """
         return the last state of the trajectory:
         x, y, yaw, vel, acc, laneID, lanPos
         """
-        last_state = self.states.pop(0)
-        return last_state.x, last_state.y, last_state.yaw, last_state.vel, last_state.acc
+        index = self._pop_index()
+        return tuple(self._values[_POP_INDEX, index].tolist())
 
     def pop_last_state_r(self) -> tuple:
         """
         return the last state of the trajectory for replay model:
         x, y, yaw, vel, acc, laneID, lanPos, routeIdx
         """
-        last_state = self.states.pop(0)
-        return last_state.x, last_state.y, last_state.yaw, last_state.vel, last_state.acc, last_state.laneID, last_state.s, last_state.routeIdx
+        index = self._pop_index()
+        x, y, yaw, vel, acc, s, routeIdx = self._values[_POP_R_INDEX,
+                                                        index].tolist()
+        return x, y, yaw, vel, acc, self._lane_ids[index], s, int(routeIdx)
 
     @property
     def xQueue(self) -> deque[float]:
-        return deque([state.x for state in self.states])
+        return deque(self.column("x").tolist())
 
     @property
     def yQueue(self) -> deque[float]:
-        return deque([state.y for state in self.states])
+        return deque(self.column("y").tolist())
 
     @property
     def yawQueue(self) -> deque[float]:
-        return deque([state.yaw for state in self.states])
+        return deque(self.column("yaw").tolist())
 
     @property
     def velQueue(self) -> deque[float]:
-        return deque([state.vel for state in self.states])
+        return deque(self.column("vel").tolist())
 
     @property
     def accQueue(self) -> deque[float]:
-        return deque([state.acc for state in self.states])
+        return deque(self.column("acc").tolist())
 
     @property
     def laneIDQueue(self) -> deque[str]:
-        return deque([state.laneID for state in self.states])
+        return deque(self.column("laneID").tolist())
 
     @property
     def lanePosQueue(self) -> deque[float]:
-        return deque([state.s for state in self.states])
+        return deque(self.column("s").tolist())
 
     @property
     def routeIdxQueue(self) -> deque[float]:
-        return deque([state.routeIdx for state in self.states])
+        return deque(self.column("routeIdx").astype(int).tolist())
 
     @staticmethod
     def concatenate(list_of_trajectories: list[Trajectory]) -> Trajectory:
@@ -233,95 +412,211 @@ class Trajectory:
         return Trajectory(states, cost)
 
     def concatenate(self, other_traj):
-        if self.states != []:
-            t = self.states[-1].t
-        else:
-            t = 0
-            self.states.append(other_traj.states[0])
-        for i in range(1, len(other_traj.states)):
-            self.states.append(other_traj.states[i])
-            self.states[-1].t += t
+        other_traj._build_columns()
+        other_values = other_traj._values[:, other_traj._cursor:].copy()
+        other_lane_ids = other_traj._lane_ids[other_traj._cursor:]
+        self._build_columns()
+        if len(self) > 0:
+            # the first state of other_traj is the last state of self
+            other_values = other_values[:, 1:]
+            other_lane_ids = other_lane_ids[1:]
+            other_values[FIELD_INDEX["t"]] += self._values[FIELD_INDEX["t"], -1]
+        self._values = np.hstack((self._values[:, self._cursor:], other_values))
+        self._lane_ids = np.concatenate(
+            (self._lane_ids[self._cursor:], other_lane_ids))
+        self._states = None
+        self._cursor = 0
         self.cost += other_traj.cost
 
     def frenet_to_cartesian(self, lanes: list[AbstractLane],
                             init_state: State) -> None:
-        warnings.filterwarnings("error")
-        if not isinstance(lanes, list):
-            lanes = [lanes]
-        lane_idx = 0
-        already_s = 0
-        for i in range(len(self.states)):
-            csp = lanes[lane_idx].course_spline
-            if self.states[i].s - already_s > csp.s[-1] - 0.1:
-                if lane_idx < len(lanes) - 1:
-                    lane_idx += 1
-                    # caution: 0.1 is the overlap length
-                    already_s += csp.s[-1] - 0.1
-                    csp = lanes[lane_idx].course_spline
-                else:
-                    del self.states[i:]
-                    break
-            rx, ry = csp.calc_position(self.states[i].s - already_s)
-            ryaw = csp.calc_yaw(self.states[i].s - already_s)
-            rkappa = csp.calc_curvature(self.states[i].s - already_s)
-            self.states[i].complete_cartesian2D(rx, ry, ryaw, rkappa)
-            self.states[i].laneID = lanes[lane_idx].id
-
-        # deal with all state with state.yaw =none
-        for i in range(len(self.states)):
-            if self.states[i].yaw is None:
-                if i == 0:
-                    self.states[i].yaw = init_state.yaw
-                else:
-                    self.states[i].yaw = self.states[i - 1].yaw
-
-        for i in range(len(self.states)):
-            if len(self.states) == 1:
-                self.states[0].acc = init_state.acc
-                break
-            if i == len(self.states) - 1:
-                self.states[-1].acc = self.states[-2].acc
-            else:
-                self.states[i].acc = (self.states[i + 1].vel - self.states[i].vel
-                                      ) / (self.states[i + 1].t - self.states[i].t)
-
-        # https://blog.csdn.net/m0_37454852/article/details/86514444
-        # https://baike.baidu.com/item/%E6%9B%B2%E7%8E%87/9985286
-        for i in range(1, len(self.states) - 1):
-            try:
-                dy = ((self.states[i + 1].y - self.states[i].y) /
-                      (self.states[i + 1].x - self.states[i].x) +
-                      (self.states[i].y - self.states[i - 1].y) /
-                      (self.states[i].x - self.states[i - 1].x)) / 2
-                ddy = ((self.states[i + 1].y - self.states[i].y) /
-                       (self.states[i + 1].x - self.states[i].x) -
-                       (self.states[i].y - self.states[i - 1].y) /
-                       (self.states[i].x - self.states[i - 1].x)) / (
-                           (self.states[i + 1].x - self.states[i - 1].x) / 2)
-            except RuntimeWarning:
-                self.states[i].cur = 0
-                continue
-            k = abs(ddy) / (1 + dy**2)**1.5
-            self.states[i].cur = k
-        # insert the first and last point
-        if (len(self.states) >= 3):
-            self.states[0].cur = self.states[1].cur
-            self.states[-1].cur = self.states[-2].cur
-
-        return
+        self._build_columns()
+        batch = TrajectoryBatch(
+            self._values[:, np.newaxis, self._cursor:].copy(),
+            self._lane_ids[np.newaxis, self._cursor:].copy())
+        batch.frenet_to_cartesian(lanes, init_state)
+        size = batch.sizes[0]
+        self._values = batch.values[:, 0, :size]
+        self._lane_ids = batch.lane_ids[0, :size]
+        self._states, self._cursor = None, 0
 
     def cartesian_to_frenet(self, csp: Spline2D) -> None:
         """
         Where s is by default monotonically increasing in the direction of the trajectory, and only the s,s',d,d' coordinates are updated
         """
+        rs = csp.find_nearest_rs_batch(
+            np.array([state.x for state in self.states], dtype=float),
+            np.array([state.y for state in self.states], dtype=float))
+
+        # Step 2: cartesian_to_frenet1D
+        rx, ry = csp.calc_position_batch(rs)
+        ryaw = csp.calc_yaw_batch(rs)
+        rkappa = csp.calc_curvature_batch(rs)
         for index, state in enumerate(self.states):
-            rs = csp.find_nearest_rs(state.x, state.y)
-
-            # Step 2: cartesian_to_frenet1D
-            rx, ry = csp.calc_position(rs)
-            ryaw = csp.calc_yaw(rs)
-            rkappa = csp.calc_curvature(rs)
-            state.complete_frenet2D(rs, rx, ry, ryaw, rkappa)
+            state.complete_frenet2D(rs[index], rx[index], ry[index],
+                                    ryaw[index], rkappa[index])
 
     def is_nonholonomic(self) -> bool:
         return all([state.s_d < 1.5 * state.d_d] for state in self.states)
+
+
+class TrajectoryBatch:
+    """Candidate trajectories sampled at the same times.
+
+    Every State field is a (N, M) array, row i holds candidate i. Rows can
+    be shorter than M after frenet_to_cartesian drops the states beyond the
+    last lane: only the first sizes[i] states of row i are valid, see mask.
+    """
+
+    def __init__(self, values: np.ndarray, lane_ids: np.ndarray,
+                 sizes: np.ndarray = None) -> None:
+        self.values = values  # shape (len(NUMERIC_FIELDS), N, M)
+        self.lane_ids = lane_ids  # shape (N, M), dtype object
+        self.sizes = (np.full(lane_ids.shape[0], lane_ids.shape[1])
+                      if sizes is None else sizes)
+
+    @classmethod
+    def from_columns(cls, **columns) -> TrajectoryBatch:
+        """Build a batch from (N, M) arrays keyed by State field names, see
+           Trajectory.from_columns."""
+        shape = np.shape(next(iter(columns.values())))
+        return cls(*_values_from_columns(columns, shape))
+
+    @classmethod
+    def stack(cls, trajectories: list[Trajectory]) -> TrajectoryBatch:
+        """Stack trajectories of different lengths into a batch, the rows of
+           the shorter ones are padded with nan."""
+        sizes = np.array([len(trajectory) for trajectory in trajectories],
+                         dtype=int)
+        steps = sizes.max(initial=0)
+        values = np.full((len(NUMERIC_FIELDS), len(trajectories), steps),
+                         np.nan)
+        lane_ids = np.full((len(trajectories), steps), None, dtype=object)
+        for i, trajectory in enumerate(trajectories):
+            trajectory._build_columns()
+            cursor = trajectory._cursor
+            values[:, i, :sizes[i]] = trajectory._values[:, cursor:]
+            lane_ids[i, :sizes[i]] = trajectory._lane_ids[cursor:]
+        return cls(values, lane_ids, sizes)
+
+    def __len__(self):
+        return self.lane_ids.shape[0]
+
+    def column(self, name: str) -> np.ndarray:
+        """(N, M) view of one State field, only valid where self.mask is."""
+        if name == "laneID":
+            return self.lane_ids
+        return self.values[FIELD_INDEX[name]]
+
+    @property
+    def mask(self) -> np.ndarray:
+        return np.arange(self.lane_ids.shape[1]) < self.sizes[:, np.newaxis]
+
+    def trajectory(self, index: int, cost: float = 0.0) -> Trajectory:
+        """Copy candidate index out of the batch."""
+        size = self.sizes[index]
+        return Trajectory._from_values(
+            self.values[:, index, :size].copy(),
+            self.lane_ids[index, :size].copy(), cost)
+
+    def frenet_to_cartesian(self, lanes: list[AbstractLane],
+                            init_state: State | list[State]) -> None:
+        """Convert the frenet states along the lanes to cartesian ones. The
+           initial state gives the yaw of the states that do not move and
+           the acc of a single state, either for all rows or one per row."""
+        if not isinstance(lanes, list):
+            lanes = [lanes]
+        init_states = (init_state if isinstance(init_state, list) else
+                       [init_state] * len(self))
+        init_yaw = np.array([np.nan if state.yaw is None else state.yaw
+                             for state in init_states], dtype=float)
+        init_acc = np.array([state.acc for state in init_states], dtype=float)
+        t, s, d = (self.values[FIELD_INDEX[name]] for name in ("t", "s", "d"))
+        rows, steps = np.arange(len(self)), np.arange(s.shape[1])
+
+        # split the states by lane, a state moves to the next lane once its
+        # local s passes the end of the current lane, and the states beyond
+        # the last lane are dropped
+        # caution: 0.1 is the overlap length
+        state_lane_idx = np.zeros(s.shape, dtype=int)
+        lane_starts = np.zeros(len(lanes))
+        start = np.zeros(len(self), dtype=int)
+        moving_on = self.mask
+        for lane_idx, lane in enumerate(lanes):
+            state_lane_idx[moving_on & (steps >= start[:, np.newaxis])] = lane_idx
+            lane_end = lane_starts[lane_idx] + lane.course_spline.s[-1] - 0.1
+            # the state that entered this lane is not checked again
+            checked = start + 1 if lane_idx > 0 else start
+            moving_on = (moving_on & (steps >= checked[:, np.newaxis]) &
+                         (s > lane_end))
+            overflow = moving_on.any(axis=1)
+            start = np.where(overflow, moving_on.argmax(axis=1), start)
+            if not overflow.any():
+                break
+            if lane_idx == len(lanes) - 1:
+                self.sizes = np.where(overflow, start, self.sizes)
+                break
+            lane_starts[lane_idx + 1] = lane_end
+            moving_on = overflow[:, np.newaxis] & self.mask
+        valid = self.mask
+        local_s = s - lane_starts[state_lane_idx]
+
+        # evaluate the reference line of every lane once for all its states
+        rx, ry, ryaw, rkappa = np.full((4, ) + s.shape, np.nan)
+        self.lane_ids = np.full(s.shape, None, dtype=object)
+        for lane_idx in np.unique(state_lane_idx[valid]):
+            lane_mask = valid & (state_lane_idx == lane_idx)
+            (rx[lane_mask], ry[lane_mask], ryaw[lane_mask], rkappa[lane_mask],
+             _) = lanes[lane_idx].course_spline.calc_reference_batch(
+                 local_s[lane_mask])
+            self.lane_ids[lane_mask] = lanes[lane_idx].id
+
+        # same as State.complete_cartesian2D
+        s_d, d_d = self.values[FIELD_INDEX["s_d"]], self.values[FIELD_INDEX["d_d"]]
+        x = rx - np.sin(ryaw) * d
+        y = ry + np.cos(ryaw) * d
+        moving = valid & (s_d > 1e-1)
+        s_d[valid & ~moving] = 1e-1
+        vel = np.where(
+            moving, np.sqrt((1 - rkappa * d)**2 * s_d**2 + d_d**2), 1e-1)
+        yaw = np.full(s.shape, np.nan)
+        yaw[moving] = np.arcsin(d_d[moving] / vel[moving]) + ryaw[moving]
+        # a state without yaw takes the one of the previous state
+        previous = np.maximum.accumulate(np.where(moving, steps, -1), axis=1)
+        yaw = np.where(
+            previous >= 0,
+            np.take_along_axis(yaw, np.maximum(previous, 0), axis=1),
+            init_yaw[:, np.newaxis])
+
+        acc = np.empty(s.shape)
+        acc[:, :-1] = np.diff(vel, axis=1) / np.diff(t, axis=1)
+        last = self.sizes - 1
+        several = self.sizes > 1
+        acc[rows[several], last[several]] = acc[rows[several],
+                                                last[several] - 1]
+        acc[self.sizes == 1, 0] = init_acc[self.sizes == 1]
+
+        # https://blog.csdn.net/m0_37454852/article/details/86514444
+        # https://baike.baidu.com/item/%E6%9B%B2%E7%8E%87/9985286
+        cur = self.values[FIELD_INDEX["cur"]]
+        if s.shape[1] >= 3:
+            dx, dy = np.diff(x, axis=1), np.diff(y, axis=1)
+            with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                slope = dy / dx
+                first = (slope[:, 1:] + slope[:, :-1]) / 2
+                second = (slope[:, 1:] - slope[:, :-1]) / (
+                    (x[:, 2:] - x[:, :-2]) / 2)
+                k = np.abs(second) / (1 + first**2)**1.5
+            # the curvature is 0 where the finite differences degenerate
+            k = np.where(np.isfinite(first) & np.isfinite(second), k, 0)
+            inner = (steps[1:-1] < last[:, np.newaxis])
+            cur[:, 1:-1][inner] = k[inner]
+            # insert the first and last point
+            long_rows = rows[self.sizes >= 3]
+            cur[long_rows, 0] = cur[long_rows, 1]
+            cur[long_rows, last[long_rows]] = cur[long_rows,
+                                                  last[long_rows] - 1]
+
+        for name, column in (("x", x), ("y", y), ("yaw", yaw), ("vel", vel),
+                             ("acc", acc)):
+            self.values[FIELD_INDEX[name]] = column